@@ -4,33 +4,123 @@
 # https://s3.us-east-2.amazonaws.com/prettyprinted/flask_cheatsheet.pdf
 #----------------------------------------------------------------------------#
 
+# Imports only the web workers need on every request are made here. Heavier ones that
+# a few code paths use (babel, dateutil, the forms and WTForms) are imported where
+# they are used, so a fresh worker starts faster.
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
-from flask_moment import Moment
+from flask import Flask, Blueprint, render_template, stream_template, request, Response, flash, redirect, url_for, abort, jsonify, make_response, stream_with_context, g, session, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
-from flask_migrate import Migrate
+from logging.handlers import QueueHandler, QueueListener
+import queue
+from cache import PageCache
+from metrics import RequestMetrics
+from assets import Assets
+from streaming import Compression, buffered, peek
+from geo import Gazetteer, build_gazetteer, grid_cell, cell_ranges, haversine_km
+from matching import Candidates, best, owner_profile
+from typeahead import Typeahead
+from jobs import JobQueue
+from importer import read_rows, chunked, copy_rows
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy import exc
-
-from datetime import datetime
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+from werkzeug.datastructures import MultiDict
+import click
+import os
+import sqlite3
+import time
+
+from datetime import datetime, timedelta
+import calendar
 import re
 from operator import itemgetter 
+from itertools import groupby
+import heapq
+from bisect import bisect_right, insort
+from functools import lru_cache, wraps
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 app = Flask(__name__)
-moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+
+# Compiled templates are kept on disk, so a new worker loads them instead of compiling
+# every template again. `flask precompile-templates` fills the cache at deploy time.
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+  # makes its directory when it first writes there, importing the app creates nothing
+  def dump_bytecode(self, bucket):
+    os.makedirs(self.directory, exist_ok=True)
+    super().dump_bytecode(bucket)
+
+if app.config.get('JINJA_BYTECODE_CACHE_DIR'):
+  app.jinja_env.bytecode_cache = TemplateBytecodeCache(
+    os.path.join(app.instance_path, app.config['JINJA_BYTECODE_CACHE_DIR'])
+  )
+
+class RoutingSession(Session):
+  # Sends the queries of read-only views (see read_only) to the replica bind when one
+  # is configured. Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+  def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+    if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+        and has_app_context() and g.get('use_replica') and 'replica' in self._db.engines):
+      return self._db.engines['replica']
+    return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+@db.event.listens_for(Engine, 'connect')
+def sqlite_foreign_keys(dbapi_connection, connection_record):
+  # SQLite only enforces foreign keys, and so runs the ON DELETE CASCADEs, when asked to
+  # on every connection
+  if isinstance(dbapi_connection, sqlite3.Connection):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+def read_only(view):
+  # Lets a view read from the replica, unless this client wrote something moments ago
+  # and the replica may not have it yet
+  @wraps(view)
+  def wrapper(**kwargs):
+    g.use_replica = session.get('read_primary_until', 0) < time.time()
+    return view(**kwargs)
+  return wrapper
+
+@db.event.listens_for(RoutingSession, 'after_commit')
+def read_your_writes(db_session):
+  # keep this client on the primary for a while after it wrote, so the page it is
+  # redirected to shows the change
+  if has_request_context() and 'replica' in app.config.get('SQLALCHEMY_BINDS', {}):
+    session['read_primary_until'] = time.time() + app.config['READ_YOUR_WRITES_SECONDS']
 
 # define migrate
-migrate = Migrate(app, db)
+# Flask-Migrate brings in all of Alembic, which takes longer to import than the rest of
+# the app and is only used by `flask db`. The flask command loads the app from inside
+# a click context, web workers don't.
+if click.get_current_context(silent=True) is not None:
+  from flask_migrate import Migrate
+  migrate = Migrate(app, db)
+
+# rendered page cache for the read-only views, see cache.py
+page_cache = PageCache()
+page_cache.init_app(app)
+
+# per-request SQL/render timing, Server-Timing headers and /metrics, see metrics.py
+request_metrics = RequestMetrics(app, db)
+
+# hashed, bundled and precompressed static files once `flask build-assets` ran, see assets.py
+assets = Assets(app)
+
+# gzip/brotli for HTML and JSON, including streamed pages, see streaming.py
+compression = Compression(app)
+
+# venue coordinates by city or ZIP code, see geo.py
+gazetteer = Gazetteer(app.config['GAZETTEER_PATH'])
 # TODO: connect to a local postgresql database
 
 #----------------------------------------------------------------------------#
@@ -42,22 +132,43 @@ class Genre(db.Model):
     __tablename__ = 'Genre'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, index=True, unique=True)
 
+# The (genre_id, X_id) primary key only serves lookups by genre, the reversed
+# index serves loading the genres of one artist or venue. Deleting an artist or venue
+# deletes its links in the database.
 artist_genre_table = db.Table('artist_genre_table',
     db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
-    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True)
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genre_table_artist_id_genre_id', 'artist_id', 'genre_id')
 )
 
 venue_genre_table = db.Table('venue_genre_table',
     db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
-    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True)
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genre_table_venue_id_genre_id', 'venue_id', 'genre_id')
 )
     
     
+# Venues and artists with deleted_at set were soft deleted (see SOFT_DELETE) and are left
+# out of every listing. The listings read them through partial indexes that only hold
+# the rows still shown.
+LIVE = 'deleted_at IS NULL'
+
 # Venue is the parent (one-to-many) of a Show (Artist is also a foreign key, in def. of Show)
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        # the directory on /venues
+        db.Index('ix_Venue_live_state_city_name', 'state', 'city', 'name',
+                 postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE)),
+        # radius searches on /venues/near
+        db.Index('ix_Venue_live_geocell', 'geocell',
+                 postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE)),
+        # /venues?seeking=yes, alone or with a state
+        db.Index('ix_Venue_live_seeking_talent_state_city', 'seeking_talent', 'state', 'city',
+                 postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE)),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -74,8 +185,16 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120))
+    deleted_at = db.Column(db.DateTime)
+
+    # from the gazetteer, None when it doesn't know the place. geocell is the grid cell
+    # of the coordinates, see geo.py.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geocell = db.Column(db.BigInteger)
 
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    # the database deletes the shows along with the venue
+    shows = db.relationship('Show', backref='venue', lazy=True, passive_deletes=True)
 
     def __repr__(self):
         return f'<Venue {self.id} {self.name}>'
@@ -83,6 +202,16 @@ class Venue(db.Model):
 # Artist is the parent (one-to-many) of a Show (Venue is also a foreign key, in def. of Show)
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        # the list on /artists
+        db.Index('ix_Artist_live_name_id', 'name', 'id',
+                 postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE)),
+        # /artists?state=...&city=... and /artists?seeking=yes
+        db.Index('ix_Artist_live_state_city', 'state', 'city',
+                 postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE)),
+        db.Index('ix_Artist_live_seeking_venue_state', 'seeking_venue', 'state',
+                 postgresql_where=db.text(LIVE), sqlite_where=db.text(LIVE)),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -99,40 +228,980 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120))
+    deleted_at = db.Column(db.DateTime)
 
-    shows = db.relationship('Show', backref='artist', lazy=True)   
+    shows = db.relationship('Show', backref='artist', lazy=True, passive_deletes=True)
 
     def __repr__(self):
         return f'<Artist {self.id} {self.name}>'
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+def default_end_time(context):
+  return context.get_current_parameters()['start_time'] + timedelta(minutes=app.config['DEFAULT_SHOW_MINUTES'])
+
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # per-venue / per-artist show lists and upcoming counts
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        # keyset pagination on /shows
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)   
+    end_time = db.Column(db.DateTime, nullable=False, default=default_end_time)
 
     # Foreign key is the tablename.pk
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)   
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    # the venue or the artist was soft deleted: the show is listed nowhere and doesn't
+    # block its slot any more
+    hidden = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     def __repr__(self):
         return f'<Show {self.id} {self.start_time} artist_id={artist_id} venue_id={venue_id}>'
 
+# Postgres rejects overlapping bookings of a venue or an artist with exclusion
+# constraints. Elsewhere only the check in create_show_submission guards against them.
+# The migration applies the same constraints to shows starting after it ran. Hidden
+# shows are left out, as they are by booking_conflict.
+def booking_constraint_ddl(column, where=''):
+  return (f'ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{column}_booking" '
+          f'EXCLUDE USING gist ({column} WITH =, tsrange(start_time, end_time) WITH &&){where}')
+
+db.event.listen(Show.__table__, 'after_create',
+                db.DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+for column in ('venue_id', 'artist_id'):
+  db.event.listen(Show.__table__, 'after_create',
+                  db.DDL(booking_constraint_ddl(column, ' WHERE (NOT hidden)')).execute_if(dialect='postgresql'))
+
+# Materialized show counts per venue and per artist, so listings don't aggregate Show
+# rows. A show is upcoming while its start_time is after ShowCountSweep.swept_at; the
+# sweep-shows job (every SWEEP_SHOWS_SECONDS, or `flask sweep-shows`) moves that
+# watermark forward and shifts the shows that started in between from upcoming to past.
+# Owners without shows have no row.
+class VenueShowCount(db.Model):
+    __tablename__ = 'VenueShowCount'
+
+    owner_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+    upcoming_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # the sweep only visits owners whose next show has started
+    next_show_time = db.Column(db.DateTime, index=True)
+
+class ArtistShowCount(db.Model):
+    __tablename__ = 'ArtistShowCount'
+
+    owner_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    upcoming_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
+
+class ShowCountSweep(db.Model):
+    __tablename__ = 'ShowCountSweep'
+
+    # a single row, id 1
+    id = db.Column(db.Integer, primary_key=True)
+    swept_at = db.Column(db.DateTime, nullable=False)
+
+# Show foreign key -> counter table
+SHOW_COUNTERS = {
+    'venue_id': VenueShowCount,
+    'artist_id': ArtistShowCount
+}
+
+# Suggested matches between artists seeking a venue and venues seeking talent, scored
+# by matching.py. The MATCH_SUGGESTIONS best matches of every artist and of every venue
+# are kept, a pair once when it is on the lists of both. Lists are brought up to date
+# by refresh_matches whenever genres, places, seeking flags or shows change, in a
+# background job after a web form (defer_refresh_matches).
+class Match(db.Model):
+    __tablename__ = 'Match'
+    __table_args__ = (
+        # the suggestions on a venue page, the primary key serves those on an artist page
+        db.Index('ix_Match_venue_id_score', 'venue_id', 'score'),
+    )
+
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+# Match column -> (model, genre links, seeking flag) of that side of a match
+MATCH_SIDES = {
+    'artist_id': (Artist, artist_genre_table, Artist.seeking_venue),
+    'venue_id': (Venue, venue_genre_table, Venue.seeking_talent)
+}
+
+# Work deferred from the request that caused it to a background worker, see jobs.py.
+# Rows are kept once done, for /jobs/stats, and purged after JOBS_KEEP_DAYS.
+class Job(db.Model):
+    __tablename__ = 'Job'
+    __table_args__ = (
+        # what workers poll for
+        db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+        # one job per key waiting to run
+        db.Index('ix_Job_key', 'key', unique=True,
+                 postgresql_where=db.text("status = 'queued'"), sqlite_where=db.text("status = 'queued'")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    key = db.Column(db.String(200))
+    # queued, running, done or failed
+    status = db.Column(db.String(10), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # seconds the last attempt took
+    duration = db.Column(db.Float)
+    error = db.Column(db.Text)
+
+jobs = JobQueue(app, db, Job, request_metrics)
+
+# Name search indexes. Postgres gets a pg_trgm GIN index, which ILIKE '%term%' can use;
+# SQLite gets an FTS5 trigram side table kept in sync by triggers. The same statements
+# are applied by the migration, these hooks cover databases built with db.create_all().
+def name_search_ddl(table):
+  fts = f'{table.lower()}_name_fts'
+  postgresql = [
+      'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+      f'CREATE INDEX IF NOT EXISTS "ix_{table}_name_trgm" ON "{table}" USING gin (name gin_trgm_ops)',
+  ]
+  sqlite = [
+      f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(name, content='{table}', content_rowid='id', tokenize='trigram')",
+      f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{table}" BEGIN '
+      f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+      f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{table}" BEGIN '
+      f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END",
+      f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name ON "{table}" BEGIN '
+      f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+      f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+      f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+  ]
+  return {'postgresql': postgresql, 'sqlite': sqlite}
+
+for model in (Venue, Artist):
+  for dialect, statements in name_search_ddl(model.__tablename__).items():
+    for statement in statements:
+      db.event.listen(model.__table__, 'after_create', db.DDL(statement).execute_if(dialect=dialect))
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+
+@lru_cache(maxsize=None)
+def datetime_pattern(locale, format):
+  # Babel patterns are compiled once per (locale, format) instead of on every call
+  from babel import Locale
+  from babel.dates import LC_TIME, parse_pattern
+  return Locale.parse(locale or LC_TIME), parse_pattern(DATETIME_FORMATS.get(format, format))
+
+def format_datetime(value, format='medium', locale=None):
+  # Takes datetime objects as they come out of the database. Strings are still
+  # accepted, but they cost a full dateutil parse. locale defaults to LC_TIME.
+  if isinstance(value, str):
+    import dateutil.parser
+    value = dateutil.parser.parse(value)
+  locale, pattern = datetime_pattern(locale, format)
+  return pattern.apply(value, locale)
 # this filter helper that used at the show page. It makes it user interactivity interesting.
 app.jinja_env.filters['datetime'] = format_datetime
 
+def filter_url(name, value):
+  # the current listing with one filter value added, or taken away when it is set
+  args = request.args.to_dict(flat=False)
+  values = args.get(name, [])
+  args[name] = [v for v in values if v != value] if value in values else values + [value]
+  return url_for(request.endpoint, **args)
+app.jinja_env.globals['filter_url'] = filter_url
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def live_shows(query):
+  # Restricts a query on Show to the shows whose venue and artist were not soft deleted
+  return query.join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id).filter(
+    Venue.deleted_at.is_(None), Artist.deleted_at.is_(None)
+  )
+
+def escape_like(term):
+  # Escapes LIKE wildcards in user input. The ESCAPE clause is only requested when
+  # something was escaped, as SQLite's trigram index can't serve patterns that carry one.
+  escaped = re.sub(r'([\\%_])', r'\\\1', term)
+  return escaped, ('\\' if escaped != term else None)
+
+def name_matches(model, term):
+  escaped, escape = escape_like(term)
+  pattern = '%' + escaped + '%'
+  if db.session.get_bind().dialect.name == 'sqlite':
+    fts = db.table(f'{model.__tablename__.lower()}_name_fts', db.column('rowid'), db.column('name'))
+    return model.id.in_(db.select(fts.c.rowid).where(fts.c.name.like(pattern, escape=escape)))
+  # using ilike operator instead of like operator to match case insensitive
+  return model.name.ilike(pattern, escape=escape)
+
+def search_by_name(model, counter, term, page, per_page):
+  # Returns one page of matches for term, best matches first, as
+  # (total, [{"id", "name", "num_upcoming_shows"}]). The total comes from a window
+  # count and the upcoming counts from the counter table, so it is a single round trip.
+  escaped, escape = escape_like(term)
+  relevance = db.case(
+      (db.func.lower(model.name) == term.lower(), 0),
+      (model.name.ilike(escaped + '%', escape=escape), 1),
+      (model.name.ilike('% ' + escaped + '%', escape=escape), 2),
+      else_=3
+  )
+  query = db.session.query(
+      model.id, model.name, db.func.coalesce(counter.upcoming_shows, 0), db.func.count().over()
+  ).outerjoin(
+      counter, counter.owner_id == model.id
+  ).filter(
+      name_matches(model, term), model.deleted_at.is_(None)
+  )
+  rows = query.order_by(relevance, model.name, model.id).limit(per_page).offset((page - 1) * per_page).all()
+
+  if rows:
+    total = rows[0][3]
+  elif page > 1:
+    # Past the last page the window count has no row to ride on
+    total = query.count()
+  else:
+    total = 0
+  return total, [{
+      "id": row_id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming
+  } for row_id, name, num_upcoming, _ in rows]
+
+def search_response(model, counter):
+  search_term = request.values.get('search_term', '').strip()
+  page = max(request.values.get('page', 1, type=int), 1)
+  per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+  total, data = search_by_name(model, counter, search_term, page, per_page)
+  response = {
+      "count": total,
+      "data": data,
+      "page": page,
+      "pages": (total + per_page - 1) // per_page
+  }
+  return response, search_term
+
+def venue_location(city, state, address):
+  # the coordinate columns of a venue, all None when the gazetteer doesn't know the place
+  point = gazetteer.locate(city, state, address)
+  if point is None:
+    return {'latitude': None, 'longitude': None, 'geocell': None}
+  return {'latitude': point[0], 'longitude': point[1], 'geocell': grid_cell(*point)}
+
+def venues_near(latitude, longitude, km, limit):
+  # The venues within km of a point, nearest first, as (total, [{..., "distance_km"}]).
+  # Only the grid cells around the point are read, each as a range of the geocell index,
+  # and the venues in them are then measured exactly. The ranges are a UNION ALL rather
+  # than an OR, which SQLite answers with a scan of the whole index.
+  rows = db.session.execute(db.union_all(*[db.select(
+      Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude,
+      db.func.coalesce(VenueShowCount.upcoming_shows, 0)
+  ).outerjoin(
+      VenueShowCount, VenueShowCount.owner_id == Venue.id
+  ).where(
+      Venue.geocell >= low, Venue.geocell < high, Venue.deleted_at.is_(None)
+  ) for low, high in cell_ranges(latitude, longitude, km)])).all()
+
+  matches = []
+  for venue_id, name, city, state, venue_latitude, venue_longitude, num_upcoming in rows:
+    distance = haversine_km(latitude, longitude, venue_latitude, venue_longitude)
+    if distance <= km:
+      matches.append((distance, venue_id, name, city, state, num_upcoming))
+  matches.sort()
+  return len(matches), [{
+      "id": venue_id,
+      "name": name,
+      "city": city,
+      "state": state,
+      "distance_km": round(distance, 2),
+      "num_upcoming_shows": num_upcoming
+  } for distance, venue_id, name, city, state, num_upcoming in matches[:limit]]
+
+# Filters of the /venues and /artists listings, by query string parameter. Several
+# values of one filter match any of them, different filters must all match.
+LISTING_FILTERS = ('genre', 'state', 'city', 'seeking')
+
+def listing_filters(model, association, owner_column, seeking_column):
+  # (criteria, selected filter values) for the filters in the query string. criteria
+  # maps each filter in use to its condition, and 'live' to the one always applied.
+  selected = {name: request.args.getlist(name) for name in LISTING_FILTERS if request.args.getlist(name)}
+  criteria = {'live': model.deleted_at.is_(None)}
+  if 'genre' in selected:
+    # through the (genre_id, owner) primary key of the association table
+    criteria['genre'] = model.id.in_(db.select(association.c[owner_column]).join(
+      Genre, Genre.id == association.c.genre_id
+    ).where(Genre.name.in_(selected['genre'])))
+  if 'state' in selected:
+    criteria['state'] = model.state.in_(selected['state'])
+  if 'city' in selected:
+    criteria['city'] = model.city.in_(selected['city'])
+  if 'seeking' in selected:
+    seeking = [value == 'yes' for value in selected['seeking'] if value in ('yes', 'no')]
+    if seeking == [True]:
+      criteria['seeking'] = seeking_column.is_(True)
+    elif seeking == [False]:
+      criteria['seeking'] = seeking_column.isnot(True)
+  return criteria, selected
+
+def facet_counts(model, association, owner_column, seeking_column, criteria):
+  # How many venues (or artists) each genre, state, city and seeking value would list,
+  # plus the total listed, as {facet: [(value, count)]}. A facet is counted with every
+  # filter but its own applied, so the values a filter in use leaves out keep their
+  # counts and can be added to it (the values of one filter are ORed). The rows are
+  # selected as materialized CTEs: all filters for the total and the facets without a
+  # filter of their own, and one branch per filter in use that leaves it out. Each
+  # facet is a GROUP BY over its branch, all in one statement. Genres are counted over
+  # the genre links of the rows, (genre, owner) pairs are unique.
+  def matching(name, without=None):
+    return db.select(
+      model.id, model.state, model.city,
+      db.case((seeking_column.is_(True), 'yes'), else_='no').label('seeking')
+    ).where(*(condition for facet, condition in criteria.items() if facet != without)).cte(name).prefix_with('MATERIALIZED')
+  matches = matching('matches')
+  branches = {facet: matching(f'matches_without_{facet}', facet) if facet in criteria else matches
+              for facet in LISTING_FILTERS}
+  owners = db.func.count()
+  query = db.union_all(
+    db.select(db.literal('total'), db.literal(None, db.String), owners).select_from(matches),
+    *(db.select(db.literal(facet), branches[facet].c[facet], owners).group_by(branches[facet].c[facet])
+      for facet in ('state', 'city', 'seeking')),
+    db.select(db.literal('genre'), Genre.name, owners).select_from(branches['genre']).join(
+      association, association.c[owner_column] == branches['genre'].c.id
+    ).join(
+      Genre, Genre.id == association.c.genre_id
+    ).group_by(Genre.name)
+  )
+  facets = {name: [] for name in ('total',) + LISTING_FILTERS}
+  for facet, value, count in db.session.execute(query):
+    if value is not None or facet == 'total':
+      facets[facet].append((value, count))
+  for name in LISTING_FILTERS:
+    facets[name].sort(key=lambda item: (-item[1], item[0]))
+  facets['total'] = facets['total'][0][1] if facets['total'] else 0
+  return facets
+
+def encode_show_cursor(start_time, show_id):
+  return f'{start_time.isoformat()}_{show_id}'
+
+def decode_show_cursor(cursor):
+  # cursors are "<start_time iso>_<show id>", the sort key of the last row on a page
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+  except ValueError:
+    abort(400)
+
+def booking_conflict(venue_id, artist_id, start_time, end_time):
+  # The first show overlapping [start_time, end_time) at the venue or for the artist, if
+  # any. No show lasts longer than MAX_SHOW_MINUTES, so only shows starting within that
+  # long before end_time can overlap. That keeps each lookup a short range scan of the
+  # (venue_id, start_time) or (artist_id, start_time) index, however many shows there are.
+  # Hidden shows, of a soft deleted venue or artist, don't count.
+  earliest = start_time - timedelta(minutes=app.config['MAX_SHOW_MINUTES'])
+  for show_fk, owner_id in ((Show.venue_id, venue_id), (Show.artist_id, artist_id)):
+    show = Show.query.filter(
+      show_fk == owner_id, Show.start_time > earliest, Show.start_time < end_time, Show.end_time > start_time,
+      Show.hidden.is_(False)
+    ).order_by(Show.start_time).first()
+    if show is not None:
+      return show
+  return None
+
+def booking_conflicts(rows):
+  # booking_conflict for a chunk of new shows ({"venue_id", "artist_id", "start_time",
+  # "end_time"} dicts), each checked against the database and against the rows before
+  # it that were not in conflict themselves. Returns, per row, None or the conflict as
+  # (fk, show id, row index, start_time, end_time), with the show id for a show in the
+  # database and the row index for an earlier row. The shows of the chunk's venues and
+  # artists around its dates are read with one query per side.
+  longest = timedelta(minutes=app.config['MAX_SHOW_MINUTES'])
+  earliest = min(row['start_time'] for row in rows) - longest
+  latest = max(row['end_time'] for row in rows)
+  # (fk, owner id) -> [(start_time, end_time, show id, row index)] ordered by start_time
+  booked = {}
+  for fk in ('venue_id', 'artist_id'):
+    show_fk = getattr(Show, fk)
+    for show_id, owner_id, start_time, end_time in db.session.execute(db.select(
+      Show.id, show_fk, Show.start_time, Show.end_time
+    ).where(
+      show_fk.in_({row[fk] for row in rows}), Show.start_time > earliest, Show.start_time < latest,
+      Show.hidden.is_(False)
+    ).order_by(Show.start_time)):
+      booked.setdefault((fk, owner_id), []).append((start_time, end_time, show_id, None))
+
+  conflicts = []
+  for index, row in enumerate(rows):
+    conflict = None
+    for fk in ('venue_id', 'artist_id'):
+      shows = booked.get((fk, row[fk]), [])
+      position = bisect_right(shows, row['start_time'] - longest, key=itemgetter(0))
+      while conflict is None and position < len(shows) and shows[position][0] < row['end_time']:
+        start_time, end_time, show_id, other = shows[position]
+        if end_time > row['start_time']:
+          conflict = (fk, show_id, other, start_time, end_time)
+        position += 1
+      if conflict is not None:
+        break
+    if conflict is None:
+      for fk in ('venue_id', 'artist_id'):
+        insort(booked.setdefault((fk, row[fk]), []), (row['start_time'], row['end_time'], None, index),
+               key=itemgetter(0))
+    conflicts.append(conflict)
+  return conflicts
+
+def shows_split_at():
+  # Where the detail pages split upcoming from past shows: the watermark the counters
+  # are relative to, so a page lists as many upcoming shows as its header counts
+  return db.session.query(ShowCountSweep.swept_at).filter(ShowCountSweep.id == 1).scalar() or datetime.now()
+
+def show_counts(counter, owner_id):
+  # (upcoming, past) show counts of one venue or artist, read from its counter row
+  return db.session.query(
+      counter.upcoming_shows, counter.past_shows
+  ).filter(counter.owner_id == owner_id).first() or (0, 0)
+
+def show_tiles(show_fk, owner_id, other, other_fk, when, now, cursor=None):
+  # One page of the upcoming or past shows of a venue (or artist), with the name and
+  # image of the artist (or venue) playing it joined in. Returns (tiles, next_cursor).
+  prefix = other.__tablename__.lower()
+  limit = app.config['DETAIL_SHOWS_PER_PAGE']
+  query = db.session.query(
+      Show.id, Show.start_time, other.id, other.name, other.image_link
+  ).join(
+      other, other_fk == other.id
+  ).filter(
+      show_fk == owner_id, other.deleted_at.is_(None)
+  )
+  key = db.tuple_(Show.start_time, Show.id)
+  if when == 'upcoming':
+    query = query.filter(Show.start_time > now).order_by(Show.start_time, Show.id)
+    if cursor:
+      query = query.filter(key > decode_show_cursor(cursor))
+  else:
+    query = query.filter(Show.start_time <= now).order_by(Show.start_time.desc(), Show.id.desc())
+    if cursor:
+      query = query.filter(key < decode_show_cursor(cursor))
+
+  rows = query.limit(limit + 1).all()
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_cursor = encode_show_cursor(rows[-1][1], rows[-1][0])
+
+  tiles = [{
+      prefix + "_id": other_id,
+      prefix + "_name": name,
+      prefix + "_image_link": image_link,
+      "start_time": start_time
+  } for _, start_time, other_id, name, image_link in rows]
+  return tiles, next_cursor
+
+def more_shows_response(show_fk, owner_id, other, other_fk):
+  # JSON page of shows for the "load more" buttons on the detail pages
+  when = request.args.get('when', 'past')
+  if when not in ('upcoming', 'past'):
+    abort(404)
+  tiles, next_cursor = show_tiles(show_fk, owner_id, other, other_fk, when, shows_split_at(), request.args.get('after'))
+  for tile in tiles:
+    tile['start_time'] = format_datetime(tile['start_time'], 'full')
+  return jsonify({
+    'shows': tiles,
+    'next': url_for(request.endpoint, when=when, after=next_cursor, **request.view_args) if next_cursor else None
+  })
+
+# Genre name -> id, filled from the database and emptied whenever genres get inserted.
+# Genres are never renamed or deleted, so ids read from a committed row stay valid.
+genre_ids = {}
+
+def insert_ignoring_duplicates(table, rows, index_elements):
+  # INSERT ... ON CONFLICT DO NOTHING where the dialect has it
+  dialect = db.session.get_bind().dialect.name
+  if dialect == 'postgresql':
+    from sqlalchemy.dialects.postgresql import insert
+  elif dialect == 'sqlite':
+    from sqlalchemy.dialects.sqlite import insert
+  else:
+    return db.session.execute(table.insert(), rows)
+  return db.session.execute(insert(table).on_conflict_do_nothing(index_elements=index_elements), rows)
+
+def resolve_genre_ids(names):
+  # Maps genre names to ids with at most one IN query and one upsert, creating missing
+  # genres. The unique index on Genre.name makes concurrent creates of one genre safe.
+  names = list(dict.fromkeys(names))
+  ids = {name: genre_ids[name] for name in names if name in genre_ids}
+  missing = [name for name in names if name not in ids]
+  if missing:
+    found = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(missing)).all())
+    new = [name for name in missing if name not in found]
+    if new:
+      insert_ignoring_duplicates(Genre.__table__, [{'name': name} for name in new], ['name'])
+      found = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(missing)).all())
+      # The new rows aren't committed yet and may be rolled back, so don't cache them
+      genre_ids.clear()
+    else:
+      genre_ids.update(found)
+    ids.update(found)
+  return [ids[name] for name in names]
+
+def set_genres(association, owner_column, owner_id, names):
+  # Replaces the genres of a venue or artist with set-based writes on the association table
+  ids = resolve_genre_ids(names)
+  column = association.c[owner_column]
+  db.session.execute(association.delete().where(column == owner_id))
+  if ids:
+    db.session.execute(association.insert(), [{'genre_id': genre_id, owner_column: owner_id} for genre_id in ids])
+
+def shows_swept_at(lock=False, shared=False):
+  # The watermark the counters are relative to. Databases built with db.create_all()
+  # start without one; their counters are empty, so any start is right.
+  # The sweep locks it for update. Whatever counts shows against it takes a shared lock,
+  # so that it waits for a running sweep and then reads the watermark that sweep left,
+  # rather than counting a show the sweep is about to move as well.
+  query = db.session.query(ShowCountSweep).filter(ShowCountSweep.id == 1)
+  sweep = (query.with_for_update(read=shared) if lock else query).one_or_none()
+  if sweep is None:
+    insert_ignoring_duplicates(ShowCountSweep.__table__, [{'id': 1, 'swept_at': datetime.now()}], ['id'])
+    sweep = query.one()
+  return sweep
+
+def count_new_shows(rows):
+  # Adds just inserted shows ({"venue_id", "artist_id", "start_time"} dicts) to the
+  # counters with one batched update per counter table
+  swept_at = shows_swept_at(lock=True, shared=True).swept_at
+  for fk, counter in SHOW_COUNTERS.items():
+    deltas = {}
+    for row in rows:
+      upcoming, past, next_show_time = deltas.get(row[fk], (0, 0, None))
+      if row['start_time'] > swept_at:
+        upcoming += 1
+        next_show_time = min(next_show_time or row['start_time'], row['start_time'])
+      else:
+        past += 1
+      deltas[row[fk]] = (upcoming, past, next_show_time)
+    if not deltas:
+      continue
+    table = counter.__table__
+    insert_ignoring_duplicates(table, [{'owner_id': owner_id} for owner_id in deltas], ['owner_id'])
+    next_show_time = db.bindparam('b_next_show_time', type_=db.DateTime)
+    db.session.execute(table.update().where(table.c.owner_id == db.bindparam('b_owner_id')).values(
+      upcoming_shows=table.c.upcoming_shows + db.bindparam('b_upcoming'),
+      past_shows=table.c.past_shows + db.bindparam('b_past'),
+      next_show_time=db.case(
+        (db.or_(table.c.next_show_time.is_(None), table.c.next_show_time > next_show_time), next_show_time),
+        else_=table.c.next_show_time
+      )
+    ), [{'b_owner_id': owner_id, 'b_upcoming': upcoming, 'b_past': past, 'b_next_show_time': next_show_time}
+        for owner_id, (upcoming, past, next_show_time) in deltas.items()])
+
+def recount_shows(fk, owner_ids=None):
+  # Rebuilds the counter rows of the given owners (all of them when None) from the Show
+  # table, for when shows went away. Shows of soft deleted venues and artists don't count.
+  counter = SHOW_COUNTERS[fk]
+  show_fk = getattr(Show, fk)
+  swept_at = shows_swept_at(lock=True, shared=True).swept_at
+  upcoming = Show.start_time > swept_at
+  query = live_shows(db.select(
+    show_fk,
+    db.func.count(db.case((upcoming, Show.id))),
+    db.func.count(db.case((db.not_(upcoming), Show.id))),
+    db.func.min(db.case((upcoming, Show.start_time)))
+  )).group_by(show_fk)
+  delete = counter.__table__.delete()
+  if owner_ids is not None:
+    owner_ids = list(owner_ids)
+    query = query.where(show_fk.in_(owner_ids))
+    delete = delete.where(counter.owner_id.in_(owner_ids))
+  db.session.execute(delete)
+  db.session.execute(counter.__table__.insert().from_select(
+    ['owner_id', 'upcoming_shows', 'past_shows', 'next_show_time'], query
+  ))
+
+def sweep_show_counts(now, batch_size=1000):
+  # Moves the shows that started since the last sweep from upcoming to past. Only the
+  # owners whose next show has started are visited. Returns the page cache namespaces
+  # that changed.
+  sweep = shows_swept_at(lock=True)
+  pages = []
+  for fk, counter in SHOW_COUNTERS.items():
+    show_fk = getattr(Show, fk)
+    table = counter.__table__
+    due = [owner_id for (owner_id,) in db.session.query(counter.owner_id).filter(counter.next_show_time <= now)]
+    for owner_ids in chunked(due, batch_size):
+      started = dict(live_shows(db.session.query(show_fk, db.func.count(Show.id))).filter(
+        show_fk.in_(owner_ids), Show.start_time > sweep.swept_at, Show.start_time <= now
+      ).group_by(show_fk).all())
+      following = dict(live_shows(db.session.query(show_fk, db.func.min(Show.start_time))).filter(
+        show_fk.in_(owner_ids), Show.start_time > now
+      ).group_by(show_fk).all())
+      db.session.execute(table.update().where(table.c.owner_id == db.bindparam('b_owner_id')).values(
+        upcoming_shows=table.c.upcoming_shows - db.bindparam('b_started'),
+        past_shows=table.c.past_shows + db.bindparam('b_started'),
+        next_show_time=db.bindparam('b_next_show_time', type_=db.DateTime)
+      ), [{'b_owner_id': owner_id, 'b_started': started.get(owner_id, 0), 'b_next_show_time': following.get(owner_id)}
+          for owner_id in owner_ids])
+    pages += [f'{fk[:-3]}:{owner_id}' for owner_id in due]
+  sweep.swept_at = now
+  if pages:
+    pages += ['venues']
+  return pages
+
+@jobs.handler('sweep-shows')
+def sweep_shows_job():
+  pages = sweep_show_counts(datetime.now())
+  db.session.commit()
+  page_cache.invalidate(*pages)
+
+jobs.schedule('sweep-shows', app.config['SWEEP_SHOWS_SECONDS'])
+
+def match_pair(fk, owner_id, other_id):
+  # the (artist_id, venue_id) key of a pair seen from one side
+  return (owner_id, other_id) if fk == 'artist_id' else (other_id, owner_id)
+
+def by_owner(pairs):
+  # {(artist_id, venue_id): value} as {side: {owner id: {other id: value}}}
+  owners = {'artist_id': {}, 'venue_id': {}}
+  for (artist_id, venue_id), value in pairs.items():
+    owners['artist_id'].setdefault(artist_id, {})[venue_id] = value
+    owners['venue_id'].setdefault(venue_id, {})[artist_id] = value
+  return owners
+
+def match_candidates(fk, states):
+  # {state: Candidates} of the live artists (fk 'artist_id') or venues ('venue_id')
+  # seeking a match in the given states, read off the partial seeking/state indexes
+  model, association, seeking = MATCH_SIDES[fk]
+  rows = db.session.execute(db.select(
+      model.id, model.city, model.state, association.c.genre_id
+  ).outerjoin(
+      association, association.c[fk] == model.id
+  ).where(
+      model.deleted_at.is_(None), seeking.is_(True), model.state.in_(states)
+  ).order_by(model.id))
+  candidates = {state: Candidates() for state in states}
+  for (owner_id, city, state), owner_rows in groupby(rows, key=itemgetter(0, 1, 2)):
+    genres = [genre_id for *_, genre_id in owner_rows if genre_id is not None]
+    candidates[state].add(owner_profile(owner_id, city, state, genres))
+  return candidates
+
+def involving(artist_column, venue_column, artist_ids, venue_ids):
+  # artist_column IN artist_ids OR venue_column IN venue_ids. An empty side is left out
+  # rather than made an always false IN, which keeps SQLite from using the indexes.
+  criteria = []
+  if artist_ids:
+    criteria.append(artist_column.in_(artist_ids))
+  if venue_ids:
+    criteria.append(venue_column.in_(venue_ids))
+  return db.or_(*criteria) if criteria else db.false()
+
+def shows_together(*criteria):
+  # {(artist_id, venue_id): shows} of the pairs that can be matched, narrowed down by criteria
+  return {(artist_id, venue_id): count for artist_id, venue_id, count in db.session.execute(live_shows(db.select(
+      Show.artist_id, Show.venue_id, db.func.count()
+  )).where(
+      Artist.seeking_venue.is_(True), Venue.seeking_talent.is_(True), Artist.state == Venue.state, *criteria
+  ).group_by(Show.artist_id, Show.venue_id))}
+
+def seeking_states(fk, ids):
+  # the states the given artists (or venues) seeking a match are in
+  model, _, seeking = MATCH_SIDES[fk]
+  return {state for (state,) in db.session.execute(db.select(model.state).where(
+    model.id.in_(ids), model.deleted_at.is_(None), seeking.is_(True)
+  ).distinct())}
+
+def match_pages(old, new):
+  # the artist and venue pages whose suggestions may look different
+  changed = {pair for pair in old.keys() | new.keys() if old.get(pair) != new.get(pair)}
+  return sorted({f'artist:{artist_id}' for artist_id, _ in changed} | {f'venue:{venue_id}' for _, venue_id in changed})
+
+def refresh_matches(artist_ids=(), venue_ids=()):
+  # Recomputes the suggestions of the given artists and venues after their genres,
+  # place, seeking flag or shows changed, or they were deleted, and patches those of
+  # the venues and artists on the other side. An artist (or venue) only needs its own
+  # list ranked again when one of the pairs it had listed scores lower now, otherwise
+  # the new scores of the changed pairs are merged into what it has stored, and the
+  # pairs pushed off its list are deleted unless the other side lists them. Returns the
+  # page cache namespaces whose suggestions changed.
+  limit = app.config['MATCH_SUGGESTIONS']
+  changed = {'artist_id': set(artist_ids), 'venue_id': set(venue_ids)}
+  if not any(changed.values()):
+    return []
+  table = Match.__table__
+  rows = involving(table.c.artist_id, table.c.venue_id, changed['artist_id'], changed['venue_id'])
+  old = {(artist_id, venue_id): value for artist_id, venue_id, value in
+         db.session.execute(db.select(table.c.artist_id, table.c.venue_id, table.c.score).where(rows))}
+  db.session.execute(table.delete().where(rows))
+
+  # the states of the changed venues and artists and of the ones they were listed with
+  before = by_owner(old)
+  states = set()
+  for fk in MATCH_SIDES:
+    ids = changed[fk] | before[fk].keys()
+    if ids:
+      states |= seeking_states(fk, ids)
+  candidates = {fk: match_candidates(fk, states) for fk in MATCH_SIDES}
+  located = {fk: {owner_id: state for state, group in candidates[fk].items() for owner_id in group.profiles}
+             for fk in MATCH_SIDES}
+  together = by_owner(shows_together(involving(Show.artist_id, Show.venue_id, changed['artist_id'], changed['venue_id'])))
+
+  def rank(fk, owner_id):
+    # {other id: score} of one artist or venue against the other side of its state
+    other_fk = 'venue_id' if fk == 'artist_id' else 'artist_id'
+    if owner_id not in located[fk]:
+      return {}
+    state = located[fk][owner_id]
+    return candidates[other_fk][state].scores(candidates[fk][state].profiles[owner_id], together[fk].get(owner_id, {}))
+
+  new, scores = {}, {}
+  for fk, ids in changed.items():
+    for owner_id in ids:
+      scored = rank(fk, owner_id)
+      scores.update((match_pair(fk, owner_id, other_id), value) for other_id, value in scored.items())
+      new.update((match_pair(fk, owner_id, other_id), value) for other_id, value in best(scored, limit))
+
+  # the unchanged artists and venues that a changed one scored against or was listed with
+  after = by_owner(scores)
+  counterparts = {fk: (before[fk].keys() | after[fk].keys()) - changed[fk] for fk in MATCH_SIDES}
+  stored = by_owner({(artist_id, venue_id): value for artist_id, venue_id, value in db.session.execute(
+    db.select(table.c.artist_id, table.c.venue_id, table.c.score).where(
+      involving(table.c.artist_id, table.c.venue_id, counterparts['artist_id'], counterparts['venue_id'])
+    )
+  )})
+  reranked = {'artist_id': [], 'venue_id': []}
+  # stored pairs that fell off a counterpart's list, kept only when on the other side's
+  pushed = {'artist_id': set(), 'venue_id': set()}
+  for fk, owner_ids in counterparts.items():
+    for owner_id in owner_ids:
+      kept = stored[fk].get(owner_id, {})
+      dropped, rescored = before[fk].get(owner_id, {}), after[fk].get(owner_id, {})
+      listed = dict(best({**kept, **dropped}, limit))
+      if any(other_id in listed and rescored.get(other_id, 0) < value for other_id, value in dropped.items()):
+        reranked[fk].append(owner_id)
+        continue
+      listed = dict(best({**kept, **rescored}, limit))
+      new.update((match_pair(fk, owner_id, other_id), value) for other_id, value in listed.items() if other_id not in kept)
+      pushed[fk].update(match_pair(fk, owner_id, other_id) for other_id in kept if other_id not in listed)
+
+  if any(reranked.values()):
+    pairs = shows_together(involving(Show.artist_id, Show.venue_id, reranked['artist_id'], reranked['venue_id']))
+    for fk, groups in by_owner(pairs).items():
+      for owner_id, shows in groups.items():
+        together[fk].setdefault(owner_id, {}).update(shows)
+    for fk, owner_ids in reranked.items():
+      for owner_id in owner_ids:
+        kept = stored[fk].get(owner_id, {})
+        listed = dict(best(rank(fk, owner_id), limit))
+        new.update((match_pair(fk, owner_id, other_id), value) for other_id, value in listed.items() if other_id not in kept)
+        pushed[fk].update(match_pair(fk, owner_id, other_id) for other_id in kept if other_id not in listed)
+
+  if new:
+    db.session.execute(table.insert(), [{'artist_id': artist_id, 'venue_id': venue_id, 'score': value}
+                                        for (artist_id, venue_id), value in new.items()])
+  if any(pushed.values()):
+    # every stored pair has its current score and every list is among the stored pairs,
+    # so the best stored pairs of an artist (or venue) are its list
+    others = {'artist_id': {artist_id for artist_id, _ in pushed['venue_id']},
+              'venue_id': {venue_id for _, venue_id in pushed['artist_id']}}
+    lists = by_owner({(artist_id, venue_id): value for artist_id, venue_id, value in db.session.execute(
+      db.select(table.c.artist_id, table.c.venue_id, table.c.score).where(
+        involving(table.c.artist_id, table.c.venue_id, others['artist_id'], others['venue_id'])
+      )
+    )})
+    lists = {fk: {owner_id: dict(best(scored, limit)) for owner_id, scored in owners.items()}
+             for fk, owners in lists.items()}
+    unlisted = [(artist_id, venue_id) for artist_id, venue_id in pushed['venue_id']
+                if venue_id not in lists['artist_id'].get(artist_id, {})]
+    unlisted += [(artist_id, venue_id) for artist_id, venue_id in pushed['artist_id']
+                 if artist_id not in lists['venue_id'].get(venue_id, {})]
+    for chunk in chunked(sorted(set(unlisted)), 500):
+      db.session.execute(table.delete().where(db.tuple_(table.c.artist_id, table.c.venue_id).in_(chunk)))
+  return match_pages(old, new)
+
+def rebuild_matches():
+  # Ranks every artist and venue seeking a match from scratch, one state at a time.
+  # Every pair is scored once, from the artist's side, and each venue keeps its best
+  # in a heap as they come. Returns the page cache namespaces whose suggestions changed.
+  limit = app.config['MATCH_SUGGESTIONS']
+  table = Match.__table__
+  old = {(artist_id, venue_id): value for artist_id, venue_id, value in db.session.execute(db.select(table))}
+  db.session.execute(table.delete())
+  states = sorted({state for (state,) in db.session.execute(db.select(Artist.state).where(
+    Artist.deleted_at.is_(None), Artist.seeking_venue.is_(True)
+  ).distinct()) if state is not None})
+  candidates = {fk: match_candidates(fk, states) for fk in MATCH_SIDES}
+  together = by_owner(shows_together())['artist_id']
+
+  new = {}
+  for state in states:
+    venues, heaps = candidates['venue_id'][state], {}
+    for artist in candidates['artist_id'][state].profiles.values():
+      scored = venues.scores(artist, together.get(artist.id, {}))
+      new.update(((artist.id, venue_id), value) for venue_id, value in best(scored, limit))
+      for venue_id, value in scored.items():
+        heap = heaps.setdefault(venue_id, [])
+        if len(heap) < limit:
+          heapq.heappush(heap, (value, -artist.id))
+        elif (value, -artist.id) > heap[0]:
+          heapq.heapreplace(heap, (value, -artist.id))
+    for venue_id, heap in heaps.items():
+      new.update(((-artist_id, venue_id), value) for value, artist_id in heap)
+
+  for chunk in chunked(list(new.items()), 10000):
+    db.session.execute(table.insert(), [{'artist_id': artist_id, 'venue_id': venue_id, 'score': value}
+                                        for (artist_id, venue_id), value in chunk])
+  return match_pages(old, new)
+
+@jobs.handler('refresh-matches')
+def refresh_matches_job(artist_ids=(), venue_ids=()):
+  pages = refresh_matches(artist_ids, venue_ids)
+  db.session.commit()
+  page_cache.invalidate(*pages)
+
+def defer_refresh_matches(artist_ids=(), venue_ids=(), key=None):
+  # Queues refresh_matches in the current transaction. The suggestions catch up with
+  # the change once a worker ran it, the write itself doesn't wait for the ranking.
+  jobs.enqueue('refresh-matches', {'artist_ids': sorted(artist_ids), 'venue_ids': sorted(venue_ids)}, key=key)
+
+def suggested_matches(fk, owner_id):
+  # The suggestions listed on an artist's (fk 'artist_id') or venue's page, best first
+  other_fk = 'venue_id' if fk == 'artist_id' else 'artist_id'
+  other = MATCH_SIDES[other_fk][0]
+  prefix = other.__tablename__.lower()
+  rows = db.session.execute(db.select(
+      other.id, other.name, other.city, other.state, other.image_link, Match.score
+  ).join(
+      Match, getattr(Match, other_fk) == other.id
+  ).where(
+      getattr(Match, fk) == owner_id, other.deleted_at.is_(None)
+  ).order_by(Match.score.desc(), other.id).limit(app.config['MATCH_SUGGESTIONS']))
+  return [{
+      prefix + "_id": other_id,
+      prefix + "_name": name,
+      prefix + "_image_link": image_link,
+      "city": city,
+      "state": state,
+      "score": round(value * 100)
+  } for other_id, name, city, state, image_link, value in rows]
+
+def month_bounds(year, month):
+  # [first, following) datetimes of a calendar month. Year 1 has no month before it
+  # for the previous link to point at.
+  if not 1 <= month <= 12 or not 1 < year < 9999:
+    abort(404)
+  return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+
+def calendar_response(kind, owner_id, model, show_fk, other, other_fk, year, month):
+  # One month of a venue's (or artist's) shows laid out by week. The shows come from a
+  # start_time range on the (venue_id, start_time) or (artist_id, start_time) index.
+  name = db.session.query(model.name).filter(model.id == owner_id, model.deleted_at.is_(None)).scalar()
+  if name is None:
+    return redirect(url_for('index'))
+  first, following = month_bounds(year, month)
+  prefix = other.__tablename__.lower()
+  rows = db.session.query(
+      Show.start_time, Show.end_time, other.id, other.name
+  ).join(
+      other, other_fk == other.id
+  ).filter(
+      show_fk == owner_id, other.deleted_at.is_(None), Show.start_time >= first, Show.start_time < following
+  ).order_by(Show.start_time, Show.id).all()
+
+  days = {}
+  for start_time, end_time, other_id, other_name in rows:
+    days.setdefault(start_time.date(), []).append({
+        prefix + "_id": other_id,
+        prefix + "_name": other_name,
+        "start_time": start_time,
+        "end_time": end_time
+    })
+  weeks = [[{
+      "date": day,
+      "in_month": day.month == month,
+      "shows": days.get(day, [])
+  } for day in week] for week in calendar.Calendar().monthdatescalendar(year, month)]
+
+  previous = first - timedelta(days=1)
+  return render_template('pages/calendar.html', kind=kind, owner={"id": owner_id, "name": name}, other=prefix,
+                         month=first, weeks=weeks, count=len(rows),
+                         previous=url_for(request.endpoint, year=previous.year, month=previous.month, **{kind + '_id': owner_id}),
+                         next=url_for(request.endpoint, year=following.year, month=following.month, **{kind + '_id': owner_id}))
+
+def calendar_page(kind, owner_id, year, month):
+  # cache namespace of one month calendar, matching the venue_calendar/artist_calendar views
+  return f'{kind}-calendar:{owner_id}:{int(year)}-{int(month)}'
+
+def calendar_pages(*criteria):
+  # the month calendars showing any of the shows matching criteria
+  year, month = db.extract('year', Show.start_time), db.extract('month', Show.start_time)
+  rows = db.session.query(Show.venue_id, Show.artist_id, year, month).filter(*criteria).distinct()
+  return sorted({page for venue_id, artist_id, y, m in rows
+                 for page in (calendar_page('venue', venue_id, y, m), calendar_page('artist', artist_id, y, m))})
+
+def stream_page(template, **context):
+  # Renders a template while it is being sent, in chunks. Iterators in context are only
+  # consumed as the page gets to them, so rows can come straight off a cursor.
+  return stream_with_context(buffered(stream_template(template, **context), app.config['STREAM_CHUNK_SIZE']))
+
+def streamed_rows(query):
+  # Rows of a select, fetched in batches while the page streams (from a server-side
+  # cursor where the driver has one)
+  return db.session.execute(query.execution_options(stream_results=True, yield_per=app.config['STREAM_BATCH_SIZE']))
+
+def venue_pages(venue_id):
+  # cached pages showing a venue: the directory, /shows, its own page, the page of
+  # every artist that played there and the calendars of its shows, on both sides
+  artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+  return (['venues', 'shows', f'venue:{venue_id}'] + [f'artist:{artist_id}' for (artist_id,) in artist_ids]
+          + calendar_pages(Show.venue_id == venue_id))
+
+def artist_pages(artist_id):
+  # cached pages showing an artist: the artist list, /shows, its own page, the page
+  # of every venue it played at and the calendars of its shows, on both sides
+  venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+  return (['artists', 'shows', f'artist:{artist_id}'] + [f'venue:{venue_id}' for (venue_id,) in venue_ids]
+          + calendar_pages(Show.artist_id == artist_id))
+
+def delete_owner(model, fk, owner_id):
+  # Deletes a venue (fk 'venue_id') or an artist (fk 'artist_id') with one statement,
+  # returning the page cache namespaces to invalidate after the commit, or None when
+  # there is no such venue or artist. The database cascades a hard delete to the shows,
+  # genre links and counter row. With SOFT_DELETE the row is only marked deleted_at and
+  # its shows stay, marked hidden: left out of every listing and of the booking checks.
+  other_fk = 'artist_id' if fk == 'venue_id' else 'venue_id'
+  show_fk = getattr(Show, fk)
+  if db.session.query(model.id).filter(model.id == owner_id, model.deleted_at.is_(None)).scalar() is None:
+    return None
+  pages = (venue_pages if fk == 'venue_id' else artist_pages)(owner_id)
+  other_ids = [other_id for (other_id,) in db.session.query(getattr(Show, other_fk)).filter(show_fk == owner_id).distinct()]
+  # the ones it was suggested to, their lists are ranked again without it
+  matched = [other_id for (other_id,) in db.session.query(getattr(Match, other_fk)).filter(getattr(Match, fk) == owner_id)]
+
+  table = model.__table__
+  if app.config['SOFT_DELETE']:
+    db.session.execute(table.update().where(table.c.id == owner_id).values(deleted_at=datetime.now()))
+    db.session.execute(db.update(Show).where(show_fk == owner_id).values(hidden=True))
+  else:
+    db.session.execute(table.delete().where(table.c.id == owner_id))
+  # the counters of the other side lose the shows, and a soft deleted owner its own row
+  recount_shows(fk, [owner_id])
+  recount_shows(other_fk, other_ids)
+  defer_refresh_matches(**{fk + 's': [owner_id], other_fk + 's': matched})
+  return pages
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -146,6 +1215,8 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@page_cache.cached('venues')
+@read_only
 def venues():
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
@@ -171,76 +1242,42 @@ def venues():
   #     }]
   # }]
 
-  # venues = Venue.query.order_by(Venue.state, Venue.city.asc()).all()
-  venues = Venue.query.all()
-
-  data = [] 
-
-  # Set of all the cities_states
-  cities_states = set()
-  for venue in venues:
-      cities_states.add( (venue.city, venue.state) )  
-  
-  cities_states = list(cities_states)
-  cities_states.sort(key=itemgetter(1,0))    
-
-  now = datetime.now()
+  # One query for the whole directory: each venue with its upcoming show count from the
+  # counter table, already ordered by state and city. Venues without shows have no
+  # counter row, hence the outer join. The rows are grouped into areas as the page
+  # streams, so the directory is never held in memory as a whole. ?genre=, ?state=,
+  # ?city= and ?seeking= narrow it down, the facet counts come from one more query.
+  criteria, selected = listing_filters(Venue, venue_genre_table, 'venue_id', Venue.seeking_talent)
+  facets = facet_counts(Venue, venue_genre_table, 'venue_id', Venue.seeking_talent, criteria)
+  rows = streamed_rows(db.select(
+      Venue.id, Venue.name, Venue.city, Venue.state, db.func.coalesce(VenueShowCount.upcoming_shows, 0)
+  ).outerjoin(
+      VenueShowCount, VenueShowCount.owner_id == Venue.id
+  ).where(
+      *criteria.values()
+  ).order_by(
+      Venue.state, Venue.city, Venue.name
+  ))
+
+  data = ({
+      "city": city,
+      "state": state,
+      "venues": ({
+          "id": venue_id,
+          "name": name,
+          "num_upcoming_shows": num_upcoming
+      } for venue_id, name, _, _, num_upcoming in area_rows)
+  } for (city, state), area_rows in groupby(rows, key=itemgetter(2, 3)))
+  return stream_page('pages/venues.html', areas=peek(data), facets=facets, selected=selected,
+                     facet_limit=app.config['LISTING_FACET_VALUES'])
 
-  for loc in cities_states:
-      venues_list = []
-      for venue in venues:
-          if (venue.city == loc[0]) and (venue.state == loc[1]):
-
-              # If we have a venue to add, check how many upcoming shows it has
-              venue_shows = Show.query.filter_by(venue_id=venue.id).all()
-              num_upcoming = 0
-              for show in venue_shows:
-                  if show.start_time > now:
-                      num_upcoming += 1
-
-              venues_list.append({
-                  "id": venue.id,
-                  "name": venue.name,
-                  "num_upcoming_shows": num_upcoming
-              })
-
-      # After all venues are added to the list for a given location, add it to our data dictionary
-      data.append({
-          "city": loc[0],
-          "state": loc[1],
-          "venues": venues_list
-      })
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
+@app.route('/venues/search', methods=['GET', 'POST'])
+@read_only
 def search_venues():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_term = request.form.get('search_term', '').strip()
-
-  # using ilike operator instead of like operator to match case insensitive
-  venues = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all() 
-  print(venues)
-  venue_list = []
-  now = datetime.now()
-  for venue in venues:
-      venue_shows = Show.query.filter_by(venue_id=venue.id).all()
-      num_upcoming = 0
-      for show in venue_shows:
-          if show.start_time > now:
-              num_upcoming += 1
-
-      venue_list.append({
-          "id": venue.id,
-          "name": venue.name,
-          "num_upcoming_shows": num_upcoming
-      })
-
-  response = {
-      "count": len(venues),
-      "data": venue_list
-  }
+  response, search_term = search_response(Venue, VenueShowCount)
 
   # response = {
   #     "count": 1,
@@ -252,41 +1289,43 @@ def search_venues():
   # }
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
+@app.route('/venues/near')
+@read_only
+def venues_near_point():
+  # venues within ?km= kilometres of ?lat=&lon=, nearest first, as JSON
+  latitude = request.args.get('lat', type=float)
+  longitude = request.args.get('lon', type=float)
+  km = request.args.get('km', 10, type=float)
+  if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+    api_error('lat and lon must be a latitude and a longitude')
+  if not 0 < km <= app.config['VENUES_NEAR_MAX_KM']:
+    api_error(f"km must be more than 0 and at most {app.config['VENUES_NEAR_MAX_KM']}")
+  limit = min(max(request.args.get('limit', app.config['VENUES_NEAR_LIMIT'], type=int), 1), app.config['VENUES_NEAR_LIMIT'])
+  total, data = venues_near(latitude, longitude, km, limit)
+  return jsonify({
+      "count": total,
+      "data": data
+  })
+
 @app.route('/venues/<int:venue_id>')
+@page_cache.cached('venue:{venue_id}')
+@read_only
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   venue = Venue.query.get(venue_id)   
   print(venue)
-  if not venue:
+  if not venue or venue.deleted_at is not None:
     # Redirect home
     return redirect(url_for('index'))
   else:
     genres = [ genre.name for genre in venue.genres ]
     
-    # Get a list of shows and count the ones in the past and future
-    past_shows = []
-    past_shows_count = 0
-    upcoming_shows = []
-    upcoming_shows_count = 0
-    now = datetime.now()
-    for show in venue.shows:
-        if show.start_time > now:
-            upcoming_shows_count += 1
-            upcoming_shows.append({
-                "artist_id": show.artist_id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": format_datetime(str(show.start_time))
-            })
-        if show.start_time < now:
-            past_shows_count += 1
-            past_shows.append({
-                "artist_id": show.artist_id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": format_datetime(str(show.start_time))
-            })
+    # Counts come from the counter table, the lists are bounded pages fetched by start_time
+    now = shows_split_at()
+    upcoming_shows_count, past_shows_count = show_counts(VenueShowCount, venue_id)
+    upcoming_shows, upcoming_next = show_tiles(Show.venue_id, venue_id, Artist, Show.artist_id, 'upcoming', now)
+    past_shows, past_next = show_tiles(Show.venue_id, venue_id, Artist, Show.artist_id, 'past', now)
 
     data = {
         "id": venue_id,
@@ -303,8 +1342,11 @@ def show_venue(venue_id):
         "image_link": venue.image_link,
         "past_shows": past_shows,
         "past_shows_count": past_shows_count,
+        "past_shows_next": past_next and url_for('venue_shows', venue_id=venue_id, when='past', after=past_next),
         "upcoming_shows": upcoming_shows,
-        "upcoming_shows_count": upcoming_shows_count
+        "upcoming_shows_count": upcoming_shows_count,
+        "upcoming_shows_next": upcoming_next and url_for('venue_shows', venue_id=venue_id, when='upcoming', after=upcoming_next),
+        "suggested_artists": suggested_matches('venue_id', venue_id)
     }
 
   # data1 = {
@@ -335,11 +1377,29 @@ def show_venue(venue_id):
   #                    venue_id, [data1, data2, data3]))[0]
   return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/<int:venue_id>/shows')
+@read_only
+def venue_shows(venue_id):
+  # older (or later) pages of the show lists on the venue page
+  return more_shows_response(Show.venue_id, venue_id, Artist, Show.artist_id)
+
+@app.route('/venues/<int:venue_id>/calendar')
+def venue_calendar_now(venue_id):
+  now = datetime.now()
+  return redirect(url_for('venue_calendar', venue_id=venue_id, year=now.year, month=now.month))
+
+@app.route('/venues/<int:venue_id>/calendar/<int:year>/<int:month>')
+@page_cache.cached('venue-calendar:{venue_id}:{year}-{month}', ttl=app.config['CALENDAR_CACHE_TTL'])
+@read_only
+def venue_calendar(venue_id, year, month):
+  return calendar_response('venue', venue_id, Venue, Show.venue_id, Artist, Show.artist_id, year, month)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
 @app.route('/venues/create', methods=['GET'])
 def create_venue_form():
+  from forms import VenueForm
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
@@ -347,6 +1407,7 @@ def create_venue_form():
 def create_venue_submission():
   # TODO: insert form data as a new Venue record in the db, instead
   # TODO: modify data to be the data object returned from db insertion
+  from forms import VenueForm
   form = VenueForm()
 
   name = form.name.data.strip()
@@ -375,19 +1436,13 @@ def create_venue_submission():
           # creates the new venue with all fields
           new_venue = Venue(name=name, city=city, state=state, address=address, phone=phone, \
               seeking_talent=seeking_talent, seeking_description=seeking_description, image_link=image_link, \
-              website=website, facebook_link=facebook_link)
-          for genre in genres:
-              # Throws an exception if more than one returned, returns None if none
-              fetch_genre = Genre.query.filter_by(name=genre).one_or_none() 
-              if fetch_genre:
-                  # if found a genre, append it to the list
-                  new_venue.genres.append(fetch_genre)
-              else:
-                  new_genre = Genre(name=genre)
-                  db.session.add(new_genre)
-                  # Create a new Genre item and append it
-                  new_venue.genres.append(new_genre)  
+              website=website, facebook_link=facebook_link, **venue_location(city, state, address))
           db.session.add(new_venue)
+          # flush to get the new id for the genre links
+          db.session.flush()
+          set_genres(venue_genre_table, 'venue_id', new_venue.id, genres)
+          defer_refresh_matches(venue_ids=[new_venue.id], key=f'matches:venue:{new_venue.id}')
+          new_id = new_venue.id
           db.session.commit()
       except Exception as e:
           error_in_insert = True
@@ -397,6 +1452,8 @@ def create_venue_submission():
           db.session.close()
 
       if not error_in_insert:
+          page_cache.invalidate('venues')
+          typeahead.add('venues', new_id, name)
           # on successful db insert, flash success
           flash('Venue ' + request.form['name'] + ' was successfully listed!')
           return redirect(url_for('index'))
@@ -409,50 +1466,54 @@ def create_venue_submission():
         # return redirect(url_for('create_venue_submission'))
         abort(500)
 
-@app.route('/venues/<venue_id>/delete', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>/delete', methods=['DELETE'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  venue = Venue.query.get(venue_id)
-  if not venue:
-    return redirect(url_for('index'))
+  error_on_delete = False
+  try:
+    pages = delete_owner(Venue, 'venue_id', venue_id)
+    db.session.commit()
+  except Exception as e:
+    error_on_delete = True
+    print(f'Exception "{e}" in delete_venue()')
+    db.session.rollback()
+  finally:
+    db.session.close()
+  if error_on_delete:
+    flash(f'An error occurred deleting venue {venue_id}.')
+    print("Error in delete_venue()")
+    abort(500)
+  elif pages is None:
+    abort(404)
   else:
-    error_on_delete = False
-    venue_name = venue.name
-    try:
-      db.session.delete(venue)
-      db.session.commit()
-    except:
-      error_on_delete = True
-      db.session.rollback()
-    finally:
-      db.session.close()
-    if error_on_delete:
-      flash(f'An error occurred deleting venue {venue_name}.')
-      print("Error in delete_venue()")
-      abort(500)
-    else:
-      return jsonify({
-        'deleted': True,
-        'url': url_for('venues')
-      })
+    page_cache.invalidate(*pages)
+    typeahead.remove('venues', venue_id)
+    return jsonify({
+      'deleted': True,
+      'url': url_for('venues')
+    })
 
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@page_cache.cached('artists')
+@read_only
 def artists():
   # TODO: replace with real data returned from querying the database
-  artists = Artist.query.order_by(Artist.name).all()  
+  # only the two columns the page shows, streamed rather than loaded as models, and
+  # narrowed down by the same filters as /venues
+  criteria, selected = listing_filters(Artist, artist_genre_table, 'artist_id', Artist.seeking_venue)
+  facets = facet_counts(Artist, artist_genre_table, 'artist_id', Artist.seeking_venue, criteria)
+  rows = streamed_rows(db.select(Artist.id, Artist.name).where(*criteria.values()).order_by(Artist.name, Artist.id))
 
-  data = []
-  for artist in artists:
-    data.append({
-        "id": artist.id,
-        "name": artist.name
-    })
+  data = ({
+      "id": artist_id,
+      "name": name
+  } for artist_id, name in rows)
 
   # data = [{
   #     "id": 4,
@@ -464,37 +1525,16 @@ def artists():
   #     "id": 6,
   #     "name": "The Wild Sax Band",
   # }]
-  return render_template('pages/artists.html', artists=data)
+  return stream_page('pages/artists.html', artists=peek(data), facets=facets, selected=selected,
+                     facet_limit=app.config['LISTING_FACET_VALUES'])
 
-@app.route('/artists/search', methods=['POST'])
+@app.route('/artists/search', methods=['GET', 'POST'])
+@read_only
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  
-  search_term = request.form.get('search_term', '').strip()
-  artists = Artist.query.filter(Artist.name.ilike('%' + search_term + '%')).all()  
-  
-  print(artists)
-  artist_list = []
-  now = datetime.now()
-  for artist in artists:
-    artist_shows = Show.query.filter_by(artist_id=artist.id).all()
-    num_upcoming = 0
-    for show in artist_shows:
-      if show.start_time > now:
-        num_upcoming += 1
-
-    artist_list.append({
-      "id": artist.id,
-      "name": artist.name,
-      "num_upcoming_shows": num_upcoming 
-    })
-
-  response = {
-    "count": len(artists),
-    "data": artist_list
-  }
+  response, search_term = search_response(Artist, ArtistShowCount)
 
   # response={
   #  "count": 1,
@@ -504,9 +1544,11 @@ def search_artists():
   #   "num_upcoming_shows": 0,
   #  }]
   # }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@page_cache.cached('artist:{artist_id}')
+@read_only
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -514,34 +1556,16 @@ def show_artist(artist_id):
   # Displays the artist page with the given artist_id.
   artist = Artist.query.get(artist_id)
   print(artist)
-  if not artist:
+  if not artist or artist.deleted_at is not None:
     # Redirect home
     return redirect(url_for('index'))
   else:
     genres = [ genre.name for genre in artist.genres ]
-    # Get a list of shows and count the ones in the past and future
-    past_shows = []
-    past_shows_count = 0
-    upcoming_shows = []
-    upcoming_shows_count = 0
-    now = datetime.now()
-    for show in artist.shows:
-      if show.start_time > now:
-        upcoming_shows_count += 1
-        upcoming_shows.append({
-            "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
-            "venue_image_link": show.venue.image_link,
-            "start_time": format_datetime(str(show.start_time))
-        })
-      if show.start_time < now:
-        past_shows_count += 1
-        past_shows.append({
-          "venue_id": show.venue_id,
-          "venue_name": show.venue.name,
-          "venue_image_link": show.venue.image_link,
-          "start_time": format_datetime(str(show.start_time))
-        })
+    # Counts come from the counter table, the lists are bounded pages fetched by start_time
+    now = shows_split_at()
+    upcoming_shows_count, past_shows_count = show_counts(ArtistShowCount, artist_id)
+    upcoming_shows, upcoming_next = show_tiles(Show.artist_id, artist_id, Venue, Show.venue_id, 'upcoming', now)
+    past_shows, past_next = show_tiles(Show.artist_id, artist_id, Venue, Show.venue_id, 'past', now)
 
     data = {
       "id": artist_id,
@@ -557,8 +1581,11 @@ def show_artist(artist_id):
       "image_link": artist.image_link,
       "past_shows": past_shows,
       "past_shows_count": past_shows_count,
+      "past_shows_next": past_next and url_for('artist_shows', artist_id=artist_id, when='past', after=past_next),
       "upcoming_shows": upcoming_shows,
-      "upcoming_shows_count": upcoming_shows_count
+      "upcoming_shows_count": upcoming_shows_count,
+      "upcoming_shows_next": upcoming_next and url_for('artist_shows', artist_id=artist_id, when='upcoming', after=upcoming_next),
+      "suggested_venues": suggested_matches('artist_id', artist_id)
     }
 
   # data1 = {
@@ -588,10 +1615,28 @@ def show_artist(artist_id):
 
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/shows')
+@read_only
+def artist_shows(artist_id):
+  # older (or later) pages of the show lists on the artist page
+  return more_shows_response(Show.artist_id, artist_id, Venue, Show.venue_id)
+
+@app.route('/artists/<int:artist_id>/calendar')
+def artist_calendar_now(artist_id):
+  now = datetime.now()
+  return redirect(url_for('artist_calendar', artist_id=artist_id, year=now.year, month=now.month))
+
+@app.route('/artists/<int:artist_id>/calendar/<int:year>/<int:month>')
+@page_cache.cached('artist-calendar:{artist_id}:{year}-{month}', ttl=app.config['CALENDAR_CACHE_TTL'])
+@read_only
+def artist_calendar(artist_id, year, month):
+  return calendar_response('artist', artist_id, Artist, Show.artist_id, Venue, Show.venue_id, year, month)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
+  from forms import ArtistForm
   # form = ArtistForm()
   # artist = {
   #     "id": 4,
@@ -610,7 +1655,7 @@ def edit_artist(artist_id):
   # TODO: populate form with fields from artist with ID <artist_id>
   # Get the existing artist from the database
   artist = Artist.query.get(artist_id)  
-  if not artist:
+  if not artist or artist.deleted_at is not None:
       # redirect home
       return redirect(url_for('index'))
   else:
@@ -638,8 +1683,13 @@ def edit_artist(artist_id):
 def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
+  from forms import ArtistForm
   form = ArtistForm()
 
+  # deleted artists can't be edited, nor brought back by an edit (see edit_artist)
+  if db.session.query(Artist.id).filter(Artist.id == artist_id, Artist.deleted_at.is_(None)).scalar() is None:
+    return redirect(url_for('index'))
+
   name = form.name.data.strip()
   city = form.city.data.strip()
   state = form.state.data
@@ -660,8 +1710,8 @@ def edit_artist_submission(artist_id):
     error_in_update = False
     # Insert form data into DB
     try:
-      # First get the existing artist object
-      artist = Artist.query.get(artist_id)
+      # First get the existing artist object, locked so a concurrent delete waits
+      artist = Artist.query.filter(Artist.id == artist_id, Artist.deleted_at.is_(None)).with_for_update().one()
 
       # Update
       artist.name = name
@@ -674,19 +1724,12 @@ def edit_artist_submission(artist_id):
       artist.website = website
       artist.facebook_link = facebook_link
 
-      # Clear all the existing genres off the artist .. or artist.genres.clear()  
-      # artist.genres.clear()  
-      artist.genres = []
-      
-      for genre in genres:
-        fetch_genre = Genre.query.filter_by(name=genre).one_or_none()  
-        if fetch_genre:
-          artist.genres.append(fetch_genre)
-        else:
-          new_genre = Genre(name=genre)
-          db.session.add(new_genre)
-          artist.genres.append(new_genre) 
+      # Replace all the existing genres of the artist
+      set_genres(artist_genre_table, 'artist_id', artist_id, genres)
+      pages = artist_pages(artist_id)
+      defer_refresh_matches(artist_ids=[artist_id], key=f'matches:artist:{artist_id}')
       db.session.commit()
+      typeahead.add('artists', artist_id, name)
     except Exception as e:
       error_in_update = True
       print(f'Exception "{e}" in edit_artist_submission()')
@@ -695,6 +1738,7 @@ def edit_artist_submission(artist_id):
       db.session.close()
 
     if not error_in_update:
+      page_cache.invalidate(*pages)
       # on successful db update, flash success
       flash('Artist ' + request.form['name'] + ' was successfully updated!')
       return redirect(url_for('show_artist', artist_id=artist_id))
@@ -706,10 +1750,11 @@ def edit_artist_submission(artist_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   # TODO: populate form with values from venue with ID <venue_id>
+  from forms import VenueForm
 
   # Get the existing venue from the database
   venue = Venue.query.get(venue_id)
-  if not venue:
+  if not venue or venue.deleted_at is not None:
     # redirect home
     return redirect(url_for('index'))
   else:
@@ -753,8 +1798,13 @@ def edit_venue(venue_id):
 def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
+  from forms import VenueForm
   form = VenueForm()
 
+  # deleted venues can't be edited, nor brought back by an edit (see edit_venue)
+  if db.session.query(Venue.id).filter(Venue.id == venue_id, Venue.deleted_at.is_(None)).scalar() is None:
+    return redirect(url_for('index'))
+
   name = form.name.data.strip()
   city = form.city.data.strip()
   state = form.state.data
@@ -778,8 +1828,8 @@ def edit_venue_submission(venue_id):
 
     # Insert form data into DB
     try:
-      venue = Venue.query.get(venue_id)
-      # venue = Venue.query.filter_by(id=venue_id).one_or_none()
+      # locked so a concurrent delete waits, one in between fails the update
+      venue = Venue.query.filter(Venue.id == venue_id, Venue.deleted_at.is_(None)).with_for_update().one()
 
       # Update
       venue.name = name
@@ -792,20 +1842,15 @@ def edit_venue_submission(venue_id):
       venue.image_link = image_link
       venue.website = website
       venue.facebook_link = facebook_link
+      for column, value in venue_location(city, state, address).items():
+        setattr(venue, column, value)
 
-      # Clear all the existing genres off the venue ... OR => venue.genres.clear()
-      # venue.genres.clear()
-      venue.genres = []
-      
-      for genre in genres:
-        fetch_genre = Genre.query.filter_by(name=genre).one_or_none() 
-        if fetch_genre:
-          venue.genres.append(fetch_genre)
-        else:
-          new_genre = Genre(name=genre)
-          db.session.add(new_genre)
-          venue.genres.append(new_genre)  
+      # Replace all the existing genres of the venue
+      set_genres(venue_genre_table, 'venue_id', venue_id, genres)
+      pages = venue_pages(venue_id)
+      defer_refresh_matches(venue_ids=[venue_id], key=f'matches:venue:{venue_id}')
       db.session.commit()
+      typeahead.add('venues', venue_id, name)
     except Exception as e:
       error_in_update = True
       print(f'Exception "{e}" in edit_venue_submission()')
@@ -814,6 +1859,7 @@ def edit_venue_submission(venue_id):
       db.session.close()
 
     if not error_in_update:
+      page_cache.invalidate(*pages)
       # on successful db update, flash success
       flash('Venue ' + request.form['name'] + ' was successfully updated!')
       return redirect(url_for('show_venue', venue_id=venue_id))
@@ -829,6 +1875,7 @@ def edit_venue_submission(venue_id):
 
 @app.route('/artists/create', methods=['GET'])
 def create_artist_form():
+  from forms import ArtistForm
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
@@ -837,6 +1884,7 @@ def create_artist_submission():
   # called upon submitting the new artist listing form
   # TODO: insert form data as a new Venue record in the db, instead
   # TODO: modify data to be the data object returned from db insertion
+  from forms import ArtistForm
   form = ArtistForm()
 
   name = form.name.data.strip()
@@ -865,16 +1913,12 @@ def create_artist_submission():
         new_artist = Artist(name=name, city=city, state=state, phone=phone, \
           seeking_venue=seeking_venue, seeking_description=seeking_description, image_link=image_link, \
           website=website, facebook_link=facebook_link)
-        for genre in genres:
-          fetch_genre = Genre.query.filter_by(name=genre).one_or_none()
-          if fetch_genre:
-            new_artist.genres.append(fetch_genre)
-
-          else:
-            new_genre = Genre(name=genre)
-            db.session.add(new_genre)
-            new_artist.genres.append(new_genre)
         db.session.add(new_artist)
+        # flush to get the new id for the genre links
+        db.session.flush()
+        set_genres(artist_genre_table, 'artist_id', new_artist.id, genres)
+        defer_refresh_matches(artist_ids=[new_artist.id], key=f'matches:artist:{new_artist.id}')
+        new_id = new_artist.id
         db.session.commit()
     except Exception as e:
       error_in_insert = True
@@ -885,6 +1929,8 @@ def create_artist_submission():
 
     # validating input
     if not error_in_insert:
+      page_cache.invalidate('artists')
+      typeahead.add('artists', new_id, name)
       # on successful db insert, flash success
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
       return redirect(url_for('index'))
@@ -900,56 +1946,83 @@ def create_artist_submission():
   return render_template('pages/home.html')
 
 
-@app.route('/artists/<artist_id>/delete', methods=['GET'])
+@app.route('/artists/<int:artist_id>/delete', methods=['DELETE'])
 def delete_artist(artist_id):
   # TODO: delete form data of artist as a new Venue record in the db
 
   # Deletes a artist based on AJAX call from the artist page
-  artist = Artist.query.get(artist_id)
-  if not artist:
-    # redirect home
-    return redirect(url_for('index'))
+  error_on_delete = False
+  try:
+    pages = delete_owner(Artist, 'artist_id', artist_id)
+    db.session.commit()
+  except Exception as e:
+    error_on_delete = True
+    print(f'Exception "{e}" in delete_artist()')
+    db.session.rollback()
+  finally:
+    db.session.close()
+  if error_on_delete:
+    flash(f'An error occurred deleting artist {artist_id}.')
+    print("Error in delete_artist()")
+    abort(500)
+  elif pages is None:
+    abort(404)
   else:
-    error_on_delete = False
-    artist_name = artist.name
-    try:
-      db.session.delete(artist)
-      db.session.commit()
-    except:
-      error_on_delete = True
-      db.session.rollback()
-    finally:
-      db.session.close()
-    if error_on_delete:
-      flash(f'An error occurred deleting artist {artist_name}.')
-      print("Error in delete_artist()")
-      abort(500)
-    else:
-      # return redirect(url_for('artists'))
-      return jsonify({
-        'deleted': True,
-        'url': url_for('artists')
-      })
+    page_cache.invalidate(*pages)
+    typeahead.remove('artists', artist_id)
+    # return redirect(url_for('artists'))
+    return jsonify({
+      'deleted': True,
+      'url': url_for('artists')
+    })
 
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@page_cache.cached('shows')
+@read_only
 def shows():
   # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
+  # Pages by keyset on (start_time, id) instead of OFFSET, so any page costs the same
+  # as the first one. Upcoming shows run soonest first, past shows most recent first.
+  when = request.args.get('when', 'upcoming')
+  if when not in ('upcoming', 'past'):
+    abort(404)
+  cursor = request.args.get('after')
+  per_page = app.config['SHOWS_PER_PAGE']
+  now = datetime.now()
+
+  # venue and artist columns come from the same query, no lazy loads per row
+  query = live_shows(db.session.query(
+      Show.id, Show.start_time, Show.venue_id, Venue.name, Show.artist_id, Artist.name, Artist.image_link
+  ))
+  key = db.tuple_(Show.start_time, Show.id)
+  if when == 'upcoming':
+    query = query.filter(Show.start_time > now).order_by(Show.start_time, Show.id)
+    if cursor:
+      query = query.filter(key > decode_show_cursor(cursor))
+  else:
+    query = query.filter(Show.start_time <= now).order_by(Show.start_time.desc(), Show.id.desc())
+    if cursor:
+      query = query.filter(key < decode_show_cursor(cursor))
+
+  # one extra row tells us whether there is a next page
+  rows = query.limit(per_page + 1).all()
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_show_cursor(rows[-1][1], rows[-1][0])
+
   data = []
-  shows = Show.query.all()
-  
-  for show in shows:
+  for show_id, start_time, venue_id, venue_name, artist_id, artist_name, artist_image_link in rows:
     data.append({
-      "venue_id": show.venue.id,
-      "venue_name": show.venue.name,
-      "artist_id": show.artist.id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": format_datetime(str(show.start_time))
+      "venue_id": venue_id,
+      "venue_name": venue_name,
+      "artist_id": artist_id,
+      "artist_name": artist_name,
+      "artist_image_link": artist_image_link,
+      "start_time": start_time
     })
   # data = [{
   #     "venue_id": 1,
@@ -966,11 +2039,12 @@ def shows():
   #     "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
   #     "start_time": "2019-06-15T23:00:00.000Z"
   # }]
-  return render_template('pages/shows.html', shows=data)
+  return stream_page('pages/shows.html', shows=data, when=when, next_cursor=next_cursor)
 
 @app.route('/shows/create', methods=['GET'])
 def create_shows():
   # renders form. do not touch.
+  from forms import ShowForm
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
@@ -978,19 +2052,50 @@ def create_shows():
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
+  from forms import ShowForm
   form = ShowForm()
 
-  artist_id = form.artist_id.data.strip()
-  venue_id = form.venue_id.data.strip()
+  # Problems are reported next to the fields of the re-rendered form
+  if not form.validate():
+    return render_template('forms/new_show.html', form=form), 400
+
+  artist_id = int(form.artist_id.data)
+  venue_id = int(form.venue_id.data)
   start_time = form.start_time.data
+  end_time = start_time + timedelta(minutes=form.duration.data or app.config['DEFAULT_SHOW_MINUTES'])
+
+  if db.session.query(Artist.id).filter(Artist.id == artist_id, Artist.deleted_at.is_(None)).scalar() is None:
+    form.artist_id.errors.append(f'There is no artist with ID {artist_id}.')
+  if db.session.query(Venue.id).filter(Venue.id == venue_id, Venue.deleted_at.is_(None)).scalar() is None:
+    form.venue_id.errors.append(f'There is no venue with ID {venue_id}.')
+  if form.artist_id.errors or form.venue_id.errors:
+    return render_template('forms/new_show.html', form=form), 400
+
+  conflict = booking_conflict(venue_id, artist_id, start_time, end_time)
+  if conflict is not None:
+    booked = f'venue {venue_id}' if conflict.venue_id == venue_id else f'artist {artist_id}'
+    form.start_time.errors.append(
+      f'Conflicts with show {conflict.id}: {booked} is booked from '
+      f'{format_datetime(conflict.start_time)} to {format_datetime(conflict.end_time)}.'
+    )
+    return render_template('forms/new_show.html', form=form), 409
 
   error_in_insert = False
   
   try:
-    new_show = Show(start_time=start_time, artist_id=artist_id, venue_id=venue_id)
+    new_show = Show(start_time=start_time, end_time=end_time, artist_id=artist_id, venue_id=venue_id)
     db.session.add(new_show)
+    count_new_shows([{'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time}])
+    defer_refresh_matches([artist_id], [venue_id], key=f'matches:show:{artist_id}:{venue_id}')
     db.session.commit()
-  except:
+  except exc.IntegrityError as e:
+    # a concurrent booking got in between the check and the insert, and the exclusion
+    # constraint caught it
+    db.session.rollback()
+    print(f'Exception "{e}" in create_show_submission()')
+    form.start_time.errors.append('This slot was just booked by someone else.')
+    return render_template('forms/new_show.html', form=form), 409
+  except Exception as e:
     error_in_insert = True
     print(f'Exception "{e}" in create_show_submission()')
     db.session.rollback()
@@ -1004,10 +2109,428 @@ def create_show_submission():
     flash(f'An error occurred.  Show could not be listed.')
     print("Error in create_show_submission()")
   else:
+    # the venue directory shows upcoming counts, so it changes with every new show
+    page_cache.invalidate('shows', 'venues', f'venue:{venue_id}', f'artist:{artist_id}',
+                          calendar_page('venue', venue_id, start_time.year, start_time.month),
+                          calendar_page('artist', artist_id, start_time.year, start_time.month))
     # on successful db insert, flash success
     flash('Show was successfully listed!')
   return render_template('pages/home.html')
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+# Name suggestions for the navbar search boxes, from an in-memory prefix index of each
+# worker (see typeahead.py) rather than the database.
+
+def live_names(model):
+  # (id, name) of every venue or artist not soft deleted, to build the index from
+  return lambda: db.session.execute(db.select(model.id, model.name).where(model.deleted_at.is_(None))).all()
+
+typeahead = Typeahead(app, {'venues': live_names(Venue), 'artists': live_names(Artist)})
+
+# ?type= -> (model, counter, page endpoint, its id argument)
+AUTOCOMPLETE_KINDS = {
+  'venues': (Venue, VenueShowCount, 'show_venue', 'venue_id'),
+  'artists': (Artist, ArtistShowCount, 'show_artist', 'artist_id')
+}
+
+@app.route('/autocomplete')
+@read_only
+def autocomplete():
+  # ?type=venues|artists&q=<what was typed so far>, names with a word starting with it
+  kind = request.args.get('type', 'venues')
+  if kind not in AUTOCOMPLETE_KINDS:
+    api_error('type must be one of ' + ', '.join(AUTOCOMPLETE_KINDS))
+  model, counter, endpoint, argument = AUTOCOMPLETE_KINDS[kind]
+  term = request.args.get('q', '').strip()
+  limit = min(max(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int), 1),
+              app.config['AUTOCOMPLETE_LIMIT'])
+  results = typeahead.search(kind, term, limit) if term else []
+  if results is None:
+    # no index, it would have been over AUTOCOMPLETE_MAX_BYTES, the name search answers
+    results = [(row['id'], row['name']) for row in search_by_name(model, counter, term, 1, limit)[1]]
+  return jsonify({
+    'results': [{
+      'id': owner_id,
+      'name': name,
+      'url': url_for(endpoint, **{argument: owner_id})
+    } for owner_id, name in results]
+  })
+
+#  API
+#  ----------------------------------------------------------------
+# Read-only JSON API for partner integrations. Lists are paged by id (?after=<cursor>),
+# ?fields= picks columns, and ?format=ndjson streams every row from a server-side cursor
+# as newline-delimited JSON instead of building one big list.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+API_RESOURCES = {
+  'venues': (Venue, ['id', 'name', 'city', 'state', 'address', 'phone', 'website', 'facebook_link',
+                     'image_link', 'seeking_talent', 'seeking_description', 'latitude', 'longitude']),
+  'artists': (Artist, ['id', 'name', 'city', 'state', 'phone', 'website', 'facebook_link',
+                       'image_link', 'seeking_venue', 'seeking_description']),
+  'shows': (Show, ['id', 'start_time', 'end_time', 'venue_id', 'artist_id']),
+  'genres': (Genre, ['id', 'name'])
+}
+
+def api_error(message, status=400):
+  abort(make_response(jsonify({'error': message}), status))
+
+def api_resource(resource):
+  # (model, selected field names) for a resource, honouring ?fields=
+  if resource not in API_RESOURCES:
+    api_error(f'Unknown resource {resource}', 404)
+  model, fields = API_RESOURCES[resource]
+  if request.args.get('fields'):
+    selected = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+    unknown = [field for field in selected if field not in fields]
+    if unknown:
+      api_error('Unknown fields: ' + ', '.join(unknown))
+    # the id is always returned, it is the pagination cursor
+    fields = ['id'] + [field for field in selected if field != 'id']
+  return model, fields
+
+def api_live(model, query):
+  # soft deleted venues and artists, and their shows, are not exported
+  if model is Show:
+    return live_shows(query)
+  if hasattr(model, 'deleted_at'):
+    return query.where(model.deleted_at.is_(None))
+  return query
+
+def api_row(fields, row):
+  return {field: value.isoformat() if isinstance(value, datetime) else value for field, value in zip(fields, row)}
+
+@api.before_request
+def api_read_only():
+  # the whole API is read-only
+  g.use_replica = session.get('read_primary_until', 0) < time.time()
+
+@api.route('/<resource>')
+def api_list(resource):
+  model, fields = api_resource(resource)
+  query = api_live(model, db.select(*[getattr(model, field) for field in fields])).order_by(model.id)
+  after = request.args.get('after')
+  if after is not None:
+    if not after.isdigit():
+      api_error('after must be an id')
+    query = query.where(model.id > int(after))
+
+  if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+    def generate():
+      # stream_results asks the driver for a server-side cursor, yield_per bounds
+      # how many rows are held in memory at once
+      rows = db.session.execute(query.execution_options(stream_results=True, yield_per=app.config['API_STREAM_BATCH_SIZE']))
+      for row in rows:
+        yield json.dumps(api_row(fields, row)) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+  limit = request.args.get('limit', app.config['API_PAGE_SIZE'], type=int)
+  limit = min(max(limit, 1), app.config['API_MAX_PAGE_SIZE'])
+  # one extra row tells us whether there is a next page
+  rows = db.session.execute(query.limit(limit + 1)).all()
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_cursor = str(rows[-1][0])
+  return jsonify({
+    'data': [api_row(fields, row) for row in rows],
+    'next': next_cursor
+  })
+
+@api.route('/<resource>/<int:item_id>')
+def api_item(resource, item_id):
+  model, fields = api_resource(resource)
+  row = db.session.execute(api_live(model, db.select(*[getattr(model, field) for field in fields])).where(model.id == item_id)).first()
+  if row is None:
+    api_error(f'No {resource} with id {item_id}', 404)
+  return jsonify({'data': api_row(fields, row)})
+
+app.register_blueprint(api)
+
+#  Commands
+#  ----------------------------------------------------------------
+# flask import venues|artists|shows FILE loads a CSV or NDJSON file in chunked
+# transactions. Rows are validated with the same forms as the create pages.
+
+IMPORT_FORMS = {
+  'venues': 'VenueForm',
+  'artists': 'ArtistForm',
+  'shows': 'ShowForm'
+}
+
+def import_form(kind, raw):
+  # Runs one input row through the create form, returns (form, errors)
+  formdata = MultiDict()
+  for key, value in raw.items():
+    if key == 'genres':
+      names = value if isinstance(value, list) else (value or '').split(',')
+      for name in names:
+        if name.strip():
+          formdata.add('genres', name.strip())
+    elif value is not None:
+      formdata.add(key, value if isinstance(value, str) else str(value))
+  import forms
+  form = getattr(forms, IMPORT_FORMS[kind])(formdata=formdata, meta={'csrf': False})
+  return form, (None if form.validate() else form.errors)
+
+def import_values(kind, form):
+  # The column values for a validated row, cleaned up like the create handlers do
+  def text(field):
+    return (field.data or '').strip()
+  if kind == 'shows':
+    return {
+      'artist_id': int(form.artist_id.data),
+      'venue_id': int(form.venue_id.data),
+      'start_time': form.start_time.data,
+      'end_time': form.start_time.data + timedelta(minutes=form.duration.data or app.config['DEFAULT_SHOW_MINUTES'])
+    }
+  values = {
+    'name': text(form.name),
+    'city': text(form.city),
+    'state': form.state.data,
+    'phone': re.sub(r'\D', '', form.phone.data or ''),
+    'image_link': text(form.image_link),
+    'website': text(form.website),
+    'facebook_link': text(form.facebook_link),
+    'seeking_description': text(form.seeking_description)
+  }
+  if kind == 'venues':
+    values['address'] = text(form.address)
+    values['seeking_talent'] = form.seeking_talent.data == 'Yes'
+    values.update(venue_location(values['city'], values['state'], values['address']))
+  else:
+    values['seeking_venue'] = form.seeking_venue.data == 'Yes'
+  return values
+
+def import_insert(table, rows, returning_ids):
+  # COPY on Postgres, executemany elsewhere. When ids are needed for the genre links,
+  # Postgres draws them from the sequence up front so COPY can write them.
+  columns = list(rows[0])
+  if db.session.get_bind().dialect.name == 'postgresql':
+    ids = None
+    if returning_ids:
+      ids = db.session.execute(
+        db.text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+        {'table': f'"{table.name}"', 'n': len(rows)}
+      ).scalars().all()
+      columns = ['id'] + columns
+      rows = [dict(row, id=row_id) for row, row_id in zip(rows, ids)]
+    copy_rows(db.session.connection(), table.name, columns, [[row[column] for column in columns] for row in rows])
+    return ids
+  if returning_ids:
+    return db.session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+  db.session.execute(table.insert(), rows)
+
+def import_chunk(kind, valid):
+  # Inserts one chunk of validated (form, values) rows, returns the cache namespaces it touched
+  if kind == 'shows':
+    rows = [values for _, values in valid]
+    import_insert(Show.__table__, rows, returning_ids=False)
+    count_new_shows(rows)
+    pages = refresh_matches({row['artist_id'] for row in rows}, {row['venue_id'] for row in rows})
+    return (['shows', 'venues'] + pages + [f'venue:{venue_id}' for venue_id in {row['venue_id'] for row in rows}]
+            + [f'artist:{artist_id}' for artist_id in {row['artist_id'] for row in rows}]
+            + sorted({calendar_page(owner, row[owner + '_id'], row['start_time'].year, row['start_time'].month)
+                      for row in rows for owner in ('venue', 'artist')}))
+
+  model, association, owner_column = (Venue, venue_genre_table, 'venue_id') if kind == 'venues' \
+    else (Artist, artist_genre_table, 'artist_id')
+  ids = import_insert(model.__table__, [values for _, values in valid], returning_ids=True)
+  # every genre of the chunk is resolved at once
+  names = sorted({name for form, _ in valid for name in form.genres.data})
+  genre_ids = dict(zip(names, resolve_genre_ids(names)))
+  links = [{'genre_id': genre_ids[name], owner_column: row_id}
+           for (form, _), row_id in zip(valid, ids) for name in dict.fromkeys(form.genres.data)]
+  if links:
+    db.session.execute(association.insert(), links)
+  return [kind] + refresh_matches(**{owner_column + 's': ids})
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+def import_command(kind, path, chunk_size):
+  """Bulk-load venues, artists or shows from a CSV or NDJSON file."""
+  started = time.perf_counter()
+  inserted = rejected = 0
+  with app.test_request_context():
+    for chunk in chunked(read_rows(path), chunk_size):
+      valid = []
+      for line_number, raw in chunk:
+        form, errors = import_form(kind, raw)
+        if errors:
+          rejected += 1
+          for field, messages in errors.items():
+            click.echo(f'{path}:{line_number}: {field}: {"; ".join(messages)}', err=True)
+        else:
+          valid.append((line_number, form, import_values(kind, form)))
+
+      if kind == 'shows' and valid:
+        # COPY would abort the whole chunk on a foreign key violation, so check up front
+        venue_ids = {values['venue_id'] for _, _, values in valid}
+        artist_ids = {values['artist_id'] for _, _, values in valid}
+        # soft-deleted ones are unknown too, as they are to create_show_submission
+        known_venues = {venue_id for (venue_id,) in db.session.query(Venue.id).filter(
+          Venue.id.in_(venue_ids), Venue.deleted_at.is_(None))}
+        known_artists = {artist_id for (artist_id,) in db.session.query(Artist.id).filter(
+          Artist.id.in_(artist_ids), Artist.deleted_at.is_(None))}
+        checked = []
+        for line_number, form, values in valid:
+          if values['venue_id'] not in known_venues or values['artist_id'] not in known_artists:
+            rejected += 1
+            click.echo(f'{path}:{line_number}: unknown venue_id or artist_id', err=True)
+          else:
+            checked.append((line_number, form, values))
+        valid = checked
+
+      if kind == 'shows' and valid:
+        # double bookings, against the database and within the chunk, are rejected row by
+        # row like create_show_submission does, rather than failing the whole chunk on the
+        # Postgres exclusion constraints
+        checked = []
+        for (line_number, form, values), conflict in zip(valid, booking_conflicts([values for _, _, values in valid])):
+          if conflict is None:
+            checked.append((line_number, form, values))
+            continue
+          fk, show_id, index, start_time, end_time = conflict
+          rejected += 1
+          other = f'show {show_id}' if show_id is not None else f'line {valid[index][0]}'
+          click.echo(f'{path}:{line_number}: conflicts with {other}: {fk[:-3]} {values[fk]} is booked from '
+                     f'{format_datetime(start_time)} to {format_datetime(end_time)}', err=True)
+        valid = checked
+
+      if not valid:
+        continue
+      try:
+        pages = import_chunk(kind, [(form, values) for _, form, values in valid])
+        db.session.commit()
+      except Exception as e:
+        db.session.rollback()
+        rejected += len(valid)
+        click.echo(f'{path}:{valid[0][0]}-{valid[-1][0]}: chunk rolled back: {e}', err=True)
+      else:
+        inserted += len(valid)
+        page_cache.invalidate(*pages)
+
+  elapsed = time.perf_counter() - started
+  click.echo(f'Imported {inserted} {kind} ({rejected} rejected) in {elapsed:.2f}s, '
+             f'{inserted / elapsed if elapsed else 0:.0f} rows/s')
+
+@app.cli.command('precompile-templates')
+def precompile_templates_command():
+  """Compile every template into the Jinja bytecode cache, for deploys."""
+  started = time.perf_counter()
+  names = app.jinja_env.list_templates(extensions=['html'])
+  for name in names:
+    app.jinja_env.get_template(name)
+  click.echo(f'Compiled {len(names)} templates in {time.perf_counter() - started:.2f}s')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+  """Bundle, fingerprint and precompress static/ into static/dist, for deploys."""
+  started = time.perf_counter()
+  manifest = assets.build()
+  click.echo(f'Built {len(manifest)} assets in {time.perf_counter() - started:.2f}s')
+
+@app.cli.command('sweep-shows')
+@click.option('--rebuild', is_flag=True, help='Recount every venue and artist from the Show table.')
+def sweep_shows_command(rebuild):
+  """Move shows that have started from the upcoming to the past counts."""
+  # the job workers sweep every SWEEP_SHOWS_SECONDS, this is for a sweep by hand or --rebuild
+  started = time.perf_counter()
+  if rebuild:
+    for fk in SHOW_COUNTERS:
+      recount_shows(fk)
+  pages = sweep_show_counts(datetime.now())
+  db.session.commit()
+  page_cache.invalidate(*pages)
+  click.echo(f'Swept show counts in {time.perf_counter() - started:.2f}s')
+
+@app.cli.command('refresh-matches')
+def refresh_matches_command():
+  """Rank the suggested matches of every artist and venue from scratch."""
+  # fills the table on an existing database, and re-scores it after matching.py changed
+  started = time.perf_counter()
+  pages = rebuild_matches()
+  matches = db.session.query(db.func.count()).select_from(Match).scalar()
+  db.session.commit()
+  page_cache.invalidate(*pages)
+  click.echo(f'Ranked {matches} matches in {time.perf_counter() - started:.2f}s')
+
+@app.cli.command('worker')
+@click.option('--threads', type=int, help='Jobs run at once, JOBS_THREADS by default.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+def worker_command(threads, burst):
+  """Run background jobs, for when JOBS_IN_PROCESS is off."""
+  # stopping with ctrl-c lets the jobs already running finish
+  started = time.perf_counter()
+  try:
+    jobs.work(threads, burst)
+  except KeyboardInterrupt:
+    pass
+  click.echo(f'Worker stopped after {time.perf_counter() - started:.2f}s')
+
+@app.cli.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True, help='Locate every venue again, not only those without coordinates.')
+@click.option('--batch-size', default=1000, show_default=True, help='Venues updated per statement.')
+def geocode_venues_command(everything, batch_size):
+  """Fill in venue coordinates from the gazetteer."""
+  # for venues from before the coordinate columns, or after the gazetteer changed
+  query = db.select(Venue.id, Venue.city, Venue.state, Venue.address).order_by(Venue.id)
+  if not everything:
+    query = query.where(Venue.geocell.is_(None))
+  rows = db.session.execute(query).all()
+  table = Venue.__table__
+  located = 0
+  for chunk in chunked(rows, batch_size):
+    values = []
+    for venue_id, city, state, address in chunk:
+      location = venue_location(city, state, address)
+      located += location['geocell'] is not None
+      values.append({'b_id': venue_id, **{'b_' + column: value for column, value in location.items()}})
+    db.session.execute(table.update().where(table.c.id == db.bindparam('b_id')).values(
+      latitude=db.bindparam('b_latitude'), longitude=db.bindparam('b_longitude'), geocell=db.bindparam('b_geocell')
+    ), values)
+    db.session.commit()
+  click.echo(f'Located {located} of {len(rows)} venues')
+
+@app.cli.command('build-gazetteer')
+@click.argument('places', type=click.Path(exists=True, dir_okay=False))
+@click.argument('zctas', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', type=click.Path(dir_okay=False), help='File to write, GAZETTEER_PATH by default.')
+def build_gazetteer_command(places, zctas, output):
+  """Write the gazetteer from the Census places and ZCTA gazetteer files."""
+  # e.g. 2023_Gaz_place_national.txt and 2023_Gaz_zcta_national.txt, then geocode-venues --all
+  # the cities of the current gazetteer keep their centres
+  output = output or app.config['GAZETTEER_PATH']
+  gazetteer.load()
+  written, zip_codes = build_gazetteer(places, zctas, output, gazetteer.places)
+  click.echo(f'Wrote {written} places and {zip_codes} ZIP codes to {output}')
+
+@app.cli.command('purge-deleted')
+@click.option('--days', default=30, show_default=True, help='Only purge rows soft deleted at least this long ago.')
+def purge_deleted_command(days):
+  """Delete soft deleted venues and artists for good, with their shows."""
+  # one DELETE per table, the database cascades to shows, genre links and counters
+  cutoff = datetime.now() - timedelta(days=days)
+  for model in (Venue, Artist):
+    table = model.__table__
+    result = db.session.execute(table.delete().where(table.c.deleted_at <= cutoff))
+    click.echo(f'Purged {result.rowcount} {table.name.lower()}s')
+  db.session.commit()
+
+@app.route('/cache/stats')
+def cache_stats():
+  # page cache hit/miss counters and autocomplete index sizes of this worker
+  return jsonify(dict(page_cache.stats(), autocomplete=typeahead.stats()))
+
+@app.route('/jobs/stats')
+def jobs_stats():
+  # background jobs by name and status, with run times, from the Job table
+  return jsonify(jobs.stats())
+
 # handling 404 ad 500 errors to display more specific messages to users on what exactly happened
 # not_found - 404
 @app.errorhandler(404)
@@ -1051,7 +2574,11 @@ if not app.debug:
     )
     app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    # requests only put records on a queue, a background thread does the file writes
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    log_listener.start()
+    app.logger.addHandler(QueueHandler(log_queue))
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
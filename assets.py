@@ -0,0 +1,191 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory, url_for
+
+# Static asset pipeline. `flask build-assets` concatenates and minifies the CSS and JS
+# bundles below, copies every file under static/ to static/dist/ with a content hash in
+# its name, and writes .gz and .br siblings of the compressible ones. The manifest maps
+# the plain names to the hashed ones, and url_for('static', filename=...) emits the
+# hashed name whenever there is one. Hashed files never change, so they are served with
+# an immutable Cache-Control and, when the client accepts it, precompressed.
+#
+# Without a build (development) everything is served from the plain names as before.
+
+BUNDLES = {
+    'css/app.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    # modernizr has to run in <head>, before the page renders
+    'js/head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+        'js/script.js',
+    ],
+    'js/app.js': [
+        'js/libs/jquery-1.11.1.min.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+    ],
+}
+
+DIST = 'dist'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.eot', '.ttf', '.otf')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def minify_css(css):
+    # Comments and insignificant whitespace only. License comments (/*! */) stay, and
+    # the space before ':' is kept since it is significant in selectors.
+    css = re.sub(r'/\*(?!!).*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    # rjsmin when it is installed. The libraries are shipped minified already, so
+    # without it only the source map references are dropped.
+    try:
+        import rjsmin
+    except ImportError:
+        return js
+    return rjsmin.jsmin(js, keep_bang_comments=True)
+
+
+def fingerprint(path, content):
+    stem, extension = posixpath.splitext(path)
+    return f'{DIST}/{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+
+class Assets:
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.load()
+        app.url_defaults(self.hashed_static_url)
+        app.view_functions['static'] = self.send_static
+        app.jinja_env.globals['bundle'] = self.bundle
+
+    def manifest_path(self):
+        return os.path.join(self.app.static_folder, DIST, 'manifest.json')
+
+    def load(self):
+        try:
+            with open(self.manifest_path()) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def hashed_static_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def bundle(self, name):
+        # URLs to include for a bundle: the built file, or its sources before a build
+        if name in self.manifest:
+            return [url_for('static', filename=name)]
+        return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+    def send_static(self, filename):
+        if not filename.startswith(DIST + '/'):
+            return self.app.send_static_file(filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = None
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in request.accept_encodings and \
+                    os.path.isfile(os.path.join(self.app.static_folder, filename + suffix)):
+                response = send_from_directory(self.app.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.app.static_folder, filename, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def build(self):
+        # Writes static/dist and its manifest, returns the new manifest. Files of earlier
+        # builds are left alone, pages rendered before a deploy may still point at them.
+        static = self.app.static_folder
+        dist = os.path.join(static, DIST)
+        manifest = {}
+
+        # single files first, the CSS bundle points at their hashed names
+        for directory, dirnames, filenames in os.walk(static):
+            dirnames[:] = sorted(name for name in dirnames if os.path.join(directory, name) != dist)
+            for filename in sorted(filenames):
+                path = os.path.relpath(os.path.join(directory, filename), static).replace(os.sep, '/')
+                with open(os.path.join(static, path), 'rb') as f:
+                    content = f.read()
+                manifest[path] = fingerprint(path, content)
+                self.write(manifest[path], content)
+
+        for name, sources in BUNDLES.items():
+            parts = []
+            for source in sources:
+                with open(os.path.join(static, source), encoding='utf-8') as f:
+                    text = f.read()
+                if name.endswith('.css'):
+                    parts.append(minify_css(self.rewrite_urls(text, source, manifest)))
+                else:
+                    text = re.sub(r'^//[#@] sourceMappingURL=.*$', '', text, flags=re.M)
+                    parts.append(minify_js(text).rstrip().rstrip(';') + ';')
+            content = '\n'.join(parts).encode('utf-8')
+            manifest[name] = fingerprint(name, content)
+            self.write(manifest[name], content)
+
+        with open(self.manifest_path(), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        self.manifest = manifest
+        return manifest
+
+    def rewrite_urls(self, css, source, manifest):
+        # url()s are relative to the source file, which the bundle no longer sits next
+        # to. They become absolute, pointing at the hashed copy when there is one.
+        def replace(match):
+            target = match.group(2)
+            if re.match(r'^(data:|https?:|/|#)', target):
+                return match.group(0)
+            path, suffix = re.match(r'^([^?#]*)(.*)$', target).groups()
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+            return f'url("{self.app.static_url_path}/{manifest.get(path, path)}{suffix}")'
+        return re.sub(r'url\((["\']?)([^"\')]+)\1\)', replace, css)
+
+    def write(self, path, content):
+        destination = os.path.join(self.app.static_folder, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, 'wb') as f:
+            f.write(content)
+        if destination.endswith(COMPRESSIBLE):
+            self.compress(destination, content)
+
+    def compress(self, path, content):
+        # .gz always, .br when the brotli package is installed. A sibling that does not
+        # come out smaller is not written.
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        try:
+            import brotli
+        except ImportError:
+            pass
+        else:
+            variants.append(('.br', brotli.compress(content, quality=11)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
@@ -0,0 +1,79 @@
+# /autocomplete: builds the name index off the database named by DATABASE_URL, reports
+# its build time and memory, then times random prefixes of real names through the
+# endpoint. Exits with 1 when p99 misses the target or an index is over
+# AUTOCOMPLETE_MAX_BYTES, so it can gate a change.
+#
+#   DATABASE_URL=sqlite:////tmp/fyyur_bench.db python benchmarks/bench_autocomplete.py [--p99-ms 10]
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, typeahead
+
+
+def percentile(samples, fraction):
+  ordered = sorted(samples)
+  return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def prefixes(index, count, rng):
+  # what a user typing would send: the start of some word of a name, 1 to 6 characters
+  folded = list(index.folded.values())
+  terms = []
+  for _ in range(count):
+    words = rng.choice(folded).split() or ['a']
+    word = rng.choice(words)
+    terms.append(word[:rng.randint(1, 6)])
+  return terms
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark /autocomplete.')
+  parser.add_argument('-n', '--queries', type=int, default=2000)
+  parser.add_argument('--p99-ms', type=float, default=10.0, help='fail above this p99 latency')
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  tracemalloc.start()
+  started = time.perf_counter()
+  typeahead.build(wait=True)
+  built = time.perf_counter() - started
+  traced = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  failed = False
+  print(f'build {built * 1000:.0f} ms, peak traced {traced / 2 ** 20:.1f} MiB '
+        f'(ceiling {typeahead.max_bytes / 2 ** 20:.0f} MiB per index)')
+  for kind, stats in typeahead.stats().items():
+    if stats is None:
+      print(f'{kind:8} over the ceiling, served from the database')
+      failed = True
+    else:
+      print(f'{kind:8} {stats["names"]} names  {stats["entries"]} entries  {stats["bytes"] / 2 ** 20:.1f} MiB')
+
+  rng = random.Random(args.seed)
+  client = app.test_client()
+  for kind, index in typeahead.indexes.items():
+    if index is None or not index.names:
+      continue
+    terms = prefixes(index, args.queries, rng)
+    client.get(f'/autocomplete?type={kind}&q={terms[0]}')
+    timings, found = [], 0
+    for term in terms:
+      started = time.perf_counter()
+      response = client.get(f'/autocomplete?type={kind}&q={term}')
+      found += len(response.get_json()['results'])
+      timings.append(time.perf_counter() - started)
+    p99 = percentile(timings, 0.99) * 1000
+    print(f'{kind:8} p50 {percentile(timings, 0.50) * 1000:6.2f} ms  p99 {p99:6.2f} ms  '
+          f'{found / len(terms):.1f} results per query')
+    if p99 > args.p99_ms:
+      print(f'{kind:8} p99 over {args.p99_ms} ms')
+      failed = True
+
+  sys.exit(1 if failed else 0)
@@ -0,0 +1,42 @@
+# Per-row cost of formatting show start times, for a 10k-show page.
+#
+# "reparse" is what the views used to do: format str(start_time), then have the
+# |datetime('full') filter parse that string again. "direct" hands the datetime to
+# the filter once, with the Babel pattern cached.
+#
+#   python benchmarks/bench_datetime.py [rows]
+
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import babel.dates
+import dateutil.parser
+from app import format_datetime, DATETIME_FORMATS
+
+
+def reparse_format_datetime(value, format='medium'):
+  # the formatter as it was: parse the string, resolve the pattern, format
+  date = dateutil.parser.parse(value)
+  return babel.dates.format_datetime(date, DATETIME_FORMATS.get(format, format))
+
+def reparse(start_times):
+  for start_time in start_times:
+    reparse_format_datetime(reparse_format_datetime(str(start_time)), 'full')
+
+def direct(start_times):
+  for start_time in start_times:
+    format_datetime(start_time, 'full')
+
+
+if __name__ == '__main__':
+  rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  start = datetime(2020, 1, 1, 20, 30)
+  start_times = [start + timedelta(hours=7 * i) for i in range(rows)]
+
+  for name, run in (('reparse', reparse), ('direct', direct)):
+    best = min(timeit.repeat(lambda: run(start_times), number=1, repeat=5))
+    print(f'{name:8} {best * 1000:9.1f} ms/page  {best / rows * 1e6:7.2f} us/row  ({rows} rows)')
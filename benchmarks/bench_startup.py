@@ -0,0 +1,62 @@
+# Worker cold start: how long a fresh interpreter takes to import app.py, and then to
+# serve its first requests, with the Jinja bytecode cache empty ("cold") and filled by
+# `flask precompile-templates` ("warm"). Each sample is a new process.
+#
+#   DATABASE_URL=sqlite:////tmp/fyyur_bench.db python benchmarks/bench_startup.py [runs]
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child: times the import, then the first response of a few pages
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+first = {}
+for url in ("/", "/venues", "/artists/create"):
+  request_started = time.perf_counter()
+  status = client.get(url).status_code
+  first[url] = (status, time.perf_counter() - request_started)
+print(json.dumps({"import": imported - started, "first": first, "modules": len(sys.modules)}))
+'''
+
+
+def sample(cache_dir):
+  env = dict(os.environ, JINJA_BYTECODE_CACHE_DIR=cache_dir)
+  output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=ROOT, env=env, text=True)
+  return json.loads(output.strip().splitlines()[-1])
+
+def median(values):
+  values = sorted(values)
+  return values[len(values) // 2]
+
+def report(label, samples):
+  print(f'{label:5} import {median([s["import"] for s in samples]) * 1000:7.1f} ms', end='')
+  for url in samples[0]['first']:
+    print(f'   {url} {median([s["first"][url][1] for s in samples]) * 1000:6.1f} ms', end='')
+  print(f'   ({samples[0]["modules"]} modules)')
+
+
+if __name__ == '__main__':
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+  cache_dir = tempfile.mkdtemp(prefix='fyyur-jinja-')
+  try:
+    cold = []
+    for _ in range(runs):
+      shutil.rmtree(cache_dir)
+      cold.append(sample(cache_dir))
+    subprocess.check_call([sys.executable, '-m', 'flask', '--app', 'app', 'precompile-templates'], cwd=ROOT,
+                          env=dict(os.environ, JINJA_BYTECODE_CACHE_DIR=cache_dir))
+    warm = [sample(cache_dir) for _ in range(runs)]
+  finally:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+  report('cold', cold)
+  report('warm', warm)
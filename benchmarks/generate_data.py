@@ -0,0 +1,180 @@
+# Seeded synthetic dataset generator for benchmarking.
+#
+# Fills the database named by DATABASE_URL with venues, artists, genre links and shows.
+# The same seed and sizes always produce the same rows, so benchmark runs on different
+# commits see identical data.
+#
+#   DATABASE_URL=sqlite:////tmp/fyyur_bench.db python benchmarks/generate_data.py --create \
+#       --venues 10000 --artists 100000 --shows 1000000
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Venue, Artist, Show, SHOW_COUNTERS, artist_genre_table, venue_genre_table, resolve_genre_ids, recount_shows, \
+  gazetteer, rebuild_matches, venue_location
+from forms import VenueForm
+from geo import grid_cell
+from importer import chunked, copy_rows
+
+CITIES = [
+  ('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('San Diego', 'CA'), ('New York', 'NY'),
+  ('Brooklyn', 'NY'), ('Austin', 'TX'), ('Houston', 'TX'), ('Chicago', 'IL'), ('Seattle', 'WA'),
+  ('Portland', 'OR'), ('Denver', 'CO'), ('Nashville', 'TN'), ('Memphis', 'TN'), ('Atlanta', 'GA'),
+  ('New Orleans', 'LA'), ('Boston', 'MA'), ('Philadelphia', 'PA'), ('Detroit', 'MI'),
+  ('Minneapolis', 'MN'), ('Miami', 'FL'),
+]
+VENUE_WORDS = ['Hall', 'Room', 'Lounge', 'Theatre', 'Club', 'Tavern', 'Cellar', 'Garden', 'Loft', 'Stage']
+ADJECTIVES = ['Blue', 'Velvet', 'Golden', 'Electric', 'Silent', 'Wild', 'Midnight', 'Crimson', 'Lucky',
+              'Rusty', 'Neon', 'Hollow', 'Broken', 'Royal', 'Dusty', 'Little']
+NOUNS = ['Owl', 'Petals', 'Harbor', 'Engine', 'River', 'Lantern', 'Sax', 'Piano', 'Echo', 'Fox',
+         'Comet', 'Anchor', 'Tide', 'Orchard', 'Wolves', 'Saints']
+GENRES = [name for name, _ in VenueForm.genres.kwargs['choices']]
+
+
+def venue_name(rng, i):
+  return f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(VENUE_WORDS)} {i}'
+
+def artist_name(rng, i):
+  return f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}'
+
+def venue_extra(rng, row):
+  values = {'address': f'{rng.randint(1, 9999)} Main Street', 'seeking_talent': rng.random() < 0.3}
+  # Located the way the app locates a venue. When the gazetteer has ZIP codes for the
+  # city (flask build-gazetteer) the address ends in one of them. Without them the app
+  # would put every venue of a city on its centre, which leaves radius searches nothing
+  # to tell apart, so they are scattered around it instead, some 10 km either way. Both
+  # are picked by a generator of their own so the rest of the dataset doesn't depend on
+  # the gazetteer.
+  scatter = random.Random(row['id'])
+  zip_codes = gazetteer.zip_codes_in(row['city'], row['state'])
+  if zip_codes:
+    values['address'] += ', ' + scatter.choice(zip_codes)
+  location = venue_location(row['city'], row['state'], values['address'])
+  if not zip_codes and location['latitude'] is not None:
+    latitude, longitude = location['latitude'] + scatter.gauss(0, 0.1), location['longitude'] + scatter.gauss(0, 0.12)
+    location = {'latitude': latitude, 'longitude': longitude, 'geocell': grid_cell(latitude, longitude)}
+  values.update(location)
+  return values
+
+def next_id(model):
+  return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+def insert(table, rows):
+  if db.session.get_bind().dialect.name == 'postgresql':
+    columns = list(rows[0])
+    copy_rows(db.session.connection(), table.name, columns, [[row[column] for column in columns] for row in rows])
+  else:
+    db.session.execute(table.insert(), rows)
+
+def sync_sequence(model):
+  # explicit ids bypass the Postgres sequence, so move it past them
+  if db.session.get_bind().dialect.name == 'postgresql':
+    db.session.execute(db.text(
+      f"SELECT setval(pg_get_serial_sequence('\"{model.__tablename__}\"', 'id'), (SELECT max(id) FROM \"{model.__tablename__}\"))"
+    ))
+
+def generate_owners(rng, model, association, owner_column, count, name, genre_ids, chunk_size, extra):
+  first_id = next_id(model)
+  for chunk in chunked(range(first_id, first_id + count), chunk_size):
+    rows, links = [], []
+    for row_id in chunk:
+      city, state = rng.choice(CITIES)
+      row = {
+        'id': row_id,
+        'name': name(rng, row_id),
+        'city': city,
+        'state': state,
+        'phone': f'{rng.randrange(200, 999)}{rng.randrange(1000000, 9999999)}',
+        'image_link': f'https://picsum.photos/seed/{model.__tablename__.lower()}{row_id}/300',
+        'facebook_link': None,
+        'website': None,
+        'seeking_description': None,
+      }
+      row.update(extra(rng, row))
+      rows.append(row)
+      for genre_id in rng.sample(genre_ids, rng.randint(1, 3)):
+        links.append({'genre_id': genre_id, owner_column: row_id})
+    insert(model.__table__, rows)
+    insert(association, links)
+    db.session.commit()
+  sync_sequence(model)
+  db.session.commit()
+  return list(range(first_id, first_id + count))
+
+def generate_shows(rng, count, venue_ids, artist_ids, chunk_size):
+  # Two hour shows starting on the hour, spread over two years either side of now.
+  # Neither a venue nor an artist is ever double-booked, Postgres would reject that.
+  now = datetime.now().replace(minute=0, second=0, microsecond=0)
+  booked = set()
+  def free(owner, hour):
+    return not any((owner, hour + offset) in booked for offset in (-1, 0, 1))
+
+  for chunk in chunked(range(count), chunk_size):
+    rows = []
+    for _ in chunk:
+      while True:
+        venue_id, artist_id = rng.choice(venue_ids), rng.choice(artist_ids)
+        hour = rng.randint(-730, 730) * 24 + rng.randint(-4, 4)
+        if free(('venue', venue_id), hour) and free(('artist', artist_id), hour):
+          break
+      booked.update({(('venue', venue_id), hour), (('artist', artist_id), hour)})
+      start_time = now + timedelta(hours=hour)
+      rows.append({
+        'venue_id': venue_id,
+        'artist_id': artist_id,
+        'start_time': start_time,
+        'end_time': start_time + timedelta(hours=2)
+      })
+    insert(Show.__table__, rows)
+    db.session.commit()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Fill the database with a seeded synthetic dataset.')
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=5000)
+  parser.add_argument('--shows', type=int, default=50000)
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--chunk-size', type=int, default=10000)
+  parser.add_argument('--create', action='store_true', help='create the tables first (db.create_all)')
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  with app.app_context():
+    if args.create:
+      db.create_all()
+    genre_ids = resolve_genre_ids(GENRES)
+    db.session.commit()
+
+    started = time.perf_counter()
+    venue_ids = generate_owners(rng, Venue, venue_genre_table, 'venue_id', args.venues, venue_name, genre_ids,
+                                args.chunk_size, venue_extra)
+    print(f'{len(venue_ids)} venues in {time.perf_counter() - started:.1f}s')
+
+    started = time.perf_counter()
+    artist_ids = generate_owners(rng, Artist, artist_genre_table, 'artist_id', args.artists, artist_name, genre_ids,
+                                 args.chunk_size, lambda rng, row: {'seeking_venue': rng.random() < 0.3})
+    print(f'{len(artist_ids)} artists in {time.perf_counter() - started:.1f}s')
+
+    started = time.perf_counter()
+    if venue_ids and artist_ids:
+      generate_shows(rng, args.shows, venue_ids, artist_ids, args.chunk_size)
+    print(f'{args.shows} shows in {time.perf_counter() - started:.1f}s')
+
+    # one recount at the end is cheaper than counting every chunk
+    started = time.perf_counter()
+    for fk in SHOW_COUNTERS:
+      recount_shows(fk)
+    db.session.commit()
+    print(f'show counts in {time.perf_counter() - started:.1f}s')
+
+    started = time.perf_counter()
+    rebuild_matches()
+    db.session.commit()
+    print(f'suggested matches in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,187 @@
+# Route benchmark: drives the routes of app.py through the WSGI test client against the
+# database named by DATABASE_URL (fill it with generate_data.py first) and records
+# p50/p99 latency, SQL query count and peak traced memory per route.
+#
+# Results are written as JSON with sorted keys, so runs on two commits can be diffed
+# directly or with --compare.
+#
+#   DATABASE_URL=sqlite:////tmp/fyyur_bench.db python benchmarks/run_routes.py -o before.json
+#   DATABASE_URL=sqlite:////tmp/fyyur_bench.db python benchmarks/run_routes.py -o after.json --compare before.json
+#
+# Routes that change data (create, edit, delete) are left out so every run sees the
+# same dataset.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, db, page_cache, Venue, Artist, Show
+
+
+def sample_ids():
+  # the busiest venue and artist, so the detail pages are measured at their worst
+  venue_id = db.session.query(Show.venue_id).group_by(Show.venue_id).order_by(db.func.count().desc()).limit(1).scalar() \
+    or db.session.query(db.func.min(Venue.id)).scalar()
+  artist_id = db.session.query(Show.artist_id).group_by(Show.artist_id).order_by(db.func.count().desc()).limit(1).scalar() \
+    or db.session.query(db.func.min(Artist.id)).scalar()
+  now = datetime.now()
+  return {'venue_id': venue_id, 'artist_id': artist_id, 'year': now.year, 'month': now.month}
+
+# query strings for routes that can't answer without one (San Francisco, where
+# generate_data.py puts some of the venues)
+QUERY_STRINGS = {
+  'venues_near_point': 'lat=37.7749&lon=-122.4194&km=25',
+  'autocomplete': 'type=venues&q=the+d'
+}
+
+def routes(ids):
+  # (name, method, url, form data)
+  benchmarks = []
+  for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+    if 'GET' not in rule.methods or rule.endpoint in ('static', 'metrics'):
+      continue
+    if rule.endpoint.startswith('delete_'):
+      continue
+    values = {}
+    for argument in rule.arguments:
+      if argument in ids:
+        values[argument] = ids[argument]
+      elif argument == 'resource':
+        values[argument] = 'shows'
+      else:
+        break
+    else:
+      with app.test_request_context():
+        url = app.url_for(rule.endpoint, **values)
+      if rule.endpoint in QUERY_STRINGS:
+        url += '?' + QUERY_STRINGS[rule.endpoint]
+      benchmarks.append((f'GET {rule.rule}', 'GET', url, None))
+  benchmarks.append(('GET /shows?when=past', 'GET', '/shows?when=past', None))
+  # the listing filters, one at a time and all combined (values generate_data.py uses)
+  benchmarks.append(('GET /venues?state=', 'GET', '/venues?state=TX', None))
+  benchmarks.append(('GET /venues?genre=&state=&seeking=', 'GET', '/venues?genre=Jazz&state=CA&seeking=yes', None))
+  benchmarks.append(('GET /artists?genre=', 'GET', '/artists?genre=Rock+n+Roll', None))
+  benchmarks.append(('GET /artists?genre=&state=&city=&seeking=', 'GET',
+                     '/artists?genre=Rock+n+Roll&state=NY&city=Brooklyn&seeking=yes', None))
+  benchmarks.append(('GET /api/v1/<resource>?format=ndjson', 'GET', '/api/v1/venues?format=ndjson', None))
+  for kind in ('venues', 'artists'):
+    for term in ('a', 'owl'):
+      benchmarks.append((f'POST /{kind}/search {term!r}', 'POST', f'/{kind}/search', {'search_term': term}))
+  return benchmarks
+
+# Statements run by requests. Counted here rather than read off the Server-Timing
+# header, which a streamed page sends before the body runs its queries. Background
+# jobs and index builds run outside any request and are left out.
+queries = [0]
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(*args):
+  if has_request_context():
+    queries[0] += 1
+
+def percentile(samples, fraction):
+  ordered = sorted(samples)
+  return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run(client, method, url, data, iterations):
+  timings = []
+  for _ in range(iterations):
+    started = time.perf_counter()
+    response = client.open(url, method=method, data=data)
+    response.get_data()
+    timings.append(time.perf_counter() - started)
+
+  # memory is traced in a separate pass, tracing skews the timings
+  queries[0] = 0
+  tracemalloc.start()
+  response = client.open(url, method=method, data=data)
+  response.get_data()
+  response.close()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return {
+    'status': response.status_code,
+    'queries': queries[0],
+    'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+    'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+    'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+    'peak_kib': round(peak / 1024, 1)
+  }
+
+def git_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def compare(previous, current):
+  for name, result in sorted(current['routes'].items()):
+    before = previous['routes'].get(name)
+    if not before:
+      print(f'{name:45} new')
+      continue
+    change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+    print(f'{name:45} p50 {before["p50_ms"]:9.2f} -> {result["p50_ms"]:9.2f} ms ({change:+6.1f}%)  '
+          f'queries {before["queries"]} -> {result["queries"]}')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the routes of app.py.')
+  parser.add_argument('-n', '--iterations', type=int, default=50)
+  parser.add_argument('-o', '--output', default='route_benchmarks.json')
+  parser.add_argument('--compare', help='earlier results to print deltas against')
+  parser.add_argument('--with-cache', action='store_true', help='keep the rendered page cache on')
+  args = parser.parse_args()
+
+  if not args.with_cache:
+    page_cache.backend = None
+
+  with app.app_context():
+    ids = sample_ids()
+    counts = {model.__tablename__: db.session.query(db.func.count(model.id)).scalar() for model in (Venue, Artist, Show)}
+    dialect = db.engine.dialect.name
+
+  client = app.test_client()
+  results = {}
+  for name, method, url, data in routes(ids):
+    # one warm-up request so first-use costs (template compilation, ...) are not counted
+    client.open(url, method=method, data=data).get_data()
+    results[name] = run(client, method, url, data, args.iterations)
+    print(f'{name:45} {results[name]["status"]}  p50 {results[name]["p50_ms"]:9.2f} ms  '
+          f'p99 {results[name]["p99_ms"]:9.2f} ms  queries {results[name]["queries"]}  '
+          f'peak {results[name]["peak_kib"]:9.1f} KiB')
+
+  report = {
+    'meta': {
+      'commit': git_commit(),
+      'date': datetime.now().isoformat(timespec='seconds'),
+      'python': platform.python_version(),
+      'database': dialect,
+      'rows': counts,
+      'iterations': args.iterations,
+      'page_cache': args.with_cache
+    },
+    'routes': results
+  }
+  with open(args.output, 'w') as f:
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+  print(f'Wrote {args.output}')
+
+  if args.compare:
+    with open(args.compare) as f:
+      compare(json.load(f), report)
@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from functools import wraps
+
+from flask import request, session
+
+# Rendered page cache for the read-only views.
+#
+# Pages are stored under "page:<namespace>:<generation>:<path>". Invalidating a
+# namespace bumps its generation, which orphans every page cached under the old one
+# (e.g. all /shows pages, whatever their query string) without having to find them.
+
+
+class MemoryBackend:
+    # In-process LRU with a TTL. Generations live outside the LRU so that evicting
+    # them can never bring back pages of an older generation.
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def counter(self, key):
+        with self.lock:
+            return self.counters.get(key, 0)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+
+class RedisBackend:
+    # Shared across workers. Takes any client with the redis-py get/set/incr/delete
+    # calls, so a local stand-in can be dropped in.
+
+    def __init__(self, client, ttl=60, prefix='fyyur:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl or self.ttl)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class PageCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.max_page_size = 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        kind = app.config.get('PAGE_CACHE_BACKEND', 'memory')
+        ttl = app.config.get('PAGE_CACHE_TTL', 60)
+        self.max_page_size = app.config.get('PAGE_CACHE_MAX_PAGE_SIZE', self.max_page_size)
+        if kind == 'memory':
+            self.backend = MemoryBackend(app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024), ttl)
+        elif kind == 'redis':
+            self.backend = RedisBackend.from_url(app.config['PAGE_CACHE_REDIS_URL'], ttl=ttl)
+        elif kind is None:
+            self.backend = None
+        else:
+            raise ValueError(f'Unknown PAGE_CACHE_BACKEND {kind!r}')
+
+    def key(self, namespace):
+        generation = self.backend.counter('gen:' + namespace)
+        return f'page:{namespace}:{generation}:{request.full_path}'
+
+    def cached(self, namespace, ttl=None):
+        # Caches the HTML a view returns, as a string or streamed. namespace is formatted
+        # with the view arguments, e.g. 'venue:{venue_id}'. Redirects and other responses
+        # pass through.
+        # ttl overrides the backend's for pages whose namespace is invalidated precisely.
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                # pending flash messages end up in the page, which must not be shared.
+                # Nor is a client that just wrote served pages, or let it cache pages,
+                # from before its write: it reads the primary for now (see read_only).
+                if (self.backend is None or session.get('_flashes')
+                        or session.get('read_primary_until', 0) >= time.time()):
+                    return view(**kwargs)
+                key = self.key(namespace.format(**kwargs))
+                page = self.backend.get(key)
+                if page is not None:
+                    self.hits += 1
+                    return page
+                self.misses += 1
+                page = view(**kwargs)
+                if isinstance(page, str):
+                    self.backend.set(key, page, ttl)
+                elif isinstance(page, Iterator):
+                    return self.tee(key, page, ttl)
+                return page
+            return wrapper
+        return decorator
+
+    def tee(self, key, chunks, ttl):
+        # Passes a streamed page through and caches it once it was sent in full. Pages
+        # over max_page_size are not kept, nor are pages the client hung up on.
+        parts, size = [], 0
+        for chunk in chunks:
+            if parts is not None:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > self.max_page_size:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            self.backend.set(key, ''.join(parts), ttl)
+
+    def invalidate(self, *namespaces):
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self.backend.incr('gen:' + namespace)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,233 @@
+import csv
+import math
+import re
+from functools import lru_cache
+
+# Venue coordinates and radius search.
+#
+# Coordinates come from an offline gazetteer, a CSV file with city, state, zip, latitude
+# and longitude columns. Rows with a zip locate addresses ending in that ZIP code, rows
+# without one locate a city. data/gazetteer.csv holds the centres of US cities of about
+# 100k people and up. `flask build-gazetteer` replaces it with every place and ZIP code
+# of the Census Bureau's gazetteer files, from
+# https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html
+#
+# Every venue also stores a grid cell: a 50 bit geohash kept as an integer. Its leading
+# bits alternate between longitude and latitude halvings, so the venues inside any
+# coarser cell are one integer range of it. A radius search picks a cell level with
+# cells about a third of the radius across, reads the ranges of the cells around the
+# centre that come within the radius off an index, and only measures the distance of
+# the venues in there.
+
+CELL_BITS = 50
+AXIS_BITS = CELL_BITS // 2
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+ZIP_CODE = re.compile(r'\b(\d{5})(?:-\d{4})?\s*$')
+# cells per radius a search uses, more cells read fewer venues outside the circle
+CELLS_PER_RADIUS = 3
+
+
+@lru_cache(maxsize=4096)
+def place_key(city, state):
+    # 'St. Louis', 'Saint Louis' and 'st louis' are the same place
+    city = re.sub(r'[^a-z0-9 ]', '', (city or '').lower())
+    city = re.sub(r'^saint ', 'st ', ' '.join(city.split()))
+    return city, (state or '').upper()
+
+
+class Gazetteer:
+
+    def __init__(self, path):
+        self.path = path
+        self.places = None
+        self.zip_codes = None
+        self.city_zip_codes = None
+
+    def load(self):
+        # read on first use, web workers that never geocode don't pay for it
+        places, zip_codes, city_zip_codes = {}, {}, {}
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                point = (float(row['latitude']), float(row['longitude']))
+                if row.get('zip'):
+                    zip_codes[row['zip']] = point
+                    if row['city']:
+                        city_zip_codes.setdefault(place_key(row['city'], row['state']), []).append(row['zip'])
+                else:
+                    places[place_key(row['city'], row['state'])] = point
+        self.places, self.zip_codes, self.city_zip_codes = places, zip_codes, city_zip_codes
+
+    def locate(self, city, state, address=None):
+        # (latitude, longitude) of an address, else of its city, or None
+        if self.places is None:
+            self.load()
+        match = ZIP_CODE.search(address or '')
+        if match and match.group(1) in self.zip_codes:
+            return self.zip_codes[match.group(1)]
+        return self.places.get(place_key(city, state))
+
+    def zip_codes_in(self, city, state):
+        # the ZIP codes the gazetteer puts in a city, sorted
+        if self.places is None:
+            self.load()
+        return sorted(self.city_zip_codes.get(place_key(city, state), []))
+
+
+def census_rows(path):
+    # rows of a Census gazetteer file: tab separated, with padded header names
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = [name.strip() for name in next(reader)]
+        for values in reader:
+            yield dict(zip(header, (value.strip() for value in values)))
+
+
+def build_gazetteer(places_path, zcta_path, out_path, centres=None):
+    # Writes a gazetteer from the Census places and ZCTA files, returns the number of
+    # places and ZIP codes written. Places in centres, a place_key -> point dict, keep
+    # that point: the Census one is inside the place's area, which for a city with a lot
+    # of water can be miles from its centre (San Francisco's is off the coast).
+    #
+    # A ZCTA has a centre but no city, so each is put in the place whose centre is
+    # nearest relative to its size: within the radius of a circle of the place's land
+    # area, give or take half. ZIP codes outside every place keep no city, they still
+    # locate addresses ending in them.
+    places, buckets = [], {}
+    for row in census_rows(places_path):
+        # 'San Francisco city', 'Nashville-Davidson metropolitan government (balance)'
+        name = re.sub(r'( (?:[a-z]+|CDP))+$', '', row['NAME'].replace(' (balance)', ''))
+        latitude, longitude = (centres or {}).get(place_key(name, row['USPS'])) \
+            or (float(row['INTPTLAT']), float(row['INTPTLONG']))
+        radius = max(1.0, math.sqrt(float(row['ALAND']) / math.pi) / 1000)
+        place = (name, row['USPS'], latitude, longitude, radius)
+        places.append(place)
+        buckets.setdefault((math.floor(latitude), math.floor(longitude)), []).append(place)
+
+    zip_rows = []
+    for row in census_rows(zcta_path):
+        latitude, longitude = float(row['INTPTLAT']), float(row['INTPTLONG'])
+        best, best_score = None, 1.5
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for place in buckets.get((math.floor(latitude) + dy, math.floor(longitude) + dx), ()):
+                    score = haversine_km(latitude, longitude, place[2], place[3]) / place[4]
+                    if score <= best_score:
+                        best, best_score = place, score
+        city, state = best[:2] if best else ('', '')
+        zip_rows.append((city, state, row['GEOID'], latitude, longitude))
+
+    seen = set()
+    with open(out_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['city', 'state', 'zip', 'latitude', 'longitude'])
+        written = 0
+        for name, state, latitude, longitude, _ in sorted(places, key=lambda place: (place[1], place[0], -place[4])):
+            # of places with the same name in a state, the largest one
+            if place_key(name, state) not in seen:
+                seen.add(place_key(name, state))
+                writer.writerow([name, state, '', latitude, longitude])
+                written += 1
+        writer.writerows(sorted(zip_rows, key=lambda row: row[2]))
+    return written, len(zip_rows)
+
+
+def spread(value):
+    # moves bit i of a 25 bit number to bit 2i
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def grid_position(latitude, longitude):
+    # (x, y) of the finest cell holding a point
+    scale = 1 << AXIS_BITS
+    x = int((longitude + 180) / 360 * scale) % scale
+    y = min(int((latitude + 90) / 180 * scale), scale - 1)
+    return x, y
+
+
+def interleave(x, y):
+    # the longitude bit leads, as in a geohash
+    return (spread(x) << 1) | spread(y)
+
+
+def grid_cell(latitude, longitude):
+    return interleave(*grid_position(latitude, longitude))
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (math.sin((latitude2 - latitude1) / 2) ** 2
+         + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+def search_level(km, shrink):
+    # The number of leading cell bits to search with: the most for which a cell is at
+    # least km high and km wide, its width shrunk by the given factor (the cosine of the
+    # latitude).
+    for level in range(CELL_BITS, 0, -1):
+        longitude_bits, latitude_bits = (level + 1) // 2, level // 2
+        height = 180 / (1 << latitude_bits) * KM_PER_DEGREE
+        width = 360 / (1 << longitude_bits) * KM_PER_DEGREE * shrink
+        if height >= km and width >= km:
+            return level
+    return 0
+
+
+def gap(value, low, high, period=None):
+    # how far value lies outside [low, high], going round when period is given
+    if low <= value <= high:
+        return 0
+    if period is None:
+        return low - value if value < low else value - high
+    return min((low - value) % period, (value - high) % period)
+
+
+def cell_ranges(latitude, longitude, km):
+    # [low, high) grid cell ranges covering every point within km of the centre.
+    #
+    # No point within km of the centre lies further towards a pole than widest_latitude,
+    # and neither does the shortest way there, so a degree of longitude is worth at least
+    # `shrink` of a degree of latitude all along it. That gives a lower bound on the
+    # distance to any cell, and the cells beyond km by that bound are left out.
+    widest_latitude = min(90, abs(latitude) + km / KM_PER_DEGREE)
+    shrink = math.cos(math.radians(widest_latitude))
+    level = search_level(km / CELLS_PER_RADIUS, shrink)
+    if level == 0:
+        return [(0, 1 << CELL_BITS)]
+    longitude_bits, latitude_bits = (level + 1) // 2, level // 2
+    cell_width, cell_height = 360 / (1 << longitude_bits), 180 / (1 << latitude_bits)
+    x, y = grid_position(latitude, longitude)
+    x >>= AXIS_BITS - longitude_bits
+    y >>= AXIS_BITS - latitude_bits
+    shift = CELL_BITS - level
+    starts = set()
+    reach = CELLS_PER_RADIUS
+    for dy in range(-reach, reach + 1):
+        cell_y = y + dy
+        if not 0 <= cell_y < 1 << latitude_bits:
+            continue
+        south = cell_y * cell_height - 90
+        latitude_gap = gap(latitude, south, south + cell_height) * KM_PER_DEGREE
+        for dx in range(-reach, reach + 1):
+            cell_x = (x + dx) % (1 << longitude_bits)
+            west = cell_x * cell_width - 180
+            longitude_gap = gap(longitude, west, west + cell_width, 360) * KM_PER_DEGREE * shrink
+            if math.hypot(latitude_gap, longitude_gap) > km:
+                continue
+            corner = interleave(cell_x << (AXIS_BITS - longitude_bits), cell_y << (AXIS_BITS - latitude_bits))
+            starts.add(corner >> shift << shift)
+
+    # neighbouring cells are often consecutive ranges, fewer ranges make a simpler query
+    ranges = []
+    for start in sorted(starts):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = start + (1 << shift)
+        else:
+            ranges.append([start, start + (1 << shift)])
+    return [tuple(bounds) for bounds in ranges]
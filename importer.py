@@ -0,0 +1,50 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+# File and database plumbing for `flask import` (see app.py). Nothing in here knows
+# about the models.
+
+
+def read_rows(path):
+    # Yields (line number, row dict) from a .csv file with a header line, or from a
+    # .ndjson / .jsonl file with one JSON object per line.
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if extension == '.csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        elif extension in ('.ndjson', '.jsonl'):
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+        else:
+            raise ValueError(f'Unsupported file type {extension!r}, expected .csv or .ndjson')
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_rows(connection, table, columns, rows):
+    # Loads rows with COPY ... FROM STDIN through the psycopg2 connection underneath a
+    # SQLAlchemy connection. None is written as \N so it arrives as NULL.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+    buffer.seek(0)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table}" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')', buffer)
+    finally:
+        cursor.close()
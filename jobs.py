@@ -0,0 +1,255 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+
+from metrics import COUNT_BUCKETS, TIME_BUCKETS, Counter, Histogram
+
+# Background jobs for the work a write does not need done before it answers.
+#
+# Jobs are rows of a table in the app's own database. enqueue() inserts one in the
+# session of the write it follows up on, so it is committed, or rolled back, together
+# with that write. Workers claim due jobs one at a time, SELECT ... FOR UPDATE SKIP
+# LOCKED where the database has it and a conditional UPDATE either way, and run them on
+# a thread pool, each in its own app context and session. A job runs at least once: one
+# whose worker died is claimed again once its lease runs out, so handlers must be safe
+# to run twice. A failed job is retried after a delay doubling with every attempt, up
+# to JOBS_MAX_ATTEMPTS.
+#
+# A job with a key is not added while a job with the same key is still waiting to run,
+# so a burst of edits to one venue runs its follow-up work once. A job already running
+# doesn't count, the one added while it runs sees the later change.
+#
+# Workers run inside the web process (JOBS_IN_PROCESS, started on its first request) or
+# as `flask worker`. Every worker also adds the scheduled jobs (schedule()) when they
+# are due by its own clock, keyed so that one waiting copy is enough. Several workers
+# can each run one per interval, so scheduled handlers should be cheap when there is
+# nothing to do.
+
+
+class JobQueue:
+
+    def __init__(self, app=None, db=None, model=None, metrics=None):
+        self.handlers = {}
+        # name -> seconds between runs, and name -> when this process adds it next
+        self.schedules = {}
+        self.next_runs = {}
+        self.wake = threading.Event()
+        self.started = False
+        self.start_lock = threading.Lock()
+        self.histograms = {
+            'duration': Histogram('fyyur_job_duration_seconds', 'Time spent running the job.', TIME_BUCKETS, 'job'),
+            'wait': Histogram('fyyur_job_wait_seconds', 'Time from when the job was due to when it started.',
+                              TIME_BUCKETS, 'job'),
+            'attempts': Histogram('fyyur_job_attempts', 'Attempts the job took, counted when it is done.',
+                                  COUNT_BUCKETS, 'job'),
+        }
+        self.outcomes = Counter('fyyur_jobs_total', 'Job attempts by outcome (done, retry, failed).', ('job', 'outcome'))
+        if app is not None:
+            self.init_app(app, db, model, metrics)
+
+    def init_app(self, app, db, model, metrics=None):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.threads = app.config.get('JOBS_THREADS', 2)
+        self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', 5)
+        self.backoff = app.config.get('JOBS_BACKOFF_SECONDS', 2)
+        self.lease = app.config.get('JOBS_LEASE_SECONDS', 300)
+        self.poll = app.config.get('JOBS_POLL_SECONDS', 1)
+        self.keep_days = app.config.get('JOBS_KEEP_DAYS', 7)
+        if metrics is not None:
+            metrics.collectors.extend(list(self.histograms.values()) + [self.outcomes])
+        # a worker in this process hears of new jobs when they are committed, not polled
+        event.listen(Session, 'after_commit', self.committed)
+        if app.config.get('JOBS_IN_PROCESS'):
+            app.before_request(self.start_in_process)
+
+    def handler(self, name):
+        # registers the function running jobs of a name, called with the payload as
+        # keyword arguments inside an app context
+        def register(function):
+            self.handlers[name] = function
+            return function
+        return register
+
+    def schedule(self, name, seconds):
+        # runs a job of this name, without payload, every so many seconds
+        self.schedules[name] = seconds
+
+    def enqueue_scheduled(self):
+        # Adds the scheduled jobs that are due. Call with an app context.
+        now = time.monotonic()
+        due = [name for name, seconds in self.schedules.items() if self.next_runs.get(name, 0) <= now]
+        for name in due:
+            self.enqueue(name, key=f'schedule:{name}')
+            self.next_runs[name] = now + self.schedules[name]
+        if due:
+            self.db.session.commit()
+
+    def enqueue(self, name, payload=None, key=None, delay=0):
+        # Adds a job to the current session, it is queued when the session commits
+        db, table = self.db, self.model.__table__
+        now = datetime.now()
+        values = {'name': name, 'payload': payload or {}, 'key': key, 'status': 'queued', 'attempts': 0,
+                  'run_at': now + timedelta(seconds=delay), 'created_at': now}
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        if key is None or insert is None:
+            db.session.execute(table.insert().values(values))
+        else:
+            # the partial unique index on key turns a second waiting job into a no-op
+            db.session.execute(insert(table).values(values).on_conflict_do_nothing())
+        db.session.info['jobs_enqueued'] = True
+
+    def committed(self, session):
+        if session.info.pop('jobs_enqueued', False):
+            self.wake.set()
+
+    def due(self, now):
+        job = self.model
+        return self.db.or_(
+            self.db.and_(job.status == 'queued', job.run_at <= now),
+            # claimed by a worker that went away without finishing it
+            self.db.and_(job.status == 'running', job.locked_until <= now)
+        )
+
+    def claim(self):
+        # The next due job, marked running under a lease, as (id, name, payload,
+        # attempts, due at), or None. Call with an app context.
+        db, job = self.db, self.model
+        while True:
+            now = datetime.now()
+            row = db.session.execute(
+                db.select(job.id).where(self.due(now)).order_by(job.run_at, job.id).limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if row is None:
+                db.session.commit()
+                return None
+            claimed = db.session.execute(
+                db.update(job).where(job.id == row.id, self.due(now)).values(
+                    status='running', attempts=job.attempts + 1, started_at=now,
+                    locked_until=now + timedelta(seconds=self.lease)
+                ).returning(job.id, job.name, job.payload, job.attempts, job.run_at)
+            ).first()
+            db.session.commit()
+            # another worker got there between the two statements, take the next one
+            if claimed is not None:
+                return tuple(claimed)
+
+    def run(self, claimed):
+        # Runs a claimed job and records how it went. Call with an app context.
+        db, job = self.db, self.model
+        job_id, name, payload, attempts, due_at = claimed
+        self.histograms['wait'].observe(name, max(0, (datetime.now() - due_at).total_seconds()))
+        started = time.perf_counter()
+        try:
+            if name not in self.handlers:
+                raise LookupError(f'no handler for {name} jobs')
+            self.handlers[name](**payload)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            outcome = 'retry' if attempts < self.max_attempts else 'failed'
+        else:
+            error, outcome = None, 'done'
+        duration = time.perf_counter() - started
+
+        # only while this worker still holds the job, it may have been claimed again
+        held = db.and_(job.id == job_id, job.status == 'running', job.attempts == attempts)
+        values = {'finished_at': datetime.now(), 'duration': duration, 'error': error, 'locked_until': None}
+        if outcome == 'retry':
+            delay = timedelta(seconds=self.backoff * 2 ** (attempts - 1))
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(db.update(job).where(held).values(
+                        status='queued', run_at=datetime.now() + delay, **values))
+            except exc.IntegrityError:
+                # a newer job with the same key is waiting and will do the same work
+                outcome = 'failed'
+        if outcome != 'retry':
+            db.session.execute(db.update(job).where(held).values(status=outcome, **values))
+        db.session.commit()
+        self.histograms['duration'].observe(name, duration)
+        self.outcomes.inc(name, outcome)
+        if outcome == 'done':
+            self.histograms['attempts'].observe(name, attempts)
+        if outcome == 'failed':
+            self.app.logger.error(f'job {job_id} ({name}) failed after {attempts} attempts:\n{error}')
+        return outcome
+
+    def run_claimed(self, claimed):
+        with self.app.app_context():
+            try:
+                return self.run(claimed)
+            finally:
+                # a slot is free
+                self.wake.set()
+
+    def purge(self):
+        # deletes jobs done more than JOBS_KEEP_DAYS ago, failed ones are kept to look at
+        job = self.model
+        cutoff = datetime.now() - timedelta(days=self.keep_days)
+        result = self.db.session.execute(self.db.delete(job).where(job.status == 'done', job.finished_at <= cutoff))
+        self.db.session.commit()
+        return result.rowcount
+
+    def work(self, threads=None, burst=False, stop=None):
+        # Claims and runs jobs until stop is set, or with burst, until none are due
+        threads = threads or self.threads
+        stop = stop or threading.Event()
+        purged_at = 0
+        with ThreadPoolExecutor(threads, thread_name_prefix='job') as pool:
+            running = set()
+            while not stop.is_set():
+                running = {future for future in running if not future.done()}
+                claimed = None
+                if len(running) < threads:
+                    with self.app.app_context():
+                        if time.monotonic() - purged_at > 3600:
+                            self.purge()
+                            purged_at = time.monotonic()
+                        self.enqueue_scheduled()
+                        claimed = self.claim()
+                if claimed is not None:
+                    running.add(pool.submit(self.run_claimed, claimed))
+                    continue
+                if burst and not running:
+                    break
+                self.wake.wait(self.poll)
+                self.wake.clear()
+
+    def start_in_process(self):
+        # JOBS_IN_PROCESS: a worker thread in this web process, started by its first request
+        if self.started:
+            return
+        with self.start_lock:
+            if not self.started:
+                threading.Thread(target=self.work, daemon=True, name='job-worker').start()
+                self.started = True
+
+    def stats(self):
+        # jobs by name and status, with their mean and slowest run, from the table
+        db, job = self.db, self.model
+        rows = db.session.execute(db.select(
+            job.name, job.status, db.func.count(), db.func.avg(job.duration), db.func.max(job.duration)
+        ).group_by(job.name, job.status).order_by(job.name, job.status))
+        stats = {}
+        for name, status, count, mean, slowest in rows:
+            stats.setdefault(name, {})[status] = {
+                'jobs': count,
+                'mean_ms': round(mean * 1000, 1) if mean is not None else None,
+                'max_ms': round(slowest * 1000, 1) if slowest is not None else None
+            }
+        return stats
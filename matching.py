@@ -0,0 +1,88 @@
+import heapq
+from collections import namedtuple
+
+from geo import place_key
+
+# Suggested matches between artists seeking a venue and venues seeking talent.
+#
+# Only artists and venues in the same state are matched. A pair scores on the genres
+# they share (the Jaccard index of their genre sets), on being in the same city, and on
+# shows the artist already played at the venue. Genre sets are bitsets, bit n standing
+# for genre id n, so the overlap of two of them is an AND and a bit count. Every genre
+# has a posting list of the profiles that have it, so ranking one profile only scores
+# the profiles it shares a genre (or a show) with, not the whole state.
+
+GENRE_WEIGHT = 0.6
+CITY_WEIGHT = 0.25
+HISTORY_WEIGHT = 0.15
+# shows played together at which the history part of the score is full
+HISTORY_SHOWS = 3
+
+# place is place_key(city, state), genres the genre bitset
+Profile = namedtuple('Profile', 'id place genres')
+
+
+def genre_bits(genre_ids):
+    bits = 0
+    for genre_id in genre_ids:
+        bits |= 1 << genre_id
+    return bits
+
+
+def owner_profile(owner_id, city, state, genre_ids):
+    return Profile(owner_id, place_key(city, state), genre_bits(genre_ids))
+
+
+def score(one, other, shows=0):
+    # 0 for a pair with neither a genre nor a show in common, however close they are
+    common = (one.genres & other.genres).bit_count()
+    if not common and not shows:
+        return 0
+    value = GENRE_WEIGHT * common / (one.genres | other.genres).bit_count() if common else 0
+    if one.place == other.place:
+        value += CITY_WEIGHT
+    if shows:
+        value += HISTORY_WEIGHT * min(shows, HISTORY_SHOWS) / HISTORY_SHOWS
+    return value
+
+
+def best(scores, k):
+    # the k highest (id, score) items of {id: score}, ties going to the lower id
+    return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+class Candidates:
+    # the artists (or venues) of one state that a venue (or artist) can match with
+
+    def __init__(self):
+        self.profiles = {}
+        self.postings = {}
+
+    def add(self, profile):
+        self.profiles[profile.id] = profile
+        bits = profile.genres
+        while bits:
+            genre = bits & -bits
+            self.postings.setdefault(genre, []).append(profile)
+            bits ^= genre
+
+    def scores(self, subject, shows):
+        # {id: score} of the candidates scoring above 0 against subject. shows maps
+        # candidate ids to the shows played together with it. The same sums as score(),
+        # inlined, this is where a rebuild spends its time.
+        scored = {}
+        genres, place = subject.genres, subject.place
+        bits = genres
+        while bits:
+            genre = bits & -bits
+            for candidate in self.postings.get(genre, ()):
+                if candidate.id not in scored:
+                    value = GENRE_WEIGHT * (genres & candidate.genres).bit_count() / (genres | candidate.genres).bit_count()
+                    if candidate.place == place:
+                        value += CITY_WEIGHT
+                    scored[candidate.id] = value
+            bits ^= genre
+        for candidate_id, count in shows.items():
+            if candidate_id in self.profiles:
+                scored[candidate_id] = score(subject, self.profiles[candidate_id], count)
+        return scored
@@ -0,0 +1,200 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request timing: SQL query count and time, pool checkout wait, template render
+# time and total time. Each response carries them in a Server-Timing header, and they
+# are aggregated per endpoint into histograms served in Prometheus text format at
+# /metrics. Aggregates are per worker process, like any in-process Prometheus client.
+#
+# A streamed response sends its headers before the body is produced, and the body runs
+# most of the queries of a streamed page. Its Server-Timing header only covers the view
+# up to that point and says so (a `streamed` entry). The histograms get the whole
+# request once the body was sent, the time the body took is observed on its own as
+# well, and the body's share is logged at debug level.
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets, label='endpoint'):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # endpoint -> ([count per bucket, +Inf last], sum)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self.lock:
+            counts, total = self.series.get(endpoint) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.series[endpoint] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted(self.series.items())
+        for endpoint, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{endpoint}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{endpoint}"}} {cumulative}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # tuple of label values -> count
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *values):
+        with self.lock:
+            self.series[values] = self.series.get(values, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = sorted(self.series.items())
+        for values, count in series:
+            labels = ','.join(f'{label}="{value}"' for label, value in zip(self.labels, values))
+            lines.append(f'{self.name}{{{labels}}} {count}')
+        return lines
+
+
+class RequestMetrics:
+
+    def __init__(self, app=None, db=None):
+        self.histograms = {
+            'total': Histogram('fyyur_request_duration_seconds', 'Time spent handling the request.', TIME_BUCKETS),
+            'db': Histogram('fyyur_db_duration_seconds', 'Time spent executing SQL per request.', TIME_BUCKETS),
+            'queries': Histogram('fyyur_db_queries', 'SQL statements executed per request.', COUNT_BUCKETS),
+            'pool': Histogram('fyyur_db_pool_wait_seconds', 'Time spent checking connections out of the pool per request.', TIME_BUCKETS),
+            'render': Histogram('fyyur_render_duration_seconds', 'Time spent rendering templates per request.', TIME_BUCKETS),
+            'body': Histogram('fyyur_stream_body_seconds', 'Time from the headers to the end of a streamed response.',
+                              TIME_BUCKETS),
+        }
+        # metrics of other parts of the app (background jobs) served along with these
+        self.collectors = []
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.logger = app.logger
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        before_render_template.connect(self.render_started, app)
+        template_rendered.connect(self.render_finished, app)
+        event.listen(Engine, 'before_cursor_execute', self.query_started)
+        event.listen(Engine, 'after_cursor_execute', self.query_finished)
+        with app.app_context():
+            for engine in db.engines.values():
+                self.time_checkouts(engine)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def time_checkouts(self, engine):
+        # The pool has no "checkout started" event, so the engine's connection getter
+        # is wrapped instead. Being an engine attribute, it survives pool recreation.
+        raw_connection = engine.raw_connection
+
+        def timed_raw_connection(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return raw_connection(*args, **kwargs)
+            finally:
+                timing = self.timing()
+                if timing is not None:
+                    timing['pool'] += time.perf_counter() - started
+        engine.raw_connection = timed_raw_connection
+
+    def timing(self):
+        return g.get('request_timing') if has_request_context() else None
+
+    def start(self):
+        g.request_timing = {'started': time.perf_counter(), 'queries': 0, 'db': 0.0, 'pool': 0.0, 'render': 0.0}
+
+    def query_started(self, conn, cursor, statement, parameters, context, executemany):
+        # kept on the execution context, which goes away with the statement whether it
+        # finished or failed, rather than on the pooled connection
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+    def query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        timing = self.timing()
+        if timing is not None:
+            timing['queries'] += 1
+            started = getattr(context, 'query_started', None)
+            if started is not None:
+                timing['db'] += time.perf_counter() - started
+
+    def render_started(self, sender, template, context, **extra):
+        timing = self.timing()
+        if timing is not None:
+            timing.setdefault('render_started', []).append(time.perf_counter())
+
+    def render_finished(self, sender, template, context, **extra):
+        timing = self.timing()
+        if timing is not None and timing.get('render_started'):
+            timing['render'] += time.perf_counter() - timing['render_started'].pop()
+
+    def finish(self, response):
+        timing = self.timing()
+        if timing is None or request.endpoint == 'metrics':
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        now = time.perf_counter()
+        entries = [
+            f'db;dur={timing["db"] * 1000:.2f};desc="{timing["queries"]} queries"',
+            f'pool;dur={timing["pool"] * 1000:.2f}',
+            f'render;dur={timing["render"] * 1000:.2f}',
+            f'total;dur={(now - timing["started"]) * 1000:.2f}',
+        ]
+        if response.is_streamed:
+            entries.append('streamed;desc="body not included"')
+            # called once the request context is gone, with the timing dict the body's
+            # queries and rendering were added to while it streamed
+            headers = dict(timing, sent=now)
+            description = f'{request.method} {request.full_path}'
+            response.call_on_close(lambda: self.streamed(endpoint, description, timing, headers))
+        else:
+            self.observe(endpoint, timing, now)
+        response.headers['Server-Timing'] = ', '.join(entries)
+        return response
+
+    def observe(self, endpoint, timing, now):
+        self.histograms['total'].observe(endpoint, now - timing['started'])
+        self.histograms['db'].observe(endpoint, timing['db'])
+        self.histograms['queries'].observe(endpoint, timing['queries'])
+        self.histograms['pool'].observe(endpoint, timing['pool'])
+        self.histograms['render'].observe(endpoint, timing['render'])
+
+    def streamed(self, endpoint, description, timing, headers):
+        # a streamed response was sent in full, or the client hung up
+        now = time.perf_counter()
+        self.observe(endpoint, timing, now)
+        self.histograms['body'].observe(endpoint, now - headers['sent'])
+        self.logger.debug(
+            f'{description} streamed body: {timing["queries"] - headers["queries"]} queries, '
+            f'db {(timing["db"] - headers["db"]) * 1000:.2f} ms, render {(timing["render"] - headers["render"]) * 1000:.2f} ms, '
+            f'{(now - headers["sent"]) * 1000:.2f} ms in all'
+        )
+
+    def metrics_view(self):
+        lines = []
+        for histogram in list(self.histograms.values()) + self.collectors:
+            lines.extend(histogram.render())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
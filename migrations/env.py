@@ -79,6 +79,11 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # app.py turns foreign keys on for SQLite. Batch mode rebuilds a table by
+            # dropping the old one, which would then cascade to the rows pointing at it.
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
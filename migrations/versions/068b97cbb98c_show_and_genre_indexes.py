@@ -0,0 +1,38 @@
+"""show and genre association indexes
+
+Revision ID: 068b97cbb98c
+Revises: 9391b6542e6d
+Create Date: 2026-10-18 10:02:17.550318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '068b97cbb98c'
+down_revision = '9391b6542e6d'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time']),
+    ('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time']),
+    ('ix_Show_start_time_id', 'Show', ['start_time', 'id']),
+    ('ix_artist_genre_table_artist_id_genre_id', 'artist_genre_table', ['artist_id', 'genre_id']),
+    ('ix_venue_genre_table_venue_id_genre_id', 'venue_genre_table', ['venue_id', 'genre_id']),
+]
+
+
+def upgrade():
+    # On Postgres the indexes are built CONCURRENTLY so the tables stay writable.
+    # That can't run inside a transaction, hence the autocommit block.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,52 @@
+"""show end time and booking constraints
+
+Revision ID: 0cd0d788bf78
+Revises: b49ac70da785
+Create Date: 2026-10-18 13:48:09.402671
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0cd0d788bf78'
+down_revision = 'b49ac70da785'
+branch_labels = None
+depends_on = None
+
+# length given to the shows that existed before end_time did (config.DEFAULT_SHOW_MINUTES)
+DEFAULT_SHOW_MINUTES = 120
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if dialect == 'postgresql':
+        op.execute(f'''UPDATE "Show" SET end_time = start_time + interval '{DEFAULT_SHOW_MINUTES} minutes' ''')
+    else:
+        op.execute(f'''UPDATE "Show" SET end_time = datetime(start_time, '+{DEFAULT_SHOW_MINUTES} minutes')''')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    if dialect == 'postgresql':
+        # Existing double bookings would keep the constraints from being created, so
+        # they only cover shows starting from now on. Past ones are history anyway.
+        cutoff = datetime.now().replace(microsecond=0).isoformat(sep=' ')
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for column in ('venue_id', 'artist_id'):
+            op.execute(f'''
+                ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{column}_booking"
+                EXCLUDE USING gist ({column} WITH =, tsrange(start_time, end_time) WITH &&)
+                WHERE (start_time >= '{cutoff}')
+            ''')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for column in ('venue_id', 'artist_id'):
+            op.execute(f'ALTER TABLE "Show" DROP CONSTRAINT "ex_Show_{column}_booking"')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_column('end_time')
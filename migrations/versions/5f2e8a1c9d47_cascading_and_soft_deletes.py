@@ -0,0 +1,61 @@
+"""cascading deletes and soft delete
+
+Revision ID: 5f2e8a1c9d47
+Revises: 0cd0d788bf78
+Create Date: 2026-10-18 16:12:40.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2e8a1c9d47'
+down_revision = '0cd0d788bf78'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table) of the foreign keys that get ON DELETE CASCADE
+FOREIGN_KEYS = [
+    ('Show', 'venue_id', 'Venue'),
+    ('Show', 'artist_id', 'Artist'),
+    ('venue_genre_table', 'venue_id', 'Venue'),
+    ('artist_genre_table', 'artist_id', 'Artist'),
+]
+
+# SQLite keeps the foreign keys unnamed, batch mode names them by this convention so
+# they can be dropped
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+LIVE = sa.text('deleted_at IS NULL')
+
+INDEXES = [
+    ('ix_Venue_live_state_city_name', 'Venue', ['state', 'city', 'name']),
+    ('ix_Artist_live_name_id', 'Artist', ['name', 'id']),
+]
+
+
+def replace_foreign_keys(ondelete):
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    for table, column, referred in FOREIGN_KEYS:
+        name = f'{table}_{column}_fkey' if postgresql else f'fk_{table}_{column}_{referred}'
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+    for _, table, _ in INDEXES:
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, postgresql_where=LIVE, sqlite_where=LIVE)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    for _, table, _ in reversed(INDEXES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
+    replace_foreign_keys(None)
@@ -0,0 +1,48 @@
+"""unique genre name
+
+Revision ID: 792c76d9ec76
+Revises: 068b97cbb98c
+Create Date: 2026-10-18 11:24:51.803117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '792c76d9ec76'
+down_revision = '068b97cbb98c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Concurrent submissions may already have created duplicate genres. Keep the
+    # lowest id per name, move the links of the duplicates over to it, then drop them.
+    for table, column in (('artist_genre_table', 'artist_id'), ('venue_genre_table', 'venue_id')):
+        op.execute(f'''
+            INSERT INTO {table} (genre_id, {column})
+            SELECT DISTINCT keep.id, link.{column}
+            FROM {table} link
+            JOIN "Genre" g ON g.id = link.genre_id
+            JOIN (SELECT min(id) AS id, name FROM "Genre" GROUP BY name) keep ON keep.name = g.name
+            WHERE g.id <> keep.id
+            AND NOT EXISTS (
+                SELECT 1 FROM {table} x WHERE x.genre_id = keep.id AND x.{column} = link.{column}
+            )
+        ''')
+        op.execute(f'''
+            DELETE FROM {table} WHERE genre_id IN (
+                SELECT g.id FROM "Genre" g
+                WHERE g.id > (SELECT min(g2.id) FROM "Genre" g2 WHERE g2.name = g.name)
+            )
+        ''')
+    op.execute('''
+        DELETE FROM "Genre"
+        WHERE id > (SELECT min(g2.id) FROM "Genre" g2 WHERE g2.name = "Genre".name)
+    ''')
+    op.create_index('ix_Genre_name', 'Genre', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_Genre_name', table_name='Genre')
@@ -0,0 +1,53 @@
+"""name search indexes
+
+Revision ID: 9391b6542e6d
+Revises: 62b75cac0a9d
+Create Date: 2026-10-18 09:12:44.102934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9391b6542e6d'
+down_revision = '62b75cac0a9d'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # trigram GIN indexes let ILIKE '%term%' avoid a sequential scan
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in TABLES:
+            op.execute(f'CREATE INDEX "ix_{table}_name_trgm" ON "{table}" USING gin (name gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        # FTS5 trigram side tables, kept in sync with the name column by triggers
+        for table in TABLES:
+            fts = f'{table.lower()}_name_fts'
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5(name, content='{table}', content_rowid='id', tokenize='trigram')")
+            op.execute(f'CREATE TRIGGER {fts}_ai AFTER INSERT ON "{table}" BEGIN '
+                       f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END')
+            op.execute(f'CREATE TRIGGER {fts}_ad AFTER DELETE ON "{table}" BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END")
+            op.execute(f'CREATE TRIGGER {fts}_au AFTER UPDATE OF name ON "{table}" BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+                       f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END')
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in TABLES:
+            op.execute(f'DROP INDEX IF EXISTS "ix_{table}_name_trgm"')
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            fts = f'{table.lower()}_name_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
@@ -0,0 +1,34 @@
+"""venue coordinates and grid cell
+
+Revision ID: a83d51f0c6b2
+Revises: 5f2e8a1c9d47
+Create Date: 2026-10-18 17:03:26.551970
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d51f0c6b2'
+down_revision = '5f2e8a1c9d47'
+branch_labels = None
+depends_on = None
+
+LIVE = sa.text('deleted_at IS NULL')
+
+
+def upgrade():
+    # filled in by `flask geocode-venues`, which needs the gazetteer
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geocell', sa.BigInteger(), nullable=True))
+    op.create_index('ix_Venue_live_geocell', 'Venue', ['geocell'], postgresql_where=LIVE, sqlite_where=LIVE)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_live_geocell', table_name='Venue')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('geocell')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,61 @@
+"""materialized show counters
+
+Revision ID: b49ac70da785
+Revises: 792c76d9ec76
+Create Date: 2026-10-18 13:05:42.118204
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b49ac70da785'
+down_revision = '792c76d9ec76'
+branch_labels = None
+depends_on = None
+
+COUNTERS = [
+    ('VenueShowCount', 'Venue', 'venue_id'),
+    ('ArtistShowCount', 'Artist', 'artist_id'),
+]
+
+
+def upgrade():
+    now = datetime.now()
+    sweep = op.create_table('ShowCountSweep',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('swept_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(sweep, [{'id': 1, 'swept_at': now}])
+
+    for table, owner, fk in COUNTERS:
+        op.create_table(table,
+            sa.Column('owner_id', sa.Integer(), nullable=False),
+            sa.Column('upcoming_shows', sa.Integer(), server_default='0', nullable=False),
+            sa.Column('past_shows', sa.Integer(), server_default='0', nullable=False),
+            sa.Column('next_show_time', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['owner_id'], [f'{owner}.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('owner_id')
+        )
+        op.create_index(f'ix_{table}_next_show_time', table, ['next_show_time'])
+        # backfill relative to the watermark written above
+        op.execute(sa.text(f'''
+            INSERT INTO "{table}" (owner_id, upcoming_shows, past_shows, next_show_time)
+            SELECT {fk},
+                   count(CASE WHEN start_time > :now THEN id END),
+                   count(CASE WHEN start_time <= :now THEN id END),
+                   min(CASE WHEN start_time > :now THEN start_time END)
+            FROM "Show"
+            GROUP BY {fk}
+        ''').bindparams(sa.bindparam('now', now, type_=sa.DateTime())))
+
+
+def downgrade():
+    for table, _, _ in reversed(COUNTERS):
+        op.drop_index(f'ix_{table}_next_show_time', table_name=table)
+        op.drop_table(table)
+    op.drop_table('ShowCountSweep')
@@ -0,0 +1,34 @@
+"""listing filter indexes
+
+Revision ID: c4e9b27d8f15
+Revises: a83d51f0c6b2
+Create Date: 2026-10-18 18:21:07.339842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9b27d8f15'
+down_revision = 'a83d51f0c6b2'
+branch_labels = None
+depends_on = None
+
+LIVE = sa.text('deleted_at IS NULL')
+
+INDEXES = [
+    ('ix_Venue_live_seeking_talent_state_city', 'Venue', ['seeking_talent', 'state', 'city']),
+    ('ix_Artist_live_state_city', 'Artist', ['state', 'city']),
+    ('ix_Artist_live_seeking_venue_state', 'Artist', ['seeking_venue', 'state']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, postgresql_where=LIVE, sqlite_where=LIVE)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
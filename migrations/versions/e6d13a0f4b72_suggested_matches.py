@@ -0,0 +1,34 @@
+"""suggested artist venue matches
+
+Revision ID: e6d13a0f4b72
+Revises: c4e9b27d8f15
+Create Date: 2026-10-18 19:02:44.615093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6d13a0f4b72'
+down_revision = 'c4e9b27d8f15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # scoring lives in matching.py, `flask refresh-matches` fills the table afterwards
+    op.create_table('Match',
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('artist_id', 'venue_id')
+    )
+    op.create_index('ix_Match_venue_id_score', 'Match', ['venue_id', 'score'])
+
+
+def downgrade():
+    op.drop_index('ix_Match_venue_id_score', table_name='Match')
+    op.drop_table('Match')
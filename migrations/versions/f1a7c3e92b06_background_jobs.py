@@ -0,0 +1,47 @@
+"""background jobs
+
+Revision ID: f1a7c3e92b06
+Revises: e6d13a0f4b72
+Create Date: 2026-10-18 21:14:09.382517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a7c3e92b06'
+down_revision = 'e6d13a0f4b72'
+branch_labels = None
+depends_on = None
+
+QUEUED = "status = 'queued'"
+
+
+def upgrade():
+    # the queue of jobs.py, run by `flask worker` or the worker thread of each web process
+    op.create_table('Job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('key', sa.String(length=200), nullable=True),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Job_status_run_at', 'Job', ['status', 'run_at'])
+    op.create_index('ix_Job_key', 'Job', ['key'], unique=True,
+                    postgresql_where=sa.text(QUEUED), sqlite_where=sa.text(QUEUED))
+
+
+def downgrade():
+    op.drop_index('ix_Job_key', table_name='Job')
+    op.drop_index('ix_Job_status_run_at', table_name='Job')
+    op.drop_table('Job')
@@ -2,3 +2,70 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Name suggestions under the navbar search boxes, from /autocomplete
+document.addEventListener('DOMContentLoaded', function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var list = document.createElement('ul');
+    var timer = null;
+    var latest = 0;
+    list.className = 'autocomplete';
+    list.hidden = true;
+    input.parentNode.appendChild(list);
+
+    function show(results) {
+      list.innerHTML = '';
+      results.forEach(function (result) {
+        var item = document.createElement('li');
+        var link = document.createElement('a');
+        link.href = result.url;
+        link.textContent = result.name;
+        item.appendChild(link);
+        list.appendChild(item);
+      });
+      list.hidden = !results.length;
+    }
+
+    function suggest() {
+      var term = input.value.trim();
+      var request = ++latest;
+      if (!term) {
+        show([]);
+        return;
+      }
+      fetch('/autocomplete?type=' + input.dataset.autocomplete + '&q=' + encodeURIComponent(term))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          // an answer to an earlier keystroke arriving late is dropped
+          if (request === latest) show(data.results || []);
+        });
+    }
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(suggest, 150);
+    });
+    input.addEventListener('keydown', function (e) {
+      var links = list.querySelectorAll('a');
+      var active = list.querySelector('a.active');
+      var index = Array.prototype.indexOf.call(links, active);
+      if (list.hidden || !links.length) return;
+      if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+        e.preventDefault();
+        if (active) active.classList.remove('active');
+        index = (index + (e.key === 'ArrowDown' ? 1 : links.length - 1 + (index < 0 ? 1 : 0))) % links.length;
+        links[index].classList.add('active');
+      } else if (e.key === 'Enter' && active) {
+        e.preventDefault();
+        window.location = active.href;
+      } else if (e.key === 'Escape') {
+        list.hidden = true;
+      }
+    });
+    input.addEventListener('blur', function () {
+      // after a click on a suggestion has followed its link
+      setTimeout(function () { list.hidden = true; }, 200);
+    });
+  });
+});
@@ -0,0 +1,115 @@
+import zlib
+from itertools import chain
+
+from flask import request
+
+# Helpers for streamed pages, and response compression that also works for them.
+#
+# Compression is negotiated from Accept-Encoding: brotli when the brotli package is
+# installed and the client takes it, gzip otherwise. Whole bodies are compressed in one
+# go. Streamed bodies are compressed chunk by chunk, each chunk flushed, so the client
+# can render what arrived without waiting for the end of the page.
+
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/plain', 'application/json', 'application/x-ndjson')
+
+
+def peek(iterable):
+    # The rows as an iterator, or None when there are none, so templates can keep
+    # testing `{% if rows %}` without the rows being loaded up front.
+    iterator = iter(iterable)
+    for first in iterator:
+        return chain([first], iterator)
+    return None
+
+
+def buffered(chunks, size):
+    # Jinja yields every text run and expression on its own. Joining them into chunks of
+    # about size characters keeps the writes (and compressor flushes) few.
+    parts, length = [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+class GzipStream:
+
+    def __init__(self, level):
+        # wbits 31: gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+
+    def __init__(self, quality):
+        import brotli
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class Compression:
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        try:
+            import brotli
+            self.brotli = True
+        except ImportError:
+            self.brotli = False
+        app.after_request(self.compress)
+
+    def compressor(self):
+        # the best encoding the client accepts, as a new stream compressor
+        if self.brotli and request.accept_encodings['br']:
+            return 'br', BrotliStream(self.brotli_quality)
+        if request.accept_encodings['gzip']:
+            return 'gzip', GzipStream(self.gzip_level)
+        return None, None
+
+    def compress(self, response):
+        if (response.direct_passthrough or 'Content-Encoding' in response.headers
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and response.calculate_content_length() < self.min_size:
+            return response
+        encoding, compressor = self.compressor()
+        if compressor is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.stream(response.iter_encoded(), compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compressor.process(response.get_data()) + compressor.finish())
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def stream(self, chunks, compressor):
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
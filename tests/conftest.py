@@ -0,0 +1,77 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config reads these when app is imported: an in-memory SQLite database, no replica
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.pop('REPLICA_DATABASE_URL', None)
+
+from app import app as flask_app, db, jobs, page_cache, typeahead, recount_shows, Artist, Show, Venue, SHOW_COUNTERS
+
+# jobs are run by the tests that need them, not by a worker thread of the first request
+jobs.started = True
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # a fresh schema per test, without the page cache unless a test puts one in
+    monkeypatch.setattr(page_cache, 'backend', None)
+    monkeypatch.setitem(flask_app.config, 'WTF_CSRF_ENABLED', False)
+    # the autocomplete index is built here, not by a thread of whichever request comes first
+    monkeypatch.setattr(typeahead, 'max_age', float('inf'))
+    with flask_app.app_context():
+        db.create_all()
+        typeahead.build(wait=True)
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    # the SQL statements run on the primary engine while the test runs
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def add_listing(venues, artists, shows_per_venue=2, start=1):
+    # venues and artists numbered from start, each venue with shows of as many artists,
+    # half of them upcoming, and the show counters filled in
+    now = datetime.now()
+    states = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX')]
+    db.session.add_all(
+        Venue(id=i, name=f'Venue {i}', city=states[i % 3][0], state=states[i % 3][1], address=f'{i} Main Street',
+              phone='1231231234')
+        for i in range(start, start + venues)
+    )
+    db.session.add_all(
+        Artist(id=i, name=f'Artist {i}', city=states[i % 3][0], state=states[i % 3][1], phone='1231231234')
+        for i in range(start, start + artists)
+    )
+    db.session.flush()
+    db.session.add_all(
+        Show(venue_id=i, artist_id=start + (i + n) % artists,
+             start_time=now + timedelta(days=(n + 1) * (1 if n % 2 else -1)))
+        for i in range(start, start + venues) for n in range(shows_per_venue)
+    )
+    db.session.commit()
+    for fk in SHOW_COUNTERS:
+        recount_shows(fk)
+    db.session.commit()
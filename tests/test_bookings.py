@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, booking_conflict, booking_conflicts, import_command, ArtistShowCount, Show
+from conftest import add_listing
+
+
+@pytest.fixture
+def booked(app):
+    # artist 1 plays venue 1 in three days, for two hours
+    add_listing(2, 3, shows_per_venue=0)
+    start_time = datetime.now().replace(microsecond=0) + timedelta(days=3)
+    db.session.add(Show(venue_id=1, artist_id=1, start_time=start_time, end_time=start_time + timedelta(hours=2)))
+    db.session.commit()
+    return start_time
+
+
+def test_overlapping_shows_conflict(booked):
+    later = booked + timedelta(hours=1)
+    assert booking_conflict(1, 2, later, later + timedelta(hours=2)).venue_id == 1
+    assert booking_conflict(2, 1, later, later + timedelta(hours=2)).artist_id == 1
+    assert booking_conflict(1, 2, booked + timedelta(hours=2), booked + timedelta(hours=4)) is None
+
+    rows = [{'venue_id': 2, 'artist_id': 2, 'start_time': later, 'end_time': later + timedelta(hours=2)},
+            {'venue_id': 1, 'artist_id': 3, 'start_time': later, 'end_time': later + timedelta(hours=2)},
+            {'venue_id': 2, 'artist_id': 3, 'start_time': later, 'end_time': later + timedelta(hours=2)}]
+    venue_conflict, earlier_row = booking_conflicts(rows)[1:]
+    assert venue_conflict[:3] == ('venue_id', 1, None)
+    assert earlier_row[:3] == ('venue_id', None, 0)
+
+
+def test_shows_of_soft_deleted_artists_free_their_slot(client, monkeypatch, booked):
+    monkeypatch.setitem(client.application.config, 'SOFT_DELETE', True)
+    assert client.delete('/artists/1/delete').get_json()['deleted']
+    assert db.session.query(Show.hidden).filter(Show.venue_id == 1).scalar()
+
+    end_time = booked + timedelta(hours=2)
+    assert booking_conflict(1, 2, booked, end_time) is None
+    assert booking_conflicts([{'venue_id': 1, 'artist_id': 2, 'start_time': booked, 'end_time': end_time}]) == [None]
+    response = client.post('/shows/create', data={
+        'artist_id': '2', 'venue_id': '1', 'start_time': booked.strftime('%Y-%m-%d %H:%M:%S')
+    })
+    assert response.status_code == 200
+    assert db.session.query(Show).filter(Show.venue_id == 1, Show.hidden.is_(False)).count() == 1
+
+
+def test_shows_are_not_imported_into_soft_deleted_venues(client, monkeypatch, tmp_path, booked):
+    monkeypatch.setitem(client.application.config, 'SOFT_DELETE', True)
+    assert client.delete('/venues/2/delete').get_json()['deleted']
+
+    path = tmp_path / 'shows.csv'
+    path.write_text(f'venue_id,artist_id,start_time\n2,2,{booked + timedelta(days=1):%Y-%m-%d %H:%M:%S}\n')
+    result = client.application.test_cli_runner().invoke(import_command, ['shows', str(path)])
+    assert 'unknown venue_id or artist_id' in result.output
+    assert 'Imported 0 shows (1 rejected)' in result.output
+    db.session.expire_all()
+    assert db.session.query(Show).filter(Show.venue_id == 2).count() == 0
+    # and no upcoming show counted for the artist either, it has no counter row at all
+    assert db.session.get(ArtistShowCount, 2) is None
@@ -0,0 +1,19 @@
+import pytest
+
+from conftest import add_listing
+
+
+@pytest.mark.parametrize('path, name', [('/venues', 'Venue'), ('/artists', 'Artist')])
+def test_listing_query_count_does_not_grow_with_rows(client, statements, path, name):
+    # the directory and the artist list are a fixed number of queries, not one per row
+    add_listing(10, 10)
+    statements.clear()
+    page = client.get(path).get_data(as_text=True)
+    small = len(statements)
+    assert f'{name} 10<' in page
+
+    add_listing(90, 90, start=11)
+    statements.clear()
+    page = client.get(path).get_data(as_text=True)
+    assert len(statements) == small
+    assert f'{name} 100<' in page
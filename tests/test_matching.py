@@ -0,0 +1,74 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import db, delete_owner, rebuild_matches, refresh_matches, Artist, Genre, Match, Show, Venue
+
+PLACES = [('Austin', 'TX'), ('Dallas', 'TX'), ('Portland', 'OR'), ('Salem', 'OR'), ('Boise', 'ID')]
+
+
+def stored_matches():
+    return {(artist_id, venue_id): score for artist_id, venue_id, score in db.session.execute(db.select(Match.__table__))}
+
+
+@pytest.fixture
+def listing(app, monkeypatch):
+    # 30 artists and 24 venues over three states, most of them seeking, each with a few
+    # of 8 genres. Lists of 3 fill up, so edits push pairs off them. Refreshes the
+    # deferred jobs ask for run right away.
+    monkeypatch.setitem(fyyur.app.config, 'MATCH_SUGGESTIONS', 3)
+    monkeypatch.setattr(fyyur, 'defer_refresh_matches',
+                        lambda artist_ids=(), venue_ids=(), key=None: refresh_matches(artist_ids, venue_ids))
+    chance = random.Random(23)
+    genres = [Genre(id=i, name=f'Genre {i}') for i in range(1, 9)]
+    db.session.add_all(genres)
+    for model, seeking, count in ((Artist, 'seeking_venue', 30), (Venue, 'seeking_talent', 24)):
+        for i in range(1, count + 1):
+            city, state = chance.choice(PLACES)
+            db.session.add(model(id=i, name=f'{model.__name__} {i}', city=city, state=state, phone='1231231234',
+                                 genres=chance.sample(genres, chance.randint(1, 3)),
+                                 **{seeking: chance.random() < 0.8}))
+    db.session.commit()
+    rebuild_matches()
+    db.session.commit()
+    return chance, genres
+
+
+def test_refresh_matches_keeps_the_lists_a_rebuild_makes(listing, monkeypatch):
+    # random edits, shows and deletes, each followed by the refresh its handler defers.
+    # A rebuild from scratch must then come up with the very same suggestions.
+    chance, genres = listing
+    monkeypatch.setitem(fyyur.app.config, 'SOFT_DELETE', True)
+    for step in range(150):
+        artist_ids = [artist_id for (artist_id,) in db.session.query(Artist.id).filter(Artist.deleted_at.is_(None))]
+        venue_ids = [venue_id for (venue_id,) in db.session.query(Venue.id).filter(Venue.deleted_at.is_(None))]
+        action = chance.choice(['genres', 'place', 'seeking', 'show', 'show', 'delete'])
+        model, fk, ids = chance.choice([(Artist, 'artist_id', artist_ids), (Venue, 'venue_id', venue_ids)])
+        owner = db.session.get(model, chance.choice(ids))
+        if action == 'genres':
+            owner.genres = chance.sample(genres, chance.randint(0, 3))
+        elif action == 'place':
+            owner.city, owner.state = chance.choice(PLACES)
+        elif action == 'seeking':
+            seeking = 'seeking_venue' if model is Artist else 'seeking_talent'
+            setattr(owner, seeking, not getattr(owner, seeking))
+        elif action == 'show':
+            artist_id, venue_id = chance.choice(artist_ids), chance.choice(venue_ids)
+            start_time = datetime(2030, 1, 1) + timedelta(hours=step)
+            db.session.add(Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time,
+                                end_time=start_time + timedelta(hours=1)))
+            db.session.flush()
+            refresh_matches([artist_id], [venue_id])
+        if action == 'delete':
+            delete_owner(model, fk, owner.id)
+        elif action != 'show':
+            db.session.flush()
+            refresh_matches(**{fk + 's': [owner.id]})
+        db.session.commit()
+
+        refreshed = stored_matches()
+        rebuild_matches()
+        db.session.commit()
+        assert stored_matches() == refreshed, f'step {step}: {action} of {fk[:-3]} {owner.id}'
@@ -0,0 +1,50 @@
+import re
+
+import pytest
+from sqlalchemy import exc
+
+from app import db
+from conftest import add_listing
+
+
+def observed(client, name, endpoint):
+    # (count, sum) of a histogram series on /metrics, zeros before it has one
+    page = client.get('/metrics').get_data(as_text=True)
+    matches = (re.search(rf'^{name}_{part}{{endpoint="{endpoint}"}} (\S+)$', page, re.M) for part in ('count', 'sum'))
+    return tuple(float(match.group(1)) if match else 0 for match in matches)
+
+
+def test_plain_responses_are_timed_in_full(client, statements):
+    add_listing(3, 3)
+    before = observed(client, 'fyyur_db_queries', 'show_venue')
+    statements.clear()
+    response = client.get('/venues/1')
+    timing = response.headers['Server-Timing']
+    assert f'desc="{len(statements)} queries"' in timing
+    assert 'streamed' not in timing
+    assert observed(client, 'fyyur_db_queries', 'show_venue') == (before[0] + 1, before[1] + len(statements))
+
+
+def test_streamed_responses_are_observed_once_sent(client, statements):
+    add_listing(3, 3)
+    before = observed(client, 'fyyur_db_queries', 'venues')
+    bodies = observed(client, 'fyyur_stream_body_seconds', 'venues')[0]
+    statements.clear()
+    response = client.get('/venues')
+    assert 'streamed;desc="body not included"' in response.headers['Server-Timing']
+    assert 'Venue 1' in response.get_data(as_text=True)
+    assert observed(client, 'fyyur_db_queries', 'venues') == before
+
+    response.close()
+    assert observed(client, 'fyyur_db_queries', 'venues') == (before[0] + 1, before[1] + len(statements))
+    assert observed(client, 'fyyur_stream_body_seconds', 'venues')[0] == bodies + 1
+
+
+def test_failed_statements_leave_nothing_on_the_connection(app):
+    with db.engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                connection.exec_driver_sql('SELECT * FROM "NoSuchTable"')
+            connection.rollback()
+        assert connection.exec_driver_sql('SELECT 1').scalar() == 1
+        assert 'query_started' not in connection.info
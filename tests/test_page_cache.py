@@ -0,0 +1,185 @@
+import fnmatch
+
+import pytest
+
+import cache
+from app import db, page_cache, Show
+from cache import MemoryBackend, RedisBackend
+from conftest import add_listing
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeRedis:
+    # the redis-py calls RedisBackend makes, on a dict, with expiry on the given clock
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.values = {}
+        self.expires = {}
+
+    def live(self, key):
+        if key in self.expires and self.expires[key] <= self.clock():
+            self.delete(key)
+        return key in self.values
+
+    def get(self, key):
+        return self.values[key].encode('utf-8') if self.live(key) else None
+
+    def set(self, key, value, ex=None):
+        self.values[key] = str(value)
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = self.clock() + ex
+
+    def incr(self, key):
+        value = int(self.values[key]) + 1 if self.live(key) else 1
+        self.values[key] = str(value)
+        return value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.expires.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.values) if fnmatch.fnmatchcase(key, pattern)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request, clock):
+    if request.param == 'memory':
+        return MemoryBackend(max_entries=100, ttl=60)
+    return RedisBackend(FakeRedis(clock), ttl=60)
+
+
+def test_get_and_set(backend):
+    assert backend.get('page:a') is None
+    backend.set('page:a', '<html>a</html>')
+    backend.set('page:b', '<html>b</html>')
+    assert backend.get('page:a') == '<html>a</html>'
+    assert backend.get('page:b') == '<html>b</html>'
+    backend.set('page:a', '<html>A</html>')
+    assert backend.get('page:a') == '<html>A</html>'
+
+
+def test_pages_expire_after_their_ttl(backend, clock):
+    backend.set('page:default', 'x')
+    backend.set('page:longer', 'y', ttl=300)
+    clock.advance(59)
+    assert backend.get('page:default') == 'x'
+    clock.advance(2)
+    assert backend.get('page:default') is None
+    assert backend.get('page:longer') == 'y'
+    clock.advance(240)
+    assert backend.get('page:longer') is None
+
+
+def test_generations_count_up_and_clear(backend):
+    assert backend.counter('gen:venues') == 0
+    backend.incr('gen:venues')
+    backend.incr('gen:venues')
+    assert backend.counter('gen:venues') == 2
+    assert backend.counter('gen:artists') == 0
+    backend.set('page:venues:2:/venues?', 'x')
+    backend.clear()
+    assert backend.counter('gen:venues') == 0
+    assert backend.get('page:venues:2:/venues?') is None
+
+
+def test_memory_backend_evicts_the_least_recently_used(clock):
+    backend = MemoryBackend(max_entries=2, ttl=60)
+    backend.set('a', '1')
+    backend.set('b', '2')
+    backend.get('a')
+    backend.set('c', '3')
+    assert backend.get('b') is None
+    assert backend.get('a') == '1'
+    assert backend.get('c') == '3'
+
+
+@pytest.fixture
+def cached_client(client, backend, monkeypatch):
+    monkeypatch.setattr(page_cache, 'backend', backend)
+    monkeypatch.setattr(page_cache, 'hits', 0)
+    monkeypatch.setattr(page_cache, 'misses', 0)
+    add_listing(3, 3)
+    return client
+
+
+def served_from_cache(client, path):
+    hits, misses = page_cache.hits, page_cache.misses
+    response = client.get(path)
+    assert response.status_code == 200
+    response.get_data()
+    # a page with a pending flash message bypasses the cache
+    assert page_cache.hits + page_cache.misses == hits + misses + 1
+    return page_cache.hits > hits
+
+
+def test_pages_are_served_from_the_cache(cached_client):
+    for path in ('/venues', '/venues/1', '/shows?when=past'):
+        assert not served_from_cache(cached_client, path)
+        assert served_from_cache(cached_client, path)
+    assert not served_from_cache(cached_client, '/shows?when=upcoming')
+
+
+def test_invalidate_drops_only_its_namespace(app, cached_client):
+    for path in ('/venues', '/venues/1', '/venues/2'):
+        served_from_cache(cached_client, path)
+    with app.test_request_context():
+        page_cache.invalidate('venue:1')
+    assert not served_from_cache(cached_client, '/venues/1')
+    assert served_from_cache(cached_client, '/venues/2')
+    assert served_from_cache(cached_client, '/venues')
+
+
+def test_editing_a_venue_invalidates_the_pages_showing_it(cached_client):
+    # artists 2 and 3 played venue 1 (see add_listing), artist 1 didn't
+    for path in ('/venues', '/venues/1', '/venues/2', '/artists/2', '/artists/1'):
+        served_from_cache(cached_client, path)
+    response = cached_client.post('/venues/1/edit', data={
+        'name': 'Venue One', 'city': 'New York', 'state': 'NY', 'address': '1 Main Street',
+        'phone': '123-123-1234', 'genres': ['Jazz'], 'seeking_talent': 'No', 'seeking_description': '',
+        'image_link': '', 'website': '', 'facebook_link': ''
+    })
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/venues/1')
+    # the page redirected to shows the flash message, and so is rendered uncached
+    assert 'Venue One' in cached_client.get('/venues/1').get_data(as_text=True)
+
+    assert not served_from_cache(cached_client, '/venues')
+    assert not served_from_cache(cached_client, '/artists/2')
+    assert served_from_cache(cached_client, '/venues/2')
+    assert served_from_cache(cached_client, '/artists/1')
+    assert 'Venue One' in cached_client.get('/venues').get_data(as_text=True)
+
+
+def test_editing_a_venue_invalidates_the_calendars_showing_it(cached_client):
+    start_time = db.session.query(Show.start_time).filter(Show.venue_id == 1, Show.artist_id == 2).first()[0]
+    calendar = f'/artists/2/calendar/{start_time.year}/{start_time.month}'
+    assert not served_from_cache(cached_client, calendar)
+    assert served_from_cache(cached_client, calendar)
+    cached_client.post('/venues/1/edit', data={
+        'name': 'Venue One', 'city': 'New York', 'state': 'NY', 'address': '1 Main Street',
+        'phone': '123-123-1234', 'genres': ['Jazz'], 'seeking_talent': 'No', 'seeking_description': '',
+        'image_link': '', 'website': '', 'facebook_link': ''
+    }, follow_redirects=True)
+    assert not served_from_cache(cached_client, calendar)
+    assert 'Venue One' in cached_client.get(calendar).get_data(as_text=True)
@@ -0,0 +1,100 @@
+import pytest
+from flask import g
+from sqlalchemy import create_engine, event
+
+from app import db, page_cache, Venue
+from cache import MemoryBackend
+
+
+@pytest.fixture
+def routed(app, tmp_path, monkeypatch):
+    # a primary and a replica, two SQLite files whose only venue has a different name,
+    # as if the replica lagged behind. Returns the statements each one ran.
+    db.session.remove()
+    executed = {}
+    for name in ('primary', 'replica'):
+        engine = create_engine(f'sqlite:///{tmp_path / name}.db')
+        db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(Venue.__table__.insert().values(
+                id=1, name=f'{name.title()} Hall', city='Austin', state='TX', address='1 Main Street', phone='1231231234'
+            ))
+        executed[name] = []
+        event.listen(engine, 'before_cursor_execute',
+                     lambda connection, cursor, statement, *args, name=name: executed[name].append(statement))
+        monkeypatch.setitem(db.engines, None if name == 'primary' else 'replica', engine)
+    # read_your_writes only looks for a replica among the configured binds
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {'replica': 'sqlite://'})
+    yield executed
+    db.session.remove()
+    for engine in (db.engines[None], db.engines['replica']):
+        engine.dispose()
+
+
+def test_read_only_views_read_the_replica(client, routed):
+    for path in ('/venues', '/venues/1', '/venues/search?search_term=hall'):
+        page = client.get(path).get_data(as_text=True)
+        assert 'Replica Hall' in page
+        assert 'Primary Hall' not in page
+    assert routed['replica']
+    assert routed['primary'] == []
+
+
+def test_writes_and_flushes_go_to_the_primary(app, routed):
+    with app.test_request_context():
+        # inside a read-only view
+        g.use_replica = True
+        assert db.session.get_bind() is db.engines['replica']
+        db.session.add(Venue(name='New Hall', city='Austin', state='TX', address='2 Main Street', phone='1231231234'))
+        db.session.flush()
+        db.session.execute(db.update(Venue).where(Venue.id == 1).values(phone='3213214321'))
+        db.session.commit()
+    assert any(statement.startswith('INSERT INTO "Venue"') for statement in routed['primary'])
+    assert any(statement.startswith('UPDATE "Venue"') for statement in routed['primary'])
+    assert not any(statement.startswith(('INSERT', 'UPDATE')) for statement in routed['replica'])
+
+    with db.engines[None].connect() as connection:
+        assert connection.execute(db.select(db.func.count()).select_from(Venue)).scalar() == 2
+    with db.engines['replica'].connect() as connection:
+        assert connection.execute(db.select(Venue.phone)).scalars().all() == ['1231231234']
+
+
+def create_venue(client):
+    return client.post('/venues/create', data={
+        'name': 'New Hall', 'city': 'Austin', 'state': 'TX', 'address': '2 Main Street', 'phone': '123-123-1234',
+        'genres': ['Jazz'], 'seeking_talent': 'No', 'seeking_description': '', 'image_link': '', 'website': '',
+        'facebook_link': ''
+    }, follow_redirects=True)
+
+
+def test_reads_right_after_a_write_go_to_the_primary(client, routed):
+    response = create_venue(client)
+    assert 'Venue New Hall was successfully listed!' in response.get_data(as_text=True)
+    assert not any(statement.startswith('INSERT') for statement in routed['replica'])
+
+    # the pages after it, within READ_YOUR_WRITES_SECONDS
+    routed['replica'].clear()
+    page = client.get('/venues').get_data(as_text=True)
+    assert 'New Hall' in page
+    assert 'Primary Hall' in page
+    assert routed['replica'] == []
+
+    # once that is over the replica is read again
+    with client.session_transaction() as session:
+        session['read_primary_until'] = 0
+    page = client.get('/venues').get_data(as_text=True)
+    assert 'Replica Hall' in page
+    assert 'New Hall' not in page
+
+
+def test_reads_right_after_a_write_skip_the_page_cache(app, client, routed, monkeypatch):
+    monkeypatch.setattr(page_cache, 'backend', MemoryBackend())
+    create_venue(client)
+    # another client fills the cache again from the replica, which lags behind
+    other = app.test_client()
+    assert 'New Hall' not in other.get('/venues').get_data(as_text=True)
+    assert 'New Hall' in client.get('/venues').get_data(as_text=True)
+    # and what the writer read from the primary is not handed to the others
+    hits = page_cache.hits
+    assert 'New Hall' not in other.get('/venues').get_data(as_text=True)
+    assert page_cache.hits == hits + 1
@@ -0,0 +1,108 @@
+import html
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db, Show
+from conftest import add_listing
+
+
+@pytest.fixture
+def show_queries(app):
+    # (statement, parameters) of the paged show queries run while the test runs
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT "Show".id') and 'LIMIT' in statement:
+            executed.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def query_plan(statement, parameters):
+    with db.engine.connect() as connection:
+        return [row[3] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+def next_page(page):
+    match = re.search(r'<li class="next"><a href="([^"]+)"', page)
+    return html.unescape(match.group(1)) if match else None
+
+
+@pytest.mark.parametrize('path, index', [
+    ('/shows', 'ix_Show_start_time_id'),
+    ('/shows?when=past', 'ix_Show_start_time_id'),
+    ('/venues/1/shows?when=upcoming', 'ix_Show_venue_id_start_time'),
+    ('/venues/1/shows?when=past', 'ix_Show_venue_id_start_time'),
+    ('/artists/1/shows?when=upcoming', 'ix_Show_artist_id_start_time'),
+])
+def test_show_pages_read_an_index_in_order(client, show_queries, path, index):
+    # every page after the first one too: no scan of Show, no sort of what it read
+    add_listing(20, 20, shows_per_venue=40)
+    page = client.get(path)
+    if path.startswith('/shows'):
+        after = next_page(page.get_data(as_text=True))
+    else:
+        after = page.get_json()['next']
+    assert after is not None
+    client.get(after).get_data()
+
+    assert len(show_queries) == 2
+    for statement, parameters in show_queries:
+        plan = query_plan(statement, parameters)
+        assert any(f'SEARCH Show USING INDEX {index}' in step for step in plan), plan
+        assert not any('SCAN Show' in step or 'TEMP B-TREE' in step for step in plan), plan
+
+
+def test_show_page_plan_sorts_without_the_index(client, show_queries):
+    # what the test above rules out, so it can tell: without the index the page is sorted
+    add_listing(20, 20, shows_per_venue=40)
+    client.get('/shows').get_data()
+    db.session.execute(db.text('DROP INDEX "ix_Show_start_time_id"'))
+    db.session.commit()
+    plan = query_plan(*show_queries[0])
+    assert any('USE TEMP B-TREE FOR ORDER BY' in step for step in plan), plan
+
+
+@pytest.mark.parametrize('when', ['upcoming', 'past'])
+def test_show_list_pages_split_equal_start_times(client, monkeypatch, when):
+    # 25 shows starting at the same time over pages of 7: each listed once, in id order
+    monkeypatch.setitem(client.application.config, 'SHOWS_PER_PAGE', 7)
+    add_listing(1, 25, shows_per_venue=0)
+    start_time = datetime.now().replace(microsecond=0) + timedelta(days=3 if when == 'upcoming' else -3)
+    db.session.add_all(Show(venue_id=1, artist_id=artist_id, start_time=start_time) for artist_id in range(1, 26))
+    db.session.commit()
+
+    listed, path = [], f'/shows?when={when}'
+    while path:
+        page = client.get(path).get_data(as_text=True)
+        listed += [int(artist_id) for artist_id in re.findall(r'href="/artists/(\d+)"', page)]
+        path = next_page(page)
+    assert listed == list(range(1, 26) if when == 'upcoming' else range(25, 0, -1))
+
+
+@pytest.mark.parametrize('when', ['upcoming', 'past'])
+def test_detail_show_pages_split_equal_start_times(client, when):
+    # the same for the "load more" pages of a venue, DETAIL_SHOWS_PER_PAGE (12) at a time
+    add_listing(1, 30, shows_per_venue=0)
+    start_time = datetime.now().replace(microsecond=0) + timedelta(days=3 if when == 'upcoming' else -3)
+    db.session.add_all(Show(venue_id=1, artist_id=artist_id, start_time=start_time) for artist_id in range(1, 31))
+    db.session.commit()
+
+    listed, path = [], f'/venues/1/shows?when={when}'
+    while path:
+        page = client.get(path).get_json()
+        listed += [show['artist_id'] for show in page['shows']]
+        path = page['next']
+    assert listed == list(range(1, 31) if when == 'upcoming' else range(30, 0, -1))
+
+
+@pytest.mark.parametrize('path', ['/venues/1/calendar/1/1', '/venues/1/calendar/9999/1', '/artists/1/calendar/2024/13'])
+def test_calendars_out_of_range_are_not_found(client, path):
+    add_listing(1, 1)
+    assert client.get(path).status_code == 404
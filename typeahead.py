@@ -0,0 +1,185 @@
+import bisect
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+
+# In-memory prefix index over venue and artist names, for the /autocomplete typeahead.
+#
+# Every word of a name starts an entry, so "The Blue Owl" is found by "the b", "blue o"
+# and "owl". An entry is one 64 bit integer, id << 8 | offset of the word in the folded
+# name, and the entries are kept in a sorted array ordered by the folded name from that
+# offset on. A prefix is then a range found with one bisect, and no string is stored
+# beyond one folded copy of each name.
+#
+# Each worker builds its own index on its first request, in a background thread, and
+# applies the creates, edits and deletes it handles itself. Changes made by other
+# workers or `flask import` show up when the index is rebuilt, once it is older than
+# AUTOCOMPLETE_MAX_AGE. An index that would grow past AUTOCOMPLETE_MAX_BYTES is not
+# kept, the endpoint searches the database instead.
+
+# word offsets are stored in 8 bits, later words of very long names are not indexed
+MAX_OFFSET = 255
+
+
+def fold(text):
+    # lower case, accents and punctuation dropped, single spaces between words
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def word_offsets(folded):
+    return [0] + [i + 1 for i, c in enumerate(folded) if c == ' ' and i < MAX_OFFSET]
+
+
+class PrefixIndex:
+
+    def __init__(self, rows=()):
+        # rows are (id, name)
+        self.names = {}
+        self.folded = {}
+        keys = []
+        for owner_id, name in rows:
+            folded = fold(name)
+            self.names[owner_id], self.folded[owner_id] = name, folded
+            keys.extend(owner_id << 8 | offset for offset in word_offsets(folded))
+        keys.sort(key=self.key)
+        self.entries = array('q', keys)
+
+    def key(self, entry):
+        return self.folded[entry >> 8][entry & 0xFF:]
+
+    def add(self, owner_id, name):
+        # adds a name, or replaces the one the id had
+        self.remove(owner_id)
+        folded = fold(name)
+        self.names[owner_id], self.folded[owner_id] = name, folded
+        for offset in word_offsets(folded):
+            entry = owner_id << 8 | offset
+            self.entries.insert(bisect.bisect_left(self.entries, folded[offset:], key=self.key), entry)
+
+    def remove(self, owner_id):
+        folded = self.folded.get(owner_id)
+        if folded is None:
+            return
+        for offset in word_offsets(folded):
+            entry = owner_id << 8 | offset
+            position = bisect.bisect_left(self.entries, folded[offset:], key=self.key)
+            # entries with an equal key sit together, the one of this id is among them
+            while self.entries[position] != entry:
+                position += 1
+            del self.entries[position]
+        del self.names[owner_id], self.folded[owner_id]
+
+    def search(self, prefix, limit):
+        # [(id, name)] of up to limit names with a word starting with prefix, in the
+        # order of the text from that word on
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        found = {}
+        position = bisect.bisect_left(self.entries, prefix, key=self.key)
+        while position < len(self.entries) and len(found) < limit:
+            entry = self.entries[position]
+            if not self.key(entry).startswith(prefix):
+                break
+            found.setdefault(entry >> 8, self.names[entry >> 8])
+            position += 1
+        return list(found.items())
+
+    def size(self):
+        # approximate bytes held: the entries, both name copies and the dicts holding them
+        strings = sum(sys.getsizeof(name) for name in self.names.values()) + \
+            sum(sys.getsizeof(folded) for folded in self.folded.values())
+        return self.entries.itemsize * len(self.entries) + strings + sys.getsizeof(self.names) * 2
+
+
+class Typeahead:
+    # The indexes of a few kinds of names. loaders maps each kind (venues, artists) to a
+    # function returning its (id, name) rows, called with an app context.
+
+    def __init__(self, app=None, loaders=None):
+        self.indexes = None
+        self.built_at = 0
+        self.pending = None
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, loaders)
+
+    def init_app(self, app, loaders):
+        self.app = app
+        self.loaders = loaders
+        self.max_age = app.config.get('AUTOCOMPLETE_MAX_AGE', 300)
+        self.max_bytes = app.config.get('AUTOCOMPLETE_MAX_BYTES', 64 * 1024 * 1024)
+        app.before_request(self.warm)
+
+    def warm(self):
+        # starts the first build, or a rebuild of an index gone stale, without waiting for it
+        if (self.indexes is None or time.monotonic() - self.built_at > self.max_age) and not self.build_lock.locked():
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def build(self, wait=False):
+        # Reads every kind into new indexes and swaps them in. With wait, blocks until a
+        # build running in another thread is done, and only builds when none has yet.
+        if not self.build_lock.acquire(blocking=wait):
+            return
+        try:
+            if wait and self.indexes is not None:
+                return
+            with self.lock:
+                # changes made while the names are read are applied again afterwards
+                self.pending = []
+            indexes = {}
+            with self.app.app_context():
+                for kind, load in self.loaders.items():
+                    index = PrefixIndex(load())
+                    if index.size() > self.max_bytes:
+                        self.app.logger.warning(f'autocomplete: {kind} index over AUTOCOMPLETE_MAX_BYTES, not kept')
+                        index = None
+                    indexes[kind] = index
+            with self.lock:
+                for method, kind, args in self.pending:
+                    if indexes[kind] is not None:
+                        getattr(indexes[kind], method)(*args)
+                self.indexes, self.pending = indexes, None
+                self.built_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.pending = None
+            self.build_lock.release()
+
+    def index(self, kind):
+        # The index of a kind, waiting for the first build. None when over the ceiling.
+        if self.indexes is None:
+            self.build(wait=True)
+        return self.indexes[kind]
+
+    def search(self, kind, prefix, limit):
+        index = self.index(kind)
+        if index is None:
+            return None
+        with self.lock:
+            return index.search(prefix, limit)
+
+    def update(self, method, kind, *args):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((method, kind, args))
+            if self.indexes is not None and self.indexes.get(kind) is not None:
+                getattr(self.indexes[kind], method)(*args)
+
+    def add(self, kind, owner_id, name):
+        self.update('add', kind, owner_id, name)
+
+    def remove(self, kind, owner_id):
+        self.update('remove', kind, owner_id)
+
+    def stats(self):
+        with self.lock:
+            indexes = self.indexes or {}
+            return {kind: index and {'names': len(index.names), 'entries': len(index.entries), 'bytes': index.size()}
+                    for kind, index in indexes.items()}